@@ -1,98 +1,293 @@
 import streamlit as st
 import pandas as pd
 import io
+import hashlib
 from openpyxl.utils import get_column_letter
+from perf_monitor import perf_stage, render_perf_panel
+from df_transport import read_excel_sheets
+from dtype_optimizer import format_memory_report, optimize_sheets
+from time_slots import DAY_MINUTES, order_by_slot, slot_labels, spans_days
+from resolution import (ROUNDING, STAT_MEAN, STATISTICS, TARGET_POINTS, UP_STEP, UPSAMPLE_METHODS, UPSAMPLE_TARGETS,
+                        downsample, dst_hours, dst_labels, file_order_rows, infer_interval, split_statistics,
+                        upsample, upsample_labels)
+from data_quality import FILL_METHODS, FILL_NONE, build_report, can_fill, check_sheet, fill_gaps, needs_fill
+from convert_cache import get_convert_cache, sheet_fingerprints
+from series_store import render_store_ingest
+from forecasting import render_forecast_panel
+from exporters import (EXPORT_FORMATS, FORMAT_EXCEL, FORMAT_PARQUET, PARQUET_COMPRESSIONS, ExportResult,
+                       export_frames)
 
 # 设置网页标题
 st.set_page_config(page_title="电力数据格式转换工具", page_icon="⚡")
 
 st.title("⚡ 电力数据转换工具 (15min -> 1h)")
-st.markdown("上传Excel文件，自动完成：**15分转1小时均值** + **去色** + **格式美化**。")
+st.markdown("上传Excel文件，自动完成：**15分转1小时均值** + **去色** + **格式美化**。5分钟/30分钟数据及夏令时切换日 (92/100 点) 自动识别。"
+            "也可反向把小时数据展开为 15 分钟等更细的粒度。")
 
-# --- 核心处理函数 (修改为内存处理，不读写本地路径) ---
-def process_excel(uploaded_file):
-    # 读取上传的文件
-    all_sheets = pd.read_excel(uploaded_file, sheet_name=None, index_col=0)
+LAYOUT_MULTIINDEX = "多层表头 (每个 Sheet 一张表)"
+LAYOUT_SHEETS = "每个统计量一个 Sheet"
+MODE_DOWN = "降采样 (如 15分钟 → 1小时)"
+MODE_UP = "升采样 (如 1小时 → 15分钟)"
+
+# --- 单个 Sheet 的转换：返回 (kind, 表, 质量报告行)，kind 为 "hourly" (转换后的表) 或 "raw" (原表) ---
+# 选择多个统计量时，降采样后的表为两层表头 (原列, 统计量)；目标比源更细时按 method 升采样
+def convert_sheet(sheet_name, df, fill_method=FILL_NONE, target_points=24, stats=(STAT_MEAN,), decimals=0,
+                  method=UP_STEP):
+    # 行标签为跨多天的完整时间戳：只支持单日时段表，原样保留并在质量报告中说明 (不能只转换首日)
+    if spans_days(df.index):
+        return "raw", df, [{"Sheet": sheet_name, "列": "(全部)", "时段行数": len(df), "缺失时段": "", "重复时段": "",
+                            "空值": 0, "负值": 0, "离群值": 0,
+                            "提示": "时间戳跨越多天，每个 Sheet 只能是一天的数据，已原样保留"}]
+    # 0. 由时刻标签推断源粒度 (5/15/30 分钟 -> 288/96/48 点)
+    interval = infer_interval(df.index)
+    if interval is None:
+        return "raw", df, [] # 没有时段行 (说明页等)，不做检查
+    points = DAY_MINUTES // interval
+    upsampling = target_points > points
+    if points == target_points or max(points, target_points) % min(points, target_points):
+        return "raw", df, [] # 已是目标粒度，或无法整数倍转换
+    ratio = target_points // points if upsampling else points // target_points
+
+    # 1. 数据清洗 (同之前的逻辑)
+    with perf_stage("清洗时间行", sheet=sheet_name):
+        # 行标签经预建的时段查找表一次 map 得到整数时段号：
+        # 非时段行 (标题/合计等) 被过滤，排序按时段号而不是字符串 ("0:15" 与 "10:00" 不再错排)
+        df_clean, slots = order_by_slot(df, points=points)
+
+    # 1.1 质量检查：缺失/重复时段、空值、负值、离群值、夏令时日
+    with perf_stage("质量检查", sheet=sheet_name):
+        report = check_sheet(sheet_name, df_clean, slots, points=points)
+
+    # 1.2 可选补缺：整表一次性补齐缺失时段和空值
+    if fill_method != FILL_NONE and needs_fill(df_clean, slots, points) and can_fill(df_clean, slots, points):
+        with perf_stage("补缺", sheet=sheet_name):
+            df_clean, slots = fill_gaps(df_clean, slots, points=points, method=fill_method)
+        for row in report:
+            row["提示"] = f"{row['提示']}；已{fill_method}补齐" if row["提示"] else f"已{fill_method}补齐"
+
+    # 2'. 升采样 (如 24 -> 96)：每个时段展开为 ratio 个细时段，所有列一次完成，3. 取整
+    if upsampling:
+        with perf_stage(f"{points}->{target_points}展开", sheet=sheet_name, method=method):
+            if len(df_clean) == points and len(pd.unique(slots)) == points:
+                df_fine = upsample(df_clean, ratio, slot_labels(target_points), method, decimals=decimals)
+            elif dst_hours(len(df_clean), points):
+                # 夏令时切换日 (23/25 小时)：按文件中的行顺序展开
+                df_rows, row_slots = file_order_rows(df, points)
+                df_fine = upsample(df_rows, ratio, upsample_labels(row_slots, ratio, points), method,
+                                   decimals=decimals)
+            else:
+                return "raw", df, report
+            df_fine.index.name = "时间"
+        return "hourly", df_fine, report
+
+    # 2. 计算均值等统计量 (连续 ratio 个时段一组，如 96 -> 24 为每 4 点一组)，3. 取整
+    source_labels = pd.Index(slot_labels(points))
+    with perf_stage(f"{points}->{target_points}聚合", sheet=sheet_name, stats=len(stats)):
+        if len(df_clean) == points and len(pd.unique(slots)) == points:
+            df_hourly = downsample(df_clean, ratio, slot_labels(target_points), stats, # 01:00 ... 24:00
+                                   source_labels[slots], decimals)
+        elif dst_hours(len(df_clean), points) and len(df_clean) % ratio == 0:
+            # 夏令时切换日 (如 92/100 点)：按文件中的行顺序分组，得到 23/25 个时段
+            df_rows, row_slots = file_order_rows(df, points)
+            df_hourly = downsample(df_rows, ratio, dst_labels(row_slots, ratio, points), stats,
+                                   source_labels[row_slots], decimals)
+        else:
+            # 如果行数不对 (或有重复时段)，原样写入
+            return "raw", df, report
+        df_hourly.index.name = "时间"
+    return "hourly", df_hourly, report
+
+
+# --- 按输出布局展开：多统计量的表可拆成每个统计量一个 Sheet ---
+def output_frames(order, results, layout=LAYOUT_MULTIINDEX):
+    """返回 [(输出 Sheet 名, kind, 表)]"""
+    frames = []
+    for sheet_name in order:
+        kind, frame, _ = results[sheet_name]
+        parts = split_statistics(frame) if kind == "hourly" and layout == LAYOUT_SHEETS else {None: frame}
+        for stat, part in parts.items():
+            # Excel 的 Sheet 名最长 31 个字符：截断原名，保留统计量后缀
+            name = sheet_name if stat is None else f"{sheet_name[:30 - len(stat)]}_{stat}"
+            frames.append((name, kind, part))
+    return frames
+
+# --- 写入 Sheet 并美化格式 ---
+def write_sheet(writer, sheet_name, kind, df):
+    # 4. 写入 Sheet
+    with perf_stage("写入Sheet", sheet=sheet_name):
+        df.to_excel(writer, sheet_name=sheet_name)
+    if kind != "hourly":
+        return
+    
+    # 5. 美化格式
+    with perf_stage("美化格式", sheet=sheet_name):
+        worksheet = writer.sheets[sheet_name]
+        worksheet.freeze_panes = 'B2' if df.columns.nlevels == 1 else 'B4' # 冻结 (两层表头另有一行索引名)
+        
+        # 自适应列宽
+        for column in worksheet.columns:
+            max_length = 0
+            column_letter = get_column_letter(column[0].column)
+            for cell in column:
+                try:
+                    if cell.value:
+                        cell_len = len(str(cell.value))
+                        if cell_len > max_length: max_length = cell_len
+                except: pass
+            worksheet.column_dimensions[column_letter].width = (max_length + 2) * 1.1
+
+# --- 核心处理函数 (修改为内存处理，不读写本地路径)：返回 (导出文件, {Sheet 名: 转换后的表}, 质量报告) ---
+def process_excel(uploaded_file, incremental=False, export_format=FORMAT_EXCEL, compression="zstd",
+                  fill_method=FILL_NONE, target_points=24, stats=(STAT_MEAN,), decimals=0,
+                  layout=LAYOUT_MULTIINDEX, method=None):
+    raw = uploaded_file.getvalue()
+    target_label = {24: "1小时", 48: "30分钟", 96: "15分钟", 288: "5分钟"}.get(target_points, f"{target_points}点")
+    stats = tuple(stats) or (STAT_MEAN,)
+    kind_label = "均值" if stats == (STAT_MEAN,) else "统计"
+    if method is not None:
+        kind_label = method  # 升采样模式以展开方法命名，如 "_15分钟线性插值版"
+    else:
+        method = UP_STEP
+    new_name = f"{uploaded_file.name.split('.')[0]}_{target_label}{kind_label}版"
+    results = {}  # sheet_name -> (kind, DataFrame, 质量报告行)
+
+    # 增量模式：按 Sheet 原始内容取指纹，命中缓存的 Sheet 不再解析和重算
+    fingerprints = sheet_fingerprints(raw) if incremental else None
+    sheets_to_read = None
+    if fingerprints is not None:
+        cache = get_convert_cache()
+        with perf_stage("增量比对"):
+            for sheet_name, fingerprint in fingerprints.items():
+                hit = cache.get(cache.key(fingerprint, fill_method, target_points, stats, decimals, method))
+                if hit is not None:
+                    results[sheet_name] = hit
+        sheets_to_read = [name for name in fingerprints if name not in results]
+        st.caption(f"♻️ 增量模式：复用 {len(results)} 个 Sheet，重新转换 {len(sheets_to_read)} 个")
+    elif incremental:
+        st.caption("♻️ 该文件格式无法按 Sheet 比对，本次全量转换")
+
+    # 读取上传的文件 (Sheet 较多时在子进程中并行解析，经共享内存取回)
+    with perf_stage("读取Excel"):
+        all_sheets = read_excel_sheets(raw, sheet_names=sheets_to_read, index_col=0)
+    # 压缩列类型 (重复文本 -> category、int64 -> int32；浮点列保持 float64 以免精度损失)
+    # 读入的原表只读不写，可以用 category
+    with perf_stage("类型压缩"):
+        memory_report = {}
+        all_sheets = optimize_sheets(all_sheets, memory_report, categories=True)
+    if all_sheets:
+        st.caption(f"📉 {format_memory_report(memory_report)}")
+
+    for sheet_name, df in all_sheets.items():
+        try:
+            results[sheet_name] = convert_sheet(sheet_name, df, fill_method, target_points, stats, decimals, method)
+        except Exception as e:
+            st.error(f"Sheet [{sheet_name}] 处理出错: {e}")
+            results[sheet_name] = ("raw", df, []) # 出错保底 (不进缓存，下次重试)
+            continue
+        if fingerprints is not None:
+            cache.put(cache.key(fingerprints[sheet_name], fill_method, target_points, stats, decimals, method), results[sheet_name])
     
+    # 按原工作簿顺序合并新旧结果
+    order = list(fingerprints) if fingerprints is not None else list(all_sheets)
+
+    # 质量报告 (命中缓存的 Sheet 使用缓存时的检查结果)
+    report = build_report([row for name in order for row in results[name][2]])
+    converted = {name: results[name][1] for name in order if results[name][0] == "hourly"}
+
+    # Parquet / Feather / CSV：不做 Excel 美化，多个 Sheet 各一个文件打包为 zip
+    if export_format != FORMAT_EXCEL:
+        with perf_stage("导出文件", format=export_format):
+            return export_frames({name: frame for name, _, frame in output_frames(order, results, layout)},
+                                 export_format, new_name,
+                                 index=True, compression=compression), converted, report
+
     # 创建一个内存缓冲区来存放结果 Excel
     output = io.BytesIO()
     
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        for sheet_name, df in all_sheets.items():
+    with perf_stage("生成Excel"), pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for sheet_name, kind, frame in output_frames(order, results, layout):
             try:
-                # 1. 数据清洗 (同之前的逻辑)
-                df.index = df.index.astype(str)
-                # 过滤掉不含冒号或包含中文'点'的行
-                condition = df.index.str.contains(':') & ~df.index.str.contains('点')
-                df_clean = df[condition].copy()
-                df_clean.sort_index(inplace=True)
-
-                if len(df_clean) != 96:
-                    # 如果行数不对，原样写入
-                    df.to_excel(writer, sheet_name=sheet_name)
-                    continue
-
-                # 2. 计算均值 (96 -> 24)
-                group_ids = [i // 4 for i in range(len(df_clean))]
-                df_hourly = df_clean.groupby(group_ids).mean()
-                
-                new_index = [f"{h:02d}:00" for h in range(1, 25)]
-                df_hourly.index = new_index
-                df_hourly.index.name = "时间"
-
-                # 3. 取整
-                df_hourly = df_hourly.fillna(0).round(0).astype(int)
-                
-                # 4. 写入 Sheet
-                df_hourly.to_excel(writer, sheet_name=sheet_name)
-                
-                # 5. 美化格式
-                worksheet = writer.sheets[sheet_name]
-                worksheet.freeze_panes = 'B2' # 冻结
-                
-                # 自适应列宽
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = get_column_letter(column[0].column)
-                    for cell in column:
-                        try:
-                            if cell.value:
-                                cell_len = len(str(cell.value))
-                                if cell_len > max_length: max_length = cell_len
-                        except: pass
-                    worksheet.column_dimensions[column_letter].width = (max_length + 2) * 1.1
-
+                write_sheet(writer, sheet_name, kind, frame)
             except Exception as e:
                 st.error(f"Sheet [{sheet_name}] 处理出错: {e}")
-                df.to_excel(writer, sheet_name=sheet_name) # 出错保底
+                if sheet_name in all_sheets:
+                    all_sheets[sheet_name].to_excel(writer, sheet_name=sheet_name) # 出错保底
+
+    return ExportResult(output.getvalue(), f"{new_name}.xlsx",
+                        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"), converted, report
 
-    # 指针回到开始位置
-    output.seek(0)
-    return output
+def render_quality_report(report):
+    if len(report):
+        with st.expander(f"🩺 数据质量报告 ({report['Sheet'].nunique()} 个 Sheet 有问题)", expanded=True):
+            st.dataframe(report, use_container_width=True, hide_index=True)
+    else:
+        st.caption("🩺 数据质量检查：未发现问题")
 
 # --- 网页交互逻辑 ---
+incremental = st.toggle("♻️ 增量模式 (只重新转换新增或变化的 Sheet)", value=True)
+fmt_col, comp_col = st.columns(2)
+with fmt_col:
+    export_format = st.selectbox("输出格式", EXPORT_FORMATS)
+with comp_col:
+    compression = st.selectbox("Parquet 压缩", PARQUET_COMPRESSIONS, disabled=export_format != FORMAT_PARQUET)
+mode = st.radio("转换方向", [MODE_DOWN, MODE_UP], horizontal=True)
+stat_col, round_col = st.columns(2)
+if mode == MODE_UP:
+    target_points = UPSAMPLE_TARGETS[st.selectbox("目标粒度 (源粒度按时刻标签自动识别)", list(UPSAMPLE_TARGETS))]
+    with stat_col:
+        method = st.selectbox("展开方法", UPSAMPLE_METHODS,
+                              help="阶梯保持/保均值曲线：每小时均值与原值一致；线性插值/三次样条：曲线经过各整点的值")
+    stats = [STAT_MEAN]
+else:
+    target_points = TARGET_POINTS[st.selectbox("目标粒度 (源粒度按时刻标签自动识别)", list(TARGET_POINTS))]
+    with stat_col:
+        stats = st.multiselect("统计量 (一次读取同时计算)", STATISTICS, default=[STAT_MEAN],
+                               help="结算用均值、调度用最大值、计费用合计；峰值时刻为组内最大值出现的时刻")
+    method = None
+with round_col:
+    decimals = ROUNDING[st.selectbox("取整", list(ROUNDING), help="整数时空值按 0 输出")]
+layout = LAYOUT_MULTIINDEX
+if len(stats) > 1:
+    layout = st.radio("多个统计量的输出方式", [LAYOUT_MULTIINDEX, LAYOUT_SHEETS], horizontal=True)
+fill_method = st.selectbox("缺口填补 (缺失时段/空值)", FILL_METHODS,
+                           help="不填补时，时段不完整的 Sheet 原样写入；92/100 点的夏令时切换日不做填补")
 uploaded_file = st.file_uploader("请将Excel文件拖拽到此处", type=["xlsx", "xls"])
 
 if uploaded_file is not None:
-    st.info("正在处理数据，请稍候...")
-    
     try:
-        # 调用处理函数
-        processed_data = process_excel(uploaded_file)
+        # 文件和参数都没变时 (如只是点了侧边栏或时序库按钮触发的重跑) 直接复用上次的结果
+        options = (incremental, export_format, compression, fill_method, target_points, tuple(stats), decimals,
+                   layout, method)
+        run_key = (hashlib.blake2b(uploaded_file.getvalue(), digest_size=16).hexdigest(), options)
+        last_run = st.session_state.get("last_convert")
+        if last_run is not None and last_run[0] == run_key:
+            result, converted, report = last_run[1]
+        else:
+            st.info("正在处理数据，请稍候...")
+            # 调用处理函数
+            with perf_stage("整体转换"):
+                result, converted, report = process_excel(uploaded_file, incremental=incremental,
+                                       export_format=export_format, compression=compression, fill_method=fill_method, target_points=target_points,
+                                       stats=stats, decimals=decimals, layout=layout, method=method)
+            st.session_state["last_convert"] = (run_key, (result, converted, report))
+        render_quality_report(report)
         
         st.success("✅ 处理完成！点击下方按钮下载。")
         
-        # 生成新文件名
-        original_name = uploaded_file.name.split('.')[0]
-        new_name = f"{original_name}_1小时均值版.xlsx"
-        
-        # 下载按钮
+        # 下载按钮 (文件名: 原文件名_1小时均值版 + 对应扩展名)
         st.download_button(
-            label="📥 下载处理后的Excel",
-            data=processed_data,
-            file_name=new_name,
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            label="📥 下载处理结果",
+            data=result.data,
+            file_name=result.file_name,
+            mime=result.mime
         )
+        # 转换结果存入本地时序库，之后可按站点/日期范围跨文件查询 (Sheet 名含日期时按 Sheet 日期入库)
+        render_store_ingest(converted, default_station=uploaded_file.name.split('.')[0])
         
     except Exception as e:
-        st.error(f"处理失败: {e}")
\ No newline at end of file
+        st.error(f"处理失败: {e}")
+
+# 时序库里已有的站点可以直接做次日预测 (不依赖本次上传)
+render_forecast_panel()
+
+render_perf_panel()
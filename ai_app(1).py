@@ -1,11 +1,21 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
 import io
-import re
-import math
-import datetime
-from openai import OpenAI
+from perf_monitor import perf_stage, render_perf_panel
+from data_store import get_data_store, switch_sheet
+from sandbox_pool import run_in_sandbox
+from data_preview import render_data_preview
+from dtype_optimizer import format_memory_report
+from exporters import export_frames_cached, render_export_options
+from series_store import render_store_ingest
+from charts import render_chart_panel
+from header_layout import HEADER_SINGLE, read_excel_layout, read_header_levels, render_header_options
+from workspace import checkpoint_workspace, render_workspace_panel, restore_workspace
+from load_analytics import render_load_report
+from exec_env import HELPER_PROMPT
+from llm_async import chat_completion, get_llm_loop, openai_client, wait_with_status
+from csv_reader import read_csv_upload, render_csv_options
+from perf_lint import analyze_code, estimated_seconds, format_findings, needs_rewrite, vectorize_request
 
 # ================= 1. 配置区域 =================
 # 务必确保 .streamlit/secrets.toml 中配置了 DEEPSEEK_API_KEY
@@ -16,57 +26,29 @@ else:
     st.stop()
 
 BASE_URL = "https://api.deepseek.com"
-client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
+client = openai_client(API_KEY, BASE_URL)  # 异步客户端，请求在后台事件循环中进行
 
 st.set_page_config(page_title="AI 能源数据分析台 (V28 全能版)", layout="wide")
 
-# ================= 2. 核心清洗引擎 (不依赖 AI 的硬逻辑) =================
+# 进程级共享数据仓库：all_sheets / history 只保存句柄 (DataHandle)
+store = get_data_store()
 
-def clean_energy_time(series):
-    """
-    【万能时间清洗器】
-    1. 能识别 '2026-01-01 24:00:00' -> 转为次日 00:00
-    2. 能识别纯时间 '24:00' -> 暂时保留或标记
-    3. 极其强健，不会因为一个错导致全盘崩溃
-    """
-    def parse_single_val(val):
-        s_val = str(val).strip()
-        # 针对电力行业特殊的 24:00 处理
-        if "24:00" in s_val:
-            # 将 24:00 替换为 00:00
-            temp_s = s_val.replace("24:00", "00:00")
-            try:
-                dt = pd.to_datetime(temp_s)
-                # 如果是包含日期的完整时间 (如 2026-01-01 24:00)，则加一天
-                if len(s_val) > 8: 
-                    return dt + pd.Timedelta(days=1)
-                # 如果只是纯时间 (如 24:00)，先返回 00:00 (后续逻辑需配合日期处理)
-                return dt
-            except:
-                return pd.NaT
-        else:
-            # 正常时间
-            try:
-                return pd.to_datetime(val)
-            except:
-                return pd.NaT
+# ================= 2. 核心清洗引擎 (不依赖 AI 的硬逻辑) =================
 
-    # 优先尝试高速批量转换
-    try:
-        return pd.to_datetime(series)
-    except:
-        # 失败则进入逐行清洗模式
-        return series.apply(parse_single_val)
+# clean_energy_time 定义在 exec_env 中，沙箱子进程与各 App 共用同一份
 
 # ================= 3. 全局状态管理 =================
+# 工作区检查点：重启 / 断线重连后按 URL 中的工作区编号恢复 (须在默认值初始化之前)
+restore_workspace("ai_app_v28")
+
 # 初始化所有 Session State，防止报错
 keys = ["current_df", "chat_history", "file_hash", "macros", 
         "last_successful_code", "last_successful_explanation", 
-        "all_sheets", "current_sheet_name", "history"]
+        "all_sheets", "current_sheet_name", "history", "header_levels"]
 
 for key in keys:
     if key not in st.session_state:
-        if key == "macros" or key == "all_sheets": st.session_state[key] = {}
+        if key in ["macros", "all_sheets", "header_levels"]: st.session_state[key] = {}
         elif key in ["chat_history", "history"]: st.session_state[key] = []
         elif key == "current_sheet_name": st.session_state[key] = ""
         else: st.session_state[key] = None
@@ -84,21 +66,33 @@ with st.sidebar:
     st.divider()
     st.header("📂 文件上传区")
     uploaded_file = st.file_uploader("上传 Excel/CSV (支持宽表/窄表)", type=["xlsx", "xls", "csv"])
+    header_mode = render_header_options()
+    csv_options = render_csv_options()
     
     if uploaded_file:
-        current_hash = hash(uploaded_file.getvalue())
+        current_hash = hash((uploaded_file.getvalue(), header_mode, csv_options))
         if st.session_state.file_hash != current_hash:
             try:
-                if uploaded_file.name.endswith('.csv'):
-                    all_sheets = {'Sheet1': pd.read_csv(uploaded_file)}
-                else:
-                    all_sheets = pd.read_excel(uploaded_file, sheet_name=None)
+                def parse_upload():
+                    if uploaded_file.name.endswith('.csv'):
+                        # pyarrow 引擎 + 类型提示；可选列裁剪 / 流式 96->24 聚合
+                        return {'Sheet1': read_csv_upload(uploaded_file, csv_options)}
+                    # 双层表头：表头两行拼成扁平列名 "上层_下层"，层级映射另存，导出 Excel 时还原
+                    return read_excel_layout(uploaded_file, header_mode)
+
+                # 同一份文件已被其他会话上传过时直接复用，不再重复解析
+                memory_report = {}
+                with perf_stage("读取文件"):
+                    all_sheets = store.load_upload(uploaded_file.getvalue(), parse_upload, uploaded_file.name.endswith('.csv'), header_mode,
+                                                   csv_options, report=memory_report)
+                two_level = header_mode != HEADER_SINGLE and not uploaded_file.name.endswith('.csv')
+                st.session_state.header_levels = read_header_levels(uploaded_file.getvalue()) if two_level else {}
                 
                 st.session_state.all_sheets = all_sheets
                 st.session_state.file_hash = current_hash
                 first_sheet = list(all_sheets.keys())[0]
                 st.session_state.current_sheet_name = first_sheet
-                st.session_state.current_df = all_sheets[first_sheet].copy()
+                st.session_state.current_df = all_sheets[first_sheet].get()
                 st.session_state.chat_history = [] 
                 st.session_state.history = [] 
                 st.session_state.last_successful_code = None
@@ -106,7 +100,7 @@ with st.sidebar:
                 # 初始欢迎语
                 st.session_state.chat_history.append({
                     "role": "assistant", 
-                    "content": f"✅ **{uploaded_file.name}** 加载成功。\n\n我已准备好处理 **24:00** 格式数据，无论是宽表（日期在表头）还是长表（日期在列），我都能自动识别。"
+                    "content": f"✅ **{uploaded_file.name}** 加载成功。\n\n我已准备好处理 **24:00** 格式数据，无论是宽表（日期在表头）还是长表（日期在列），我都能自动识别。\n\n📉 {format_memory_report(memory_report)}"
                 })
                 st.rerun()
             except Exception as e:
@@ -120,10 +114,17 @@ with st.sidebar:
         except: curr_idx = 0
         sel_sheet = st.selectbox("当前工作表", sheet_names, index=curr_idx)
         if sel_sheet != st.session_state.current_sheet_name:
+            with perf_stage("切换工作表"):
+                # 本应用切换时不保留旧表上的修改 (keep=False)
+                st.session_state.current_df = switch_sheet(store, st.session_state.all_sheets,
+                                                           st.session_state.current_sheet_name,
+                                                           st.session_state.current_df, sel_sheet, keep=False)
             st.session_state.current_sheet_name = sel_sheet
-            st.session_state.current_df = st.session_state.all_sheets[sel_sheet].copy()
             st.session_state.history = []
             st.rerun()
+
+    st.toggle("🐢 慢代码先要求 AI 向量化", value=True, key="auto_vectorize",
+              help="执行前静态检查 iterrows / apply(axis=1) / 循环内 concat 等写法，按数据量估计耗时过长时先让 AI 改写")
             
     if st.button("🔥 重置工作区", type="primary"):
         st.session_state.file_hash = None
@@ -132,10 +133,18 @@ with st.sidebar:
     # 结果下载
     if st.session_state.current_df is not None:
         st.divider()
-        out = io.BytesIO()
-        with pd.ExcelWriter(out, engine='openpyxl') as writer:
-            st.session_state.current_df.to_excel(writer, index=True)
-        st.download_button("📥 下载当前结果", out.getvalue(), "Result.xlsx")
+        export_format, compression = render_export_options()
+        with perf_stage("导出文件", format=export_format):
+            export = export_frames_cached({"Sheet1": st.session_state.current_df}, export_format, "Result",
+                                   index=True, compression=compression, header_levels=st.session_state.header_levels)
+        st.download_button("📥 下载当前结果", export.data, export.file_name, mime=export.mime)
+        render_store_ingest({st.session_state.current_sheet_name or "Sheet1": st.session_state.current_df})
+
+    # 状态有变化时后台写检查点 (file_hash 不保存：重新上传即开始新工作)
+    checkpoint_workspace("ai_app_v28", [k for k in keys if k != "file_hash"],
+                         f"{st.session_state.current_sheet_name} · {len(st.session_state.history)} 步")
+    render_workspace_panel("ai_app_v28")
+    render_perf_panel()
 
 # ================= 5. 主界面 (数据展示与交互) =================
 st.title("⚡ AI 能源数据分析台 (V28)")
@@ -149,14 +158,16 @@ c1, c2 = st.columns([1, 6])
 with c1: 
     if st.button("↩️ 撤销"):
         if st.session_state.history:
-            st.session_state.current_df = st.session_state.history.pop()
+            st.session_state.current_df = st.session_state.history.pop().get()
             st.rerun()
 with c2: 
     st.success(f"当前数据形状: {st.session_state.current_df.shape} | 列: {list(st.session_state.current_df.columns)[:5]}...")
 
 # 数据预览
-with st.expander("📊 数据预览 (前 5 行)", expanded=True):
-    st.dataframe(st.session_state.current_df.head(5), use_container_width=True)
+with st.expander("📊 数据预览 (分页)", expanded=True):
+    render_data_preview(st.session_state.current_df, key="preview")
+render_load_report(st.session_state.current_df)
+render_chart_panel(st.session_state.current_df)
 
 # 聊天记录显示
 for msg in st.session_state.chat_history:
@@ -172,20 +183,16 @@ def get_dataframe_info(df):
 if user_prompt := st.chat_input("请输入指令 (例如: 转成96点，注意表头是日期)..."):
     # 记录用户输入
     st.session_state.chat_history.append({"role": "user", "content": user_prompt})
-    st.session_state.history.append(st.session_state.current_df.copy())
+    # current_df 只会被整体替换、不会原地修改，撤销栈里存句柄即可
+    with perf_stage("备份"):
+        st.session_state.history.append(store.put(st.session_state.current_df))
     with st.chat_message("user"): st.markdown(user_prompt)
     
     with st.chat_message("assistant"):
         status = st.status(f"🧠 AI ({selected_model}) 正在思考...", expanded=True)
         
-        # 注入全局变量，让 AI 可以直接调用 pandas 和我们的清洗函数
-        execution_globals = {
-            "pd": pd, "np": np, "re": re, "math": math, "datetime": datetime,
-            "clean_energy_time": clean_energy_time 
-        }
-        
         # --- V28 System Prompt: 针对宽表和 24:00 的专项训练 ---
-        system_prompt = """
+        system_prompt = f"""
         You are an Expert Python Data Scientist in the Energy Sector.
         
         【Critical: Handling Input Structure (Wide vs Long)】
@@ -202,9 +209,13 @@ if user_prompt := st.chat_input("请输入指令 (例如: 转成96点，注意
         - NEVER use `pd.to_datetime()` directly on energy data.
         - ALWAYS use `clean_energy_time(series)` provided in the environment.
         - This function automatically handles "24:00" -> "Next Day 00:00".
+        - For time-of-day labels only (no dates), use `time_slots` (see Built-in Helpers).
         
+        【Built-in Helpers (already available)】
+{HELPER_PROMPT}
         【Critical: Output Formatting】
         - If the user asks for "96 points" or "resampling", perform the calculation using the cleaned datetime index.
+        - For hourly -> 15-minute (24 -> 96 points) use `upsample_points`; for wide tables with dates in headers, melt/pivot so rows are times first.
         - **MANDATORY FINAL STEP**: If the user wants to see "24:00", you must convert the final DatetimeIndex back to String.
         - Logic: Convert to string, identify rows where time is "00:00:00" (which implies next day in energy terms), change string to "24:00:00", and shift date string back one day if needed (or just ensure the display looks like the original date + 24:00).
         
@@ -212,9 +223,10 @@ if user_prompt := st.chat_input("请输入指令 (例如: 转成96点，注意
         Write a function `def process_step(df):` that returns the processed DataFrame.
         """
         
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"""
+        with perf_stage("构建Prompt"):
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"""
             [Data Info]
             {get_dataframe_info(st.session_state.current_df)}
             
@@ -227,10 +239,10 @@ if user_prompt := st.chat_input("请输入指令 (例如: 转成96点，注意
             [Goal]
             1. Detect if it's Wide Format (Dates in headers). If yes, melt/unpivot first.
             2. Fix "24:00" using clean_energy_time.
-            3. Resample/Interpolate to 96 points (00:15 to 24:00).
+            3. Resample/Interpolate to 96 points (00:15 to 24:00) with `upsample_points` (no row loops).
             4. Ensure final output clearly shows "24:00" if requested, matching industry norms.
-            """}
-        ]
+                """}
+            ]
         
         success = False
         generated_code = ""
@@ -240,12 +252,14 @@ if user_prompt := st.chat_input("请输入指令 (例如: 转成96点，注意
             try:
                 if i > 0: status.write(f"🔧 自动修正代码 (第 {i} 次)...")
                 
-                response = client.chat.completions.create(
-                    model=selected_model,
-                    messages=messages,
-                    temperature=0.1
-                )
-                code = response.choices[0].message.content
+                # 请求在途时页面继续刷新状态 (已等待秒数)
+                with perf_stage("LLM调用", model=selected_model, attempt=i):
+                    code = wait_with_status(get_llm_loop().submit(chat_completion(
+                        client,
+                        model=selected_model,
+                        messages=messages,
+                        temperature=0.1
+                    )), status, f"🧠 AI ({selected_model}) 正在思考...")
                 # 提取代码块
                 if "```python" in code:
                     code = code.split("```python")[1].split("```")[0].strip()
@@ -253,21 +267,25 @@ if user_prompt := st.chat_input("请输入指令 (例如: 转成96点，注意
                     code = code.split("```")[1].split("```")[0].strip()
                 
                 generated_code = code
-                local_scope = {}
-                
-                # 执行代码
-                exec(code, execution_globals, local_scope)
-                
-                if 'process_step' not in local_scope: 
-                    raise ValueError("生成的代码中未找到 process_step 函数")
+
+                # 执行前的性能静态检查：估计过慢时先占用一次重试机会要求 AI 改写
+                shape = st.session_state.current_df.shape
+                findings = analyze_code(code, shape)
+                if st.session_state.get("auto_vectorize", True) and i < 2 and needs_rewrite(findings):
+                    status.write(f"🐢 预计耗时 ~{estimated_seconds(findings):.0f}s，要求 AI 改写为向量化代码...")
+                    messages.append({"role": "assistant", "content": code})
+                    messages.append({"role": "user", "content": vectorize_request(findings, shape)})
+                    continue
                 
-                # 调用处理函数
-                new_df = local_scope['process_step'](st.session_state.current_df.copy())
+                # 在沙箱子进程中执行代码 (已注入 pandas 和 clean_energy_time 等清洗函数)
+                with perf_stage("沙箱执行", attempt=i):
+                    step = run_in_sandbox(code, st.session_state.current_df)
+                new_df = step.value
+                perf_note = format_findings(findings, step.timings.get("process_step"), shape)
                 
-                # 结果校验
+                # 结果校验 (Styler 已在沙箱内剥离为 .data)
                 if not isinstance(new_df, pd.DataFrame): 
-                    if hasattr(new_df, 'data'): new_df = new_df.data
-                    else: raise ValueError("函数返回的不是 DataFrame")
+                    raise ValueError("函数返回的不是 DataFrame")
 
                 st.session_state.current_df = new_df
                 st.session_state.last_successful_code = code
@@ -278,8 +296,9 @@ if user_prompt := st.chat_input("请输入指令 (例如: 转成96点，注意
                 st.markdown(f"**✅ 执行完成**")
                 st.markdown(f"> 结果数据: {new_df.shape} 行列")
                 st.markdown(f"> *已自动识别表格结构并修正 24:00 时间点*")
+                st.markdown(perf_note)
                 
-                st.session_state.chat_history.append({"role": "assistant", "content": f"✅ 处理完成。结果形状: {new_df.shape}"})
+                st.session_state.chat_history.append({"role": "assistant", "content": f"✅ 处理完成。结果形状: {new_df.shape}\n\n{perf_note}"})
                 st.rerun()
                 break
                 
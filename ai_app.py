@@ -1,12 +1,22 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-import io
-import re
-import math
 import datetime
-from openai import OpenAI
-import traceback
+import asyncio
+from perf_monitor import perf_stage, render_perf_panel
+from data_store import get_data_store, switch_sheet
+from sandbox_pool import SandboxError
+from step_memo import code_hash, run_step_memoized
+from perf_lint import analyze_code, estimated_seconds, format_findings, needs_rewrite, vectorize_request
+from data_preview import render_data_preview
+from dtype_optimizer import format_memory_report
+from exporters import export_frames_cached, render_export_options
+from series_store import render_store_ingest
+from charts import render_chart_panel
+from header_layout import HEADER_SINGLE, read_excel_layout, read_header_levels, render_header_options
+from workspace import checkpoint_workspace, render_workspace_panel, restore_workspace
+from load_analytics import render_load_report
+from exec_env import HELPER_PROMPT
+from llm_async import ProgressLog, chat_completion, get_llm_loop, openai_client, run_many, timed_call, wait_with_status
 
 # ================= 配置区域 =================
 if "DEEPSEEK_API_KEY" in st.secrets:
@@ -16,10 +26,18 @@ else:
     st.stop()
 
 BASE_URL = "https://api.deepseek.com"
-client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
+client = openai_client(API_KEY, BASE_URL)  # 异步客户端，进程内缓存复用
 
 st.set_page_config(page_title="AI 数据分析台", layout="wide")
 
+# 进程级共享数据仓库：all_sheets / history 只保存句柄，相同文件和中间结果在各会话间只存一份
+store = get_data_store()
+
+# 工作区检查点：重启 / 断线重连后按 URL 中的工作区编号恢复 (须在下面的默认值初始化之前)
+WORKSPACE_KEYS = ["current_df", "chat_history", "macros", "last_successful_code", "last_successful_explanation",
+                  "all_sheets", "current_sheet_name", "history", "redo", "header_levels"]
+restore_workspace("ai_app")
+
 # ================= 1. 状态管理 =================
 if "current_df" not in st.session_state:
     st.session_state.current_df = None
@@ -36,11 +54,15 @@ if "last_successful_explanation" not in st.session_state:
     
 # --- V22 新增状态 ---
 if "all_sheets" not in st.session_state:
-    st.session_state.all_sheets = {} # 存储所有 Sheet
+    st.session_state.all_sheets = {} # 存储所有 Sheet 的句柄 (DataHandle)
 if "current_sheet_name" not in st.session_state:
     st.session_state.current_sheet_name = ""
 if "history" not in st.session_state:
-    st.session_state.history = [] # 撤销栈
+    st.session_state.history = [] # 撤销栈 (DataHandle)
+if "redo" not in st.session_state:
+    st.session_state.redo = [] # 重做栈 (DataHandle)，有新操作时清空
+if "header_levels" not in st.session_state:
+    st.session_state.header_levels = {} # 双层表头：扁平列名 -> [第一层, 第二层]，导出 Excel 时还原
 
 st.title("🤖 AI 数据分析台 (林洋内部版)")
 st.caption("专注数据清洗与计算 | 支持多 Sheet 切换 | 支持撤销回退")
@@ -49,26 +71,34 @@ st.caption("专注数据清洗与计算 | 支持多 Sheet 切换 | 支持撤销
 with st.sidebar:
     st.header("📂 1. 文件区")
     uploaded_file = st.file_uploader("上传 Excel", type=["xlsx", "xls"])
+    header_mode = render_header_options()
     
     if uploaded_file:
-        current_hash = hash(uploaded_file.getvalue())
+        current_hash = hash((uploaded_file.getvalue(), header_mode))
         if st.session_state.file_hash != current_hash:
             try:
-                # --- V22 修改：读取所有 Sheet ---
-                all_sheets = pd.read_excel(uploaded_file, sheet_name=None)
+                # --- V22 修改：读取所有 Sheet (其他会话已上传过同一文件时直接复用) ---
+                memory_report = {}
+                with perf_stage("读取Excel"):
+                    # 双层表头：表头两行拼成扁平列名 "上层_下层"，层级映射只读表头两行得到
+                    all_sheets = store.load_upload(uploaded_file.getvalue(), lambda: read_excel_layout(uploaded_file, header_mode),
+                                                   header_mode, report=memory_report)
+                    st.session_state.header_levels = {} if header_mode == HEADER_SINGLE else \
+                        read_header_levels(uploaded_file.getvalue())
                 st.session_state.all_sheets = all_sheets
                 st.session_state.file_hash = current_hash
                 
                 # 默认选中第一个 Sheet
                 first_sheet = list(all_sheets.keys())[0]
                 st.session_state.current_sheet_name = first_sheet
-                st.session_state.current_df = all_sheets[first_sheet].copy()
+                st.session_state.current_df = all_sheets[first_sheet].get()
                 
                 # 重置状态
                 st.session_state.chat_history = [] 
                 st.session_state.history = [] # 清空撤销
+                st.session_state.redo = []
                 st.session_state.last_successful_code = None
-                st.session_state.chat_history.append({"role": "assistant", "content": f"✅ 文件已加载，共 {len(all_sheets)} 个工作表。请选择工作表并下达指令。"})
+                st.session_state.chat_history.append({"role": "assistant", "content": f"✅ 文件已加载，共 {len(all_sheets)} 个工作表。请选择工作表并下达指令。\n\n📉 {format_memory_report(memory_report)}"})
                 st.rerun()
             except Exception as e:
                 st.error(f"读取失败: {e}")
@@ -96,28 +126,38 @@ with st.sidebar:
         if selected_sheet != st.session_state.current_sheet_name:
             # 1. 保存旧表进度
             old_name = st.session_state.current_sheet_name
-            if st.session_state.current_df is not None:
-                st.session_state.all_sheets[old_name] = st.session_state.current_df.copy()
-            
-            # 2. 加载新表
-            st.session_state.current_sheet_name = selected_sheet
-            st.session_state.current_df = st.session_state.all_sheets[selected_sheet].copy()
+            with perf_stage("切换工作表"):
+                # 2. 加载新表 (仓库中的版本不可变，直接引用，不再整表复制)
+                st.session_state.current_df = switch_sheet(store, st.session_state.all_sheets, old_name,
+                                                           st.session_state.current_df, selected_sheet)
+                st.session_state.current_sheet_name = selected_sheet
             
             # 3. 清空撤销栈 (换表了，之前的撤销记录就不适用了)
             st.session_state.history = []
+            st.session_state.redo = []
             st.toast(f"已切换至: {selected_sheet}", icon="🔄")
             st.rerun()
 
+        if len(sheet_names) > 1:
+            st.toggle("🗂️ 指令同时作用于所有工作表", key="apply_all_sheets",
+                      help="各工作表同时生成、执行代码；只有当前工作表的修改进入撤销栈")
+
+    st.toggle("🐢 慢代码先要求 AI 向量化", value=True, key="auto_vectorize",
+              help="执行前静态检查 iterrows / apply(axis=1) / 循环内 concat 等写法，按数据量估计耗时过长时先让 AI 改写")
+
     if st.button("🔥 重置工作区", type="primary"):
         if uploaded_file:
             # 重读文件
-            all_sheets = pd.read_excel(uploaded_file, sheet_name=None)
+            with perf_stage("读取Excel"):
+                all_sheets = store.load_upload(uploaded_file.getvalue(), lambda: read_excel_layout(uploaded_file, header_mode),
+                                               header_mode)
             st.session_state.all_sheets = all_sheets
             first_sheet = list(all_sheets.keys())[0]
             st.session_state.current_sheet_name = first_sheet
-            st.session_state.current_df = all_sheets[first_sheet].copy()
+            st.session_state.current_df = all_sheets[first_sheet].get()
             st.session_state.chat_history = []
             st.session_state.history = []
+            st.session_state.redo = []
             st.session_state.last_successful_code = None
             st.rerun()
 
@@ -134,41 +174,27 @@ with st.sidebar:
                         status = st.status(f"执行：{name}...", expanded=True)
                         current_df = st.session_state.current_df
                         
-                        # --- V22 新增：执行宏前先备份 (Undo) ---
-                        st.session_state.history.append(current_df.copy())
-                        
-                        execution_globals = {"pd": pd, "np": np, "re": re, "math": math, "datetime": datetime}
-                        local_scope = {}
-                        exec(macro_data['code'], execution_globals, local_scope)
-                        
-                        # --- 安全执行封装 ---
-                        result_obj = local_scope['process_step'](current_df.copy())
+                        # --- V22 新增：执行宏前先备份 (Undo)：current_df 只会被整体替换，存句柄即可，无需拷贝 ---
+                        with perf_stage("备份"):
+                            backup = store.put(current_df)
+                            st.session_state.history.append(backup)
+                            st.session_state.redo = []
                         
-                        # --- 版本兼容的 Styler 检查 ---
-                        is_styler = False
-                        try:
-                            # 尝试新版本导入
-                            from pandas.io.formats.style import Styler
-                            is_styler = isinstance(result_obj, Styler)
-                        except ImportError:
-                            try:
-                                # 尝试旧版本导入
-                                from pandas.formats.style import Styler
-                                is_styler = isinstance(result_obj, Styler)
-                            except ImportError:
-                                # 通用检查
-                                is_styler = hasattr(result_obj, 'data') and hasattr(result_obj, 'render')
+                        # --- 安全执行封装：在沙箱子进程中运行 (Styler 已在沙箱内剥离)；同一数据版本上执行过则直接取结果 ---
+                        with perf_stage("沙箱执行", macro=name):
+                            step, reused = run_step_memoized(macro_data['code'], current_df, backup.key)
                         
-                        if is_styler:
-                            new_df = result_obj.data
+                        new_df = step.value
+                        if step.styled:
                             msg = f"✅ 技能【{name}】执行成功！(已自动过滤不支持的颜色样式)"
                         else:
-                            new_df = result_obj
                             msg = f"✅ 技能【{name}】执行成功！"
+                        if reused:
+                            msg += " (相同数据上已执行过，直接复用结果)"
 
                         st.session_state.current_df = new_df
                         # --- V22 新增：同步到 all_sheets ---
-                        st.session_state.all_sheets[st.session_state.current_sheet_name] = new_df
+                        st.session_state.all_sheets[st.session_state.current_sheet_name] = store.put(new_df)
                         
                         st.session_state.chat_history.append({"role": "assistant", "content": f"{msg}\n> 说明: {macro_data['explanation']}"})
                         status.update(label="完成", state="complete", expanded=False)
@@ -177,7 +203,7 @@ with st.sidebar:
                         st.error(f"执行失败: {e}")
                         # 回滚
                         if st.session_state.history:
-                            st.session_state.current_df = st.session_state.history.pop()
+                            st.session_state.current_df = st.session_state.history.pop().get()
             with col2:
                 if st.button("❌", key=f"del_{name}"):
                     del st.session_state.macros[name]
@@ -185,32 +211,44 @@ with st.sidebar:
 
     if st.session_state.current_df is not None:
         st.divider()
-        # --- V22 修改：下载逻辑包含所有工作表 ---
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            for sheet_name, sheet_df in st.session_state.all_sheets.items():
-                # 确保当前正在编辑的表也是最新的
-                if sheet_name == st.session_state.current_sheet_name:
-                    st.session_state.current_df.to_excel(writer, sheet_name=sheet_name, index=True)
-                else:
-                    sheet_df.to_excel(writer, sheet_name=sheet_name, index=True)
+        # --- V22 修改：下载逻辑包含所有工作表 (非 Excel 格式每表一个文件，打包为 zip) ---
+        export_format, compression = render_export_options()
+        frames = {}
+        for sheet_name, sheet_handle in st.session_state.all_sheets.items():
+            # 确保当前正在编辑的表也是最新的
+            if sheet_name == st.session_state.current_sheet_name:
+                frames[sheet_name] = st.session_state.current_df
+            else:
+                frames[sheet_name] = sheet_handle  # 句柄：导出结果命中缓存时不必取出数据
+        with perf_stage("导出文件", format=export_format):
+            # 表和参数没变时复用上次导出的字节，不随每次重跑重新生成
+            export = export_frames_cached(frames, export_format, f"Result_{datetime.datetime.now().strftime('%H%M')}",
+                                   index=True, compression=compression, header_levels=st.session_state.header_levels)
                     
-        st.download_button("📥 下载完整结果 (含所有表)", data=output.getvalue(), file_name=f"Result_{datetime.datetime.now().strftime('%H%M')}.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        st.download_button("📥 下载完整结果 (含所有表)", data=export.data, file_name=export.file_name, mime=export.mime)
+        render_store_ingest(frames)
+
+    # 状态有变化时后台写检查点 (只写新出现的数据版本)
+    checkpoint_workspace("ai_app", WORKSPACE_KEYS,
+                         f"{st.session_state.current_sheet_name} · {len(st.session_state.history)} 步")
+    render_workspace_panel("ai_app")
+    render_perf_panel()
 
 # ================= 3. 主界面 =================
 if st.session_state.current_df is None:
     st.info("👈 请上传 Excel 开始")
     st.stop()
 
-# --- V22 新增：撤销按钮区域 ---
-col_tool_1, col_tool_2 = st.columns([1, 5])
+# --- V22 新增：撤销 / 重做按钮区域 (撤销栈、重做栈都是仓库句柄，切换只是取出已有版本) ---
+col_tool_1, col_tool_redo, col_tool_2 = st.columns([1, 1, 4])
 with col_tool_1:
     if st.button("↩️ 撤销上一步", use_container_width=True):
         if len(st.session_state.history) > 0:
-            last_df = st.session_state.history.pop()
-            st.session_state.current_df = last_df
+            st.session_state.redo.append(store.put(st.session_state.current_df))
+            last_handle = st.session_state.history.pop()
+            st.session_state.current_df = last_handle.get()
             # 同步回 all_sheets
-            st.session_state.all_sheets[st.session_state.current_sheet_name] = last_df
+            st.session_state.all_sheets[st.session_state.current_sheet_name] = last_handle
             
             # 移除最后一条 AI 回复（如果需要的话，不仅回退数据，也回退对话界面看起来更合理）
             if len(st.session_state.chat_history) > 0:
@@ -223,11 +261,21 @@ with col_tool_1:
         else:
             st.warning("没有可撤销的步骤了")
 
+with col_tool_redo:
+    if st.button("↪️ 重做", use_container_width=True, disabled=not st.session_state.redo):
+        st.session_state.history.append(store.put(st.session_state.current_df))
+        next_handle = st.session_state.redo.pop()
+        st.session_state.current_df = next_handle.get()
+        st.session_state.all_sheets[st.session_state.current_sheet_name] = next_handle
+        st.rerun()
+
 with col_tool_2:
     st.success(f"当前表: **{st.session_state.current_sheet_name}** | {st.session_state.current_df.shape[0]} 行, {st.session_state.current_df.shape[1]} 列")
 
 with st.expander("📊 数据预览", expanded=True):
-    st.dataframe(st.session_state.current_df.head(5), use_container_width=True)
+    render_data_preview(st.session_state.current_df, key="preview")
+render_load_report(st.session_state.current_df)
+render_chart_panel(st.session_state.current_df)
 
 st.divider()
 
@@ -254,12 +302,124 @@ if st.session_state.last_successful_code:
                     st.rerun()
 
 # ================= 4. 核心引擎 (含安全气囊) =================
+MAX_RETRIES = 3
+
+# --- 16.0 全能通用版 System Prompt (智能+安全) ---
+SYSTEM_PROMPT = f"""
+You are an expert Python Data Scientist for the Energy/Power industry.
+
+【Output Rules - STRICT】
+1. Output ONLY valid Python code. NO markdown (```). NO text.
+2. The code MUST contain `def process_step(df):`.
+3. IGNORE non-data sheets (Smart Guard is active).
+
+【Industry Domain Knowledge (CRITICAL)】
+You must apply the following default logic to ALL user queries unless explicitly told otherwise:
+
+1. **Time Representation**: In this domain, a timestamp (e.g., 01:00) represents the **END** of a period, not the start.
+2. **Resampling/Aggregation**: 
+   - When converting frequency (e.g., 15min -> 1H), you MUST use **right-closed intervals**.
+   - Code pattern: `df.resample('...', closed='right', label='right').mean()` (or sum).
+   - **NEVER** use the default pandas behavior (which is left-closed).
+   - Example: 01:00 hourly mean = average of (00:15, 00:30, 00:45, 01:00).
+3. **24:00 Handling**:
+   - If '24:00' exists, treat it as the end of the day.
+   - Ensure calculations (like mean) include this 24:00 point correctly in the last interval.
+4. **Built-in Helpers** (already available; use them instead of writing your own loops):
+{HELPER_PROMPT}
+【Smart Guard Clause】
+(Include this at the start of your code)
+- Check if df is empty or first column is not time-like/string-like. If so, `return df`.
+
+【Task】
+Generate `def process_step(df):` to fulfill the user's natural language request, applying the Industry Knowledge above automatically.
+"""
+
+
+def extract_code(text):
+    return text.replace("```python", "").replace("```", "").strip()
+
+
+async def solve_sheet(sheet_name, df, version, user_prompt, log, vectorize=False):
+    """
+    单个工作表：生成代码 -> 沙箱执行，出错时把报错回传给 AI 自动修正 (最多 MAX_RETRIES 次)。
+    version 为 df 的数据版本：AI 给出与之前相同的代码时直接复用结果 (跨会话共享的记忆表) /
+    报错 (只记在本次调用内，不与其他会话共享)，不重复执行。
+    vectorize 为 True 时，静态检查估计过慢的代码先不执行，占用一次重试机会要求 AI 改写为向量化写法。
+    返回 (new_df, code, explanation, perf_note)；全部失败时抛出最后一次的错误。
+    在后台事件循环中运行，进度写入 log，不能调用 st.*。
+    """
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Current Sheet: {sheet_name}\nData Preview:\n{df.head(2).to_markdown()}\n需求: {user_prompt}"}
+    ]
+    code, error_info = "", ""
+    failed = {}  # 本次调用中执行失败过的代码：code_hash -> 报错 (数据版本在调用内不变)
+    for i in range(MAX_RETRIES):
+        executed = None
+        try:
+            if i > 0: log.write(f"🔧 [{sheet_name}] 第 {i} 次自动修正中...")
+
+            reply = await timed_call(log, "LLM调用", chat_completion(
+                client, model="deepseek-chat", messages=messages, temperature=0.1
+            ), model="deepseek-chat", attempt=i, sheet=sheet_name)
+            code = extract_code(reply)
+
+            # 执行前的性能静态检查：按数据行列数估计逐行写法的耗时
+            findings = analyze_code(code, df.shape)
+            if vectorize and i < MAX_RETRIES - 1 and needs_rewrite(findings):
+                log.write(f"🐢 [{sheet_name}] 预计耗时 ~{estimated_seconds(findings):.0f}s，要求 AI 改写为向量化代码...")
+                messages.append({"role": "assistant", "content": code})
+                messages.append({"role": "user", "content": vectorize_request(findings, df.shape)})
+                continue
+
+            executed = code_hash(code)
+            if executed in failed:
+                log.write(f"♻️ [{sheet_name}] 相同代码已在相同数据上失败过，不再重复执行")
+                raise SandboxError(failed[executed])
+
+            # 执行处理：沙箱子进程内编译并调用 process_step，超时/超内存不会拖垮服务
+            # (在线程里等待沙箱，事件循环可以继续处理其他工作表的 LLM 请求)
+            step, reused = await timed_call(log, "沙箱执行", asyncio.to_thread(run_step_memoized, code, df, version),
+                                            attempt=i, sheet=sheet_name)
+            if reused:
+                log.write(f"♻️ [{sheet_name}] 相同代码已在相同数据上执行过，直接复用结果")
+            result_obj = step.value
+            explanation = step.explanation or "AI 未提供解释"
+
+            # =========== 🛡️ 安全气囊：防样式崩溃系统 ===========
+            warning_note = ""
+            # Styler (Pandas 的样式对象) 已在沙箱内强制取回纯数据 (.data)
+            if step.styled:
+                new_df = result_obj
+                warning_note = "\n\n⚠️ **系统提示**：检测到包含颜色/样式指令。为防止系统崩溃，已自动过滤样式，仅保留处理后的数据结果。"
+            elif isinstance(result_obj, pd.DataFrame):
+                new_df = result_obj
+            else:
+                raise ValueError(f"AI 返回了不支持的数据类型: {type(result_obj)}")
+            # ===============================================
+            perf_note = format_findings(findings, step.timings.get("process_step"), df.shape)
+            return new_df, code, explanation + warning_note, perf_note
+
+        except Exception as e:
+            # 沙箱错误的消息里已带有原始异常类型
+            error_info = str(e) if isinstance(e, SandboxError) else f"{type(e).__name__}: {str(e)}"
+            if executed is not None:
+                failed[executed] = error_info
+            log.write(f"❌ [{sheet_name}] 内部尝试错误: {error_info}")
+            messages.append({"role": "assistant", "content": code})
+            messages.append({"role": "user", "content": f"代码执行报错: {error_info}\n请修正。如果是因为尝试使用 .style 或样式功能导致，请去掉样式代码，只处理数据！"})
+    raise RuntimeError(error_info)
+
+
 if user_prompt := st.chat_input("对当前工作表下达指令..."):
     st.session_state.chat_history.append({"role": "user", "content": user_prompt})
     st.session_state.last_successful_code = None
     
-    # --- V22 新增：操作前自动备份 ---
-    st.session_state.history.append(st.session_state.current_df.copy())
+    # --- V22 新增：操作前自动备份 (存入共享仓库，只保留句柄) ---
+    with perf_stage("备份"):
+        st.session_state.history.append(store.put(st.session_state.current_df))
+        st.session_state.redo = []
     
     with st.chat_message("user"):
         st.markdown(user_prompt)
@@ -267,120 +427,58 @@ if user_prompt := st.chat_input("对当前工作表下达指令..."):
     with st.chat_message("assistant"):
         status = st.status("🧠 AI 正在处理...", expanded=True)
         
-        current_df = st.session_state.current_df
-        MAX_RETRIES = 3
-        success = False
-        
-        execution_globals = {"pd": pd, "np": np, "re": re, "math": math, "datetime": datetime}
-        
-        # --- 16.0 全能通用版 System Prompt (智能+安全) ---
-        system_prompt = """
-        You are an expert Python Data Scientist for the Energy/Power industry.
-        
-        【Output Rules - STRICT】
-        1. Output ONLY valid Python code. NO markdown (```). NO text.
-        2. The code MUST contain `def process_step(df):`.
-        3. IGNORE non-data sheets (Smart Guard is active).
-        
-        【Industry Domain Knowledge (CRITICAL)】
-        You must apply the following default logic to ALL user queries unless explicitly told otherwise:
-        
-        1. **Time Representation**: In this domain, a timestamp (e.g., 01:00) represents the **END** of a period, not the start.
-        2. **Resampling/Aggregation**: 
-           - When converting frequency (e.g., 15min -> 1H), you MUST use **right-closed intervals**.
-           - Code pattern: `df.resample('...', closed='right', label='right').mean()` (or sum).
-           - **NEVER** use the default pandas behavior (which is left-closed).
-           - Example: 01:00 hourly mean = average of (00:15, 00:30, 00:45, 01:00).
-        3. **24:00 Handling**:
-           - If '24:00' exists, treat it as the end of the day.
-           - Ensure calculations (like mean) include this 24:00 point correctly in the last interval.
-        
-        【Smart Guard Clause】
-        (Include this at the start of your code)
-        - Check if df is empty or first column is not time-like/string-like. If so, `return df`.
-        
-        【Task】
-        Generate `def process_step(df):` to fulfill the user's natural language request, applying the Industry Knowledge above automatically.
-        """
+        current_name = st.session_state.current_sheet_name
+        # 所有工作表模式：各表同时请求、同时执行，总耗时接近最慢的一张表
+        # 每张表带上数据版本 (当前表即刚备份的句柄)，用于结果复用
+        current = (st.session_state.current_df, st.session_state.history[-1].key)
+        if st.session_state.get("apply_all_sheets") and len(st.session_state.all_sheets) > 1:
+            targets = {name: current if name == current_name else (handle.get(), handle.key)
+                       for name, handle in st.session_state.all_sheets.items()}
+        else:
+            targets = {current_name: current}
 
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Current Sheet: {st.session_state.current_sheet_name}\nData Preview:\n{current_df.head(2).to_markdown()}\n需求: {user_prompt}"}
-        ]
+        # LLM 请求在后台事件循环中进行，脚本线程只负责刷新状态
+        log = ProgressLog()
+        with perf_stage("AI处理", sheets=len(targets)):
+            vectorize = st.session_state.get("auto_vectorize", True)
+            future = get_llm_loop().submit(run_many([solve_sheet(name, df, version, user_prompt, log, vectorize)
+                                                     for name, (df, version) in targets.items()]))
+            outcomes = dict(zip(targets, wait_with_status(future, status, "🧠 AI 正在处理...", log)))
+        solved = {name: o for name, o in outcomes.items() if not isinstance(o, BaseException)}
+        failed = {name: o for name, o in outcomes.items() if isinstance(o, BaseException)}
 
-        for i in range(MAX_RETRIES):
-            try:
-                if i > 0: status.write(f"🔧 第 {i} 次自动修正中...")
-                
-                response = client.chat.completions.create(
-                    model="deepseek-chat", messages=messages, temperature=0.1
-                )
-                code = response.choices[0].message.content.replace("```python", "").replace("```", "").strip()
-                
-                local_scope = {}
-                exec(code, execution_globals, local_scope)
-                
-                if 'process_step' not in local_scope: raise ValueError("函数丢失")
-                if 'explanation' not in local_scope: local_scope['explanation'] = "AI 未提供解释"
-                
-                # 执行处理
-                result_obj = local_scope['process_step'](current_df.copy())
-                
-                # =========== 🛡️ 安全气囊：防样式崩溃系统 ===========
-                warning_note = ""
-                # 检测返回值是不是 Styler (Pandas 的样式对象)
-                # 版本兼容的 Styler 检查
-                is_styler = False
-                try:
-                    # 尝试新版本导入
-                    from pandas.io.formats.style import Styler
-                    is_styler = isinstance(result_obj, Styler)
-                except ImportError:
-                    try:
-                        # 尝试旧版本导入
-                        from pandas.formats.style import Styler
-                        is_styler = isinstance(result_obj, Styler)
-                    except ImportError:
-                        # 通用检查：有 data 和 render 方法的就是 Styler
-                        is_styler = hasattr(result_obj, 'data') and hasattr(result_obj, 'render')
-
-                if is_styler:
-                    # 如果是，强制取回纯数据 (.data)
-                    new_df = result_obj.data
-                    warning_note = "\n\n⚠️ **系统提示**：检测到包含颜色/样式指令。为防止系统崩溃，已自动过滤样式，仅保留处理后的数据结果。"
-                elif isinstance(result_obj, pd.DataFrame):
-                    new_df = result_obj
-                else:
-                    raise ValueError(f"AI 返回了不支持的数据类型: {type(result_obj)}")
-                # ===============================================
-                
-                # 成功
-                st.session_state.current_df = new_df
-                # --- V22 新增：同步到 all_sheets ---
-                st.session_state.all_sheets[st.session_state.current_sheet_name] = new_df
-                
-                st.session_state.last_successful_code = code
-                st.session_state.last_successful_explanation = local_scope['explanation'] + warning_note
-                
-                success = True
-                status.update(label="✅ 执行成功", state="complete", expanded=False)
-                
+        if solved:
+            # 成功：写回 (--- V22 新增：同步到 all_sheets ---)
+            for name, (new_df, code, explanation, _) in solved.items():
+                st.session_state.all_sheets[name] = store.put(new_df)
+                if name == current_name:
+                    st.session_state.current_df = new_df
+            # 技能库保存当前表的代码 (当前表失败时取第一张成功的表)
+            _, code, explanation, perf_note = solved.get(current_name) or next(iter(solved.values()))
+            st.session_state.last_successful_code = code
+            st.session_state.last_successful_explanation = explanation
+            
+            status.update(label="✅ 执行成功", state="complete", expanded=False)
+            
+            if len(targets) == 1:
                 final_response = f"""
                 **🧐 结果说明:**
                 > {st.session_state.last_successful_explanation}
                 """
-                st.markdown(final_response)
-                st.session_state.chat_history.append({"role": "assistant", "content": final_response})
-                st.rerun()
-                break
-
-            except Exception as e:
-                error_info = f"{type(e).__name__}: {str(e)}"
-                status.write(f"❌ 内部尝试错误: {error_info}")
-                messages.append({"role": "assistant", "content": code})
-                messages.append({"role": "user", "content": f"代码执行报错: {error_info}\n请修正。如果是因为尝试使用 .style 或样式功能导致，请去掉样式代码，只处理数据！"})
-        
-        if not success:
+                if perf_note:
+                    final_response += f"\n\n{perf_note}"
+            else:
+                lines = [f"- **{name}**：{explanation.splitlines()[0] if explanation else ''}"
+                         for name, (_, _, explanation, _) in solved.items()]
+                lines += [f"- **{name}**：❌ {e}" for name, e in failed.items()]
+                notes = [f"**{name}**\n{note}" for name, (_, _, _, note) in solved.items() if note]
+                final_response = f"**🧐 结果说明 ({len(solved)}/{len(targets)} 个工作表成功):**\n\n" + "\n".join(lines)
+                if notes:
+                    final_response += "\n\n" + "\n\n".join(notes)
+            st.markdown(final_response)
+            st.session_state.chat_history.append({"role": "assistant", "content": final_response})
+            st.rerun()
+        else:
             status.update(label="❌ 无法处理", state="error")
             # 回退数据（虽然还没覆盖，但清理一下栈比较好）
             st.session_state.history.pop() 
@@ -0,0 +1,184 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# ================= 大数据量曲线图 (降采样 + 渲染缓存) =================
+# 几年的 15 分钟数据 x 多个站点直接画，浏览器要接收、绘制几十万到上百万个点。
+# 屏幕上每条曲线最多也就图宽那么多个像素，这里先按像素宽度降采样再画：
+# - min-max：每个像素桶保留最小值和最大值 (峰谷不丢)，所有列一次向量化完成，默认方法；
+# - LTTB (Largest-Triangle-Three-Buckets)：保留视觉形状最突出的点，逐桶计算，适合少量曲线；
+# 降采样结果和 matplotlib PNG 按 (数据版本, 列, 宽度, 方法) 缓存，重跑脚本或重复打开不重算。
+
+CHART_WIDTH = int(os.environ.get("CHART_WIDTH", "1200"))  # 目标像素宽度
+CHART_CACHE_ENTRIES = 64
+DOWNSAMPLE_MINMAX = "min-max (保留峰谷)"
+DOWNSAMPLE_LTTB = "LTTB (保留形状)"
+DOWNSAMPLE_METHODS = [DOWNSAMPLE_MINMAX, DOWNSAMPLE_LTTB]
+_METHOD_ALIASES = {"minmax": DOWNSAMPLE_MINMAX, "lttb": DOWNSAMPLE_LTTB}
+
+
+def plot_frame(df):
+    """整理成 横轴索引 x 数值列：索引不是时间/数值时，把第一列可解析为时间的列当作横轴"""
+    index = df.index
+    if not (isinstance(index, pd.DatetimeIndex) or pd.api.types.is_numeric_dtype(index)) \
+            or isinstance(index, pd.RangeIndex):
+        for col in df.columns[:1]:
+            if pd.api.types.is_datetime64_any_dtype(df[col]):
+                ts = df[col]
+            elif pd.api.types.is_numeric_dtype(df[col]):
+                break
+            else:
+                ts = pd.to_datetime(df[col].astype(str), errors="coerce", format="mixed")
+            if ts.notna().mean() > 0.9:
+                df = df.drop(columns=col).set_axis(pd.DatetimeIndex(ts, name=col))
+                break
+    numeric = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+    return df[numeric]
+
+
+def minmax_rows(values, buckets):
+    """
+    values: (行数, 列数)。每个桶为每列保留最小值、最大值两点 (按出现先后排列)，
+    返回 (桶数*2, 列数) 的数组与对应的行号 (桶首行、桶末行，所有列共用横轴)。
+    """
+    n, cols = values.shape
+    size = -(-n // buckets)
+    count = -(-n // size)
+    padded = np.full((count * size, cols), np.nan)
+    padded[:n] = values
+    groups = padded.reshape(count, size, cols)
+    empty = np.isnan(groups).all(axis=1)
+    low = np.where(np.isnan(groups), np.inf, groups).argmin(axis=1)
+    high = np.where(np.isnan(groups), -np.inf, groups).argmax(axis=1)
+    first = np.minimum(low, high)
+    second = np.maximum(low, high)
+    take = lambda pos: np.where(empty, np.nan, np.take_along_axis(groups, pos[:, None, :], axis=1)[:, 0, :])
+    out = np.empty((count * 2, cols))
+    out[0::2], out[1::2] = take(first), take(second)
+    starts = np.arange(count) * size
+    rows = np.empty(count * 2, dtype=np.int64)
+    rows[0::2], rows[1::2] = starts, np.minimum(starts + size, n) - 1
+    return out, rows
+
+
+def lttb_indices(x, y, threshold):
+    """单条曲线的 LTTB 选点，返回保留点的下标 (含首尾)；空值点不参与"""
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= threshold or threshold < 3:
+        return valid
+    x, y = x[valid], y[valid]
+    edges = np.linspace(1, len(x) - 1, threshold - 1).astype(np.int64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, len(x) - 1
+    prev = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt_lo, nxt_hi = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else len(x)
+        avg_x, avg_y = x[nxt_lo:nxt_hi].mean(), y[nxt_lo:nxt_hi].mean()
+        area = np.abs((x[prev] - avg_x) * (y[lo:hi] - y[prev]) - (x[prev] - x[lo:hi]) * (avg_y - y[prev]))
+        prev = lo + int(area.argmax())
+        keep[i + 1] = prev
+    return valid[keep]
+
+
+def downsample_for_plot(df, width=CHART_WIDTH, method="minmax"):
+    """
+    供生成代码和图表面板使用：把 df 降采样到约 width 个像素桶，返回行数很少的同结构表 (横轴为索引)。
+    method: "minmax" (每桶最小/最大值，多列一次完成) 或 "lttb" (逐列选点后取并集)。
+    """
+    method = _METHOD_ALIASES.get(method, method)
+    frame = plot_frame(df)
+    n = len(frame)
+    if n <= width * 2 or not frame.shape[1]:
+        return frame
+    values = frame.to_numpy(dtype=float, na_value=np.nan)
+    if method == DOWNSAMPLE_LTTB:
+        index = frame.index
+        x = index.asi8.astype(float) if isinstance(index, pd.DatetimeIndex) else \
+            (index.to_numpy(dtype=float) if pd.api.types.is_numeric_dtype(index) else np.arange(n, dtype=float))
+        rows = np.unique(np.concatenate([lttb_indices(x, values[:, c], width) for c in range(values.shape[1])]))
+        return frame.iloc[rows]
+    out, rows = minmax_rows(values, width)
+    return pd.DataFrame(out, index=frame.index[rows], columns=frame.columns)
+
+
+# ---------- 渲染缓存 ----------
+
+_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def _cached(key, build):
+    with _CACHE_LOCK:
+        if key in _CACHE:
+            _CACHE.move_to_end(key)
+            return _CACHE[key]
+    value = build()
+    with _CACHE_LOCK:
+        _CACHE[key] = value
+        while len(_CACHE) > CHART_CACHE_ENTRIES:
+            _CACHE.popitem(last=False)
+    return value
+
+
+def chart_data(df, columns, width=CHART_WIDTH, method=DOWNSAMPLE_MINMAX):
+    """按 (数据版本, 列, 宽度, 方法) 缓存的降采样结果"""
+    from data_store import get_data_store
+
+    key = ("data", get_data_store().version(df), tuple(map(str, columns)), width, method)
+    return _cached(key, lambda: downsample_for_plot(plot_frame(df)[list(columns)], width, method))
+
+
+def chart_png(df, columns, width=CHART_WIDTH, method=DOWNSAMPLE_MINMAX):
+    """matplotlib 静态图 (PNG 字节)，用于下载或需要完全一致的导出样式"""
+    from data_store import get_data_store
+    from lazy_modules import LAZY_MODULES
+
+    def build():
+        plt = LAZY_MODULES["plt"]
+        data = chart_data(df, columns, width, method)
+        fig, ax = plt.subplots(figsize=(width / 100, 4), dpi=100)
+        try:
+            data.plot(ax=ax, linewidth=0.8)
+            ax.grid(alpha=0.3)
+            fig.tight_layout()
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format="png")
+            return buffer.getvalue()
+        finally:
+            plt.close(fig)
+
+    key = ("png", get_data_store().version(df), tuple(map(str, columns)), width, method)
+    return _cached(key, build)
+
+
+def render_chart_panel(df, key="chart"):
+    """曲线图面板：默认用 st.line_chart 画降采样后的数据；可切换为 matplotlib PNG"""
+    import streamlit as st
+
+    with st.expander("📈 曲线图 (按像素宽度降采样)"):
+        frame = plot_frame(df)
+        if not frame.shape[1]:
+            st.caption("没有可绘制的数值列")
+            return
+        columns = st.multiselect("曲线", list(frame.columns), default=list(frame.columns[:10]), key=f"{key}_cols")
+        method_col, renderer_col = st.columns(2)
+        with method_col:
+            method = st.selectbox("降采样", DOWNSAMPLE_METHODS, key=f"{key}_method",
+                                  help="min-max 保留每个像素内的峰谷，适合负荷曲线；LTTB 保留整体形状，适合少量曲线")
+        with renderer_col:
+            static = st.toggle("matplotlib 静态图", key=f"{key}_static", help="默认用原生交互图表，更快")
+        if not columns:
+            return
+        data = chart_data(df, columns, CHART_WIDTH, method)
+        st.caption(f"{len(frame)} 行 -> {len(data)} 行 (每条曲线)")
+        if static:
+            png = chart_png(df, columns, CHART_WIDTH, method)
+            st.image(png, use_container_width=True)
+            st.download_button("📥 下载 PNG", png, file_name="chart.png", mime="image/png", key=f"{key}_png")
+        else:
+            st.line_chart(data)
@@ -0,0 +1,179 @@
+import hashlib
+import io
+import os
+import posixpath
+import re
+import tempfile
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+
+import pandas as pd
+
+from data_store import ensure_private_dir
+
+# ================= 增量转换缓存 =================
+# 同一个逐日增长的工作簿每天重新上传一次，通常只有最新的 Sheet 有变化。
+# - 不解析单元格，直接对 .xlsx 压缩包里每个 Sheet 的原始 XML 取指纹
+#   (连同它引用到的共享字符串、单元格样式/数字格式，以及 1904 日期设置)；
+# - 以指纹 (+ 转换参数) 为键把转换结果 (24 点表或原样保留的表、质量报告) 缓存到本地目录；
+# - 指纹命中的 Sheet 既不解析也不重算，只有新增/变化的 Sheet 才重新读取和转换。
+# .xls 等非 zip 格式无法按 Sheet 取指纹，返回 None，由调用方退回全量模式。
+# 条目以 pickle 存储，读回即执行其中的对象构造：缓存目录只允许当前用户访问 (0700)，
+# 目录属于其他用户时停用缓存 (全部当作未命中、不写入)，不读取别人可能放进来的文件。
+
+CACHE_DIR = os.environ.get("CONVERT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "convert_cache")
+CACHE_MAX_MB = int(os.environ.get("CONVERT_CACHE_MAX_MB", "512"))
+CACHE_VERSION = "96to24-v4"  # 转换逻辑变化时改这里，使旧缓存整体失效
+
+_NS = {
+    "m": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+_SHARED_REF = re.compile(rb'<c\b[^>]*\bt="s"[^>]*>\s*<v>(\d+)</v>')
+_STYLE_REF = re.compile(rb'<c\b[^>]*?\bs="(\d+)"')
+_SHARED_ITEM = re.compile(rb"<si\b.*?</si>", re.S)
+_CELL_XFS = re.compile(rb"<cellXfs\b.*?</cellXfs>", re.S)
+_XF = re.compile(rb"<xf\b[^>]*?(?:/>|>.*?</xf>)", re.S)
+_NUM_FMT_ID = re.compile(rb'\bnumFmtId="(\d+)"')
+_NUM_FMT = re.compile(rb'<numFmt\b[^>]*\bnumFmtId="(\d+)"[^>]*/>')
+_DATE1904 = re.compile(rb'date1904="(1|true)"')
+
+
+def _sheet_paths(zf):
+    """按工作簿顺序返回 [(sheet_name, zip 内路径)]"""
+    workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+    rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    targets = {}
+    for rel in rels.findall("rel:Relationship", _NS):
+        target = rel.get("Target")
+        targets[rel.get("Id")] = target.lstrip("/") if target.startswith("/") else posixpath.normpath(
+            posixpath.join("xl", target))
+    sheets = []
+    for sheet in workbook.find("m:sheets", _NS):
+        rid = sheet.get(f"{{{_NS['r']}}}id")
+        sheets.append((sheet.get("name"), targets.get(rid)))
+    return sheets
+
+
+def sheet_fingerprints(raw):
+    """
+    返回 {sheet_name: 指纹}，顺序与工作簿一致；无法按 Sheet 取指纹时返回 None。
+    指纹只取决于该 Sheet 自身的内容，其他 Sheet 的增删改不影响它。
+    """
+    try:
+        zf = zipfile.ZipFile(io.BytesIO(raw))
+        sheets = _sheet_paths(zf)
+    except (zipfile.BadZipFile, KeyError, ET.ParseError):
+        return None
+
+    names = set(zf.namelist())
+    shared = _SHARED_ITEM.findall(zf.read("xl/sharedStrings.xml")) if "xl/sharedStrings.xml" in names else []
+    styles = zf.read("xl/styles.xml") if "xl/styles.xml" in names else b""
+    cell_xfs = _CELL_XFS.search(styles)
+    xfs = _XF.findall(cell_xfs.group(0)) if cell_xfs else []
+    num_fmts = {m.group(1): m.group(0) for m in _NUM_FMT.finditer(styles)}
+    date1904 = bool(_DATE1904.search(zf.read("xl/workbook.xml")))
+
+    result = {}
+    for name, path in sheets:
+        if path is None or path not in names:
+            return None
+        data = zf.read(path)
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{CACHE_VERSION}|{date1904}|".encode())
+        h.update(data)
+        # 共享字符串按引用顺序计入：其他 Sheet 追加的新字符串不会改变本 Sheet 的指纹
+        for idx in _SHARED_REF.findall(data):
+            i = int(idx)
+            h.update(shared[i] if i < len(shared) else b"?")
+        for idx in sorted(set(_STYLE_REF.findall(data)), key=int):
+            i = int(idx)
+            xf = xfs[i] if i < len(xfs) else b"?"
+            h.update(xf)
+            fmt = _NUM_FMT_ID.search(xf)
+            if fmt:
+                h.update(num_fmts.get(fmt.group(1), b""))
+        result[name] = h.hexdigest()
+    return result
+
+
+class ConvertCache:
+    """以 Sheet 指纹 (+ 转换参数) 为键的本地转换结果缓存，条目为任意可 pickle 的对象"""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_mb=CACHE_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_mb * 1024 * 1024
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(fingerprint, *options):
+        """同一个 Sheet 在不同转换参数下的结果分别缓存"""
+        if not options:
+            return fingerprint
+        return hashlib.blake2b(f"{fingerprint}|{options!r}".encode(), digest_size=16).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def _private(self):
+        """创建 / 检查私有缓存目录；不可用 (属于其他用户等) 时返回 False"""
+        try:
+            ensure_private_dir(self.cache_dir)
+        except OSError:
+            return False
+        return True
+
+    def get(self, key):
+        if not self._private():
+            return None
+        path = self._path(key)
+        try:
+            value = pd.read_pickle(path)
+        except Exception:
+            return None  # 不存在或已损坏：当作未命中
+        try:
+            os.utime(path)  # 刷新访问时间，清理时按最久未用淘汰
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        if not self._private():
+            return
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        pd.to_pickle(value, tmp)
+        os.replace(tmp, path)  # 原子替换，多个会话同时写同一条目也不会读到半截文件
+        self._prune()
+
+    def _prune(self):
+        with self._lock:
+            try:
+                entries = [e for e in os.scandir(self.cache_dir) if e.name.endswith(".pkl")]
+            except OSError:
+                return
+            stats = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in entries]
+            total = sum(size for _, size, _ in stats)
+            for _, size, path in sorted(stats):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                    total -= size
+                except OSError:
+                    pass
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_convert_cache():
+    """进程级单例"""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = ConvertCache()
+        return _CACHE
@@ -0,0 +1,198 @@
+import io
+import warnings
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from time_slots import DAY_MINUTES, label_codes, slot_labels, time_slots
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # 没有 pyarrow 时退回 pandas 的 C 引擎
+    pa = None
+    pa_csv = None
+
+# ================= CSV 快速读取 / 流式 96->24 聚合 =================
+# - 普通读取：pyarrow 多线程解析，可只读取需要的列；遇到 pyarrow 解析不了的脏数据自动退回 C 引擎。
+#   不加类型提示：读出的表交给 AI 生成代码修改，浮点保持 float64、文本不转 category (见 dtype_optimizer)。
+# - 流式聚合：按块 (默认 64MB) 读取电表级长表，每块先按 (分组列, 日期, 小时) 求和/计数，
+#   最后合并为小时均值。内存中只保留聚合后的结果，完整的 15 分钟表从不整体载入。
+#   时刻标签按"时段结束"(00:15..24:00) 还是"时段开始"(00:00..23:45) 解释，由第一块数据判断后各块统一使用；
+#   无法归入任何小时的行 (时间解析失败、不在 15 分钟整点上等) 会被丢弃，并给出警告。
+# - 中文导出的 CSV 常见 GBK 编码，UTF-8 解码失败时自动改用 GB18030。
+
+SAMPLE_BYTES = 1024 * 1024  # 编码检测只看开头这么多字节
+STREAM_BLOCK_BYTES = 64 * 1024 * 1024
+COMBINE_EVERY = 16  # 每累计若干块的部分聚合结果就合并一次，控制常驻内存
+FALLBACK_ENCODING = "gb18030"
+
+
+class CsvOptions(NamedTuple):
+    usecols: tuple = ()           # 只读取这些列 (空 = 全部)
+    aggregate: bool = False       # 是否流式 96 -> 24 聚合
+    time_col: str = ""            # 时间列：完整时间戳，或配合 date_col 的时刻标签
+    date_col: str = ""            # 日期列 (时间列只有时刻时填写)
+    key_cols: tuple = ()          # 分组列 (如电表号)
+
+
+def _raw_bytes(source):
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    return source.getvalue()
+
+
+def _detect_encoding(raw):
+    try:
+        raw[:SAMPLE_BYTES].decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        # 抽样刚好截断在多字节字符中间不算解码失败
+        return "utf-8" if e.start >= min(len(raw), SAMPLE_BYTES) - 3 else FALLBACK_ENCODING
+
+
+def read_csv_fast(source, usecols=None):
+    """读取整个 CSV：pyarrow 引擎 + 列裁剪"""
+    raw = _raw_bytes(source)
+    encoding = _detect_encoding(raw)
+    usecols = list(usecols) if usecols else None
+    if pa is not None:
+        try:
+            return pd.read_csv(io.BytesIO(raw), engine="pyarrow", encoding=encoding, usecols=usecols)
+        except Exception:
+            pass  # 引号不规范、列数不一致等：交给更宽松的 C 引擎
+    return pd.read_csv(io.BytesIO(raw), encoding=encoding, usecols=usecols, low_memory=False)
+
+
+def iter_csv_chunks(source, usecols=None, column_types=None, block_bytes=STREAM_BLOCK_BYTES):
+    """按块流式读取，逐块产出 DataFrame；column_types 为 {列名: pyarrow 类型}"""
+    raw = _raw_bytes(source)
+    encoding = _detect_encoding(raw)
+    if pa is None:
+        yield from pd.read_csv(io.BytesIO(raw), encoding=encoding, usecols=usecols or None,
+                               chunksize=max(1, block_bytes // 100), dtype=str)
+        return
+    reader = pa_csv.open_csv(
+        io.BytesIO(raw),
+        read_options=pa_csv.ReadOptions(block_size=block_bytes, encoding=encoding),
+        convert_options=pa_csv.ConvertOptions(include_columns=list(usecols) if usecols else None,
+                                              column_types=column_types or {}),
+    )
+    for batch in reader:
+        yield batch.to_pandas()
+
+
+def _hour_buckets(chunk, time_col, date_col, convention=None):
+    """
+    返回 (日期, 小时 1..24, 时刻约定)。convention 为 None 时由本块判断 (见 time_slots)：
+    "end" 为右闭区间，00:15–01:00 归入 01:00，24:00 (或次日 00:00) 属于当天；
+    "start" 为左闭区间，00:00–00:45 归入 01:00。
+    """
+    if date_col:
+        if convention is None:
+            codes = label_codes(chunk[time_col])
+            codes = codes[codes >= 0]
+            convention = "end" if DAY_MINUTES in codes or 0 not in codes else "start"
+        slots = time_slots(chunk[time_col], points=96, convention=convention)
+        hours = np.where(slots >= 0, slots // 4 + 1, -1)
+        return chunk[date_col].astype(str).to_numpy(), hours, convention
+    text = chunk[time_col].astype(str).str.strip()
+    is_24 = text.str.contains("24:00", regex=False).to_numpy()
+    text = text.str.replace("24:00", "00:00", regex=False)
+    try:
+        ts = pd.to_datetime(text)  # 格式统一时按首行推断的格式整列向量化解析
+    except (ValueError, TypeError):
+        ts = pd.to_datetime(text, errors="coerce", format="mixed")
+    ts = ts + pd.to_timedelta(is_24.astype(int), unit="D")
+    if convention is None:
+        # 出现 24:00，或最早的记录不在零点 (首条为 00:15)：结束时刻约定
+        first = ts.min()
+        convention = "end" if is_24.any() or pd.isna(first) or first != first.normalize() else "start"
+    # 结束时刻约定下往前挪 1 分钟再取整点：00:00 (即前一天 24:00) 归到前一天的第 24 小时
+    shifted = ts - pd.Timedelta(minutes=1) if convention == "end" else ts
+    dates = shifted.dt.normalize().to_numpy()  # 保持 datetime64 分组，最后只对聚合结果格式化
+    hours = (shifted.dt.hour + 1).fillna(-1).astype(int).to_numpy()
+    return dates, hours, convention
+
+
+def _combine(partials, group_cols):
+    return pd.concat(partials).groupby(group_cols, sort=False, observed=True).sum()
+
+
+def stream_aggregate_96_to_24(source, time_col, date_col="", key_cols=(), usecols=None,
+                              block_bytes=STREAM_BLOCK_BYTES, convention=None):
+    """
+    流式把 15 分钟长表聚合为小时均值长表：列为 分组列 + 日期 + 时间 (01:00..24:00) + 各数值列。
+    数值列为除时间/日期/分组列外的所有列 (或 usecols 中的其余列)。
+    convention 为时刻标签约定 "end" / "start"，None 时按第一块数据自动判断。
+    """
+    key_cols = list(key_cols)
+    label_cols = key_cols + [time_col] + ([date_col] if date_col else [])
+    column_types = {c: pa.string() for c in label_cols} if pa is not None else None
+    group_cols = key_cols + ["日期", "小时"]
+
+    partials, value_cols, dropped = [], None, 0
+    for chunk in iter_csv_chunks(source, usecols=usecols, column_types=column_types, block_bytes=block_bytes):
+        if value_cols is None:
+            value_cols = [c for c in chunk.columns if c not in label_cols]
+        dates, hours, convention = _hour_buckets(chunk, time_col, date_col, convention)
+        dropped += int((hours <= 0).sum())
+        values = chunk[value_cols].apply(pd.to_numeric, errors="coerce")
+        part = pd.concat([chunk[key_cols].reset_index(drop=True),
+                          pd.DataFrame({"日期": dates, "小时": hours}),
+                          values.reset_index(drop=True),
+                          values.notna().add_suffix("__n").astype(np.int32).reset_index(drop=True)], axis=1)
+        part = part[part["小时"] > 0]
+        partials.append(part.groupby(group_cols, sort=False, observed=True).sum())
+        if len(partials) >= COMBINE_EVERY:
+            partials = [_combine(partials, group_cols)]
+
+    if dropped:
+        warnings.warn(f"96->24 聚合：{dropped} 行无法归入任何小时 (时间列 {time_col!r} 解析失败或不在 15 分钟整点上，"
+                      f"时刻约定 {convention!r})，已丢弃", stacklevel=2)
+    if not partials:
+        return pd.DataFrame(columns=group_cols)
+    total = _combine(partials, group_cols)
+    counts = total[[f"{c}__n" for c in value_cols]].to_numpy()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = total[value_cols].to_numpy() / counts
+    result = pd.DataFrame(means, index=total.index, columns=value_cols).reset_index()
+    result = result.sort_values(group_cols, kind="stable").reset_index(drop=True)
+    if pd.api.types.is_datetime64_any_dtype(result["日期"]):
+        result["日期"] = result["日期"].dt.strftime("%Y-%m-%d")
+    result.insert(len(key_cols) + 1, "时间", np.asarray(slot_labels(24))[result.pop("小时").to_numpy() - 1])
+    return result
+
+
+def read_csv_upload(source, options=None):
+    """按 CsvOptions 读取上传的 CSV：流式聚合或整表快速读取"""
+    options = options or CsvOptions()
+    usecols = list(options.usecols) or None
+    if options.aggregate and options.time_col:
+        if usecols:
+            # 聚合需要的列必须保留
+            needed = list(options.key_cols) + [options.time_col] + ([options.date_col] if options.date_col else [])
+            usecols = list(dict.fromkeys(needed + usecols))
+        return stream_aggregate_96_to_24(source, options.time_col, options.date_col, options.key_cols, usecols)
+    return read_csv_fast(source, usecols)
+
+
+def _split(text):
+    return tuple(p.strip() for p in text.replace("，", ",").split(",") if p.strip())
+
+
+def render_csv_options(key="csv"):
+    """侧边栏 CSV 读取选项，返回 CsvOptions"""
+    import streamlit as st
+
+    with st.expander("⚙️ CSV 读取选项 (大文件)"):
+        usecols = st.text_input("只读取这些列 (逗号分隔，留空为全部)", key=f"{key}_usecols")
+        aggregate = st.toggle("边读边做 96→24 小时均值", key=f"{key}_aggregate",
+                              help="适合电表级长表：15 分钟数据不整体载入内存")
+        time_col = date_col = key_cols = ""
+        if aggregate:
+            time_col = st.text_input("时间列 (完整时间戳或时刻)", key=f"{key}_time_col")
+            date_col = st.text_input("日期列 (时间列只有时刻时填写)", key=f"{key}_date_col")
+            key_cols = st.text_input("分组列 (如电表号，逗号分隔)", key=f"{key}_key_cols")
+    return CsvOptions(_split(usecols), aggregate, time_col.strip(), date_col.strip(), _split(key_cols))
@@ -0,0 +1,180 @@
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# ================= 分页数据预览 =================
+# 代替 st.dataframe(df.head(5))：在服务端完成筛选、排序、分页，只把当前页发给浏览器。
+# 排序 / 数值区间筛选用到的列会建立一次排序索引 (argsort + 名次)，之后翻页、换方向都是 O(页大小)。
+
+PAGE_SIZES = [20, 50, 100, 500]
+MAX_INDEXES = 8  # 每个会话最多缓存的列索引数
+_NO_FILTER = "(不筛选)"
+_NO_SORT = "(原始顺序)"
+
+
+class ColumnIndex:
+    """单列排序索引：order[i] 为第 i 小的行号 (空值排最后)，rank[row] 为该行的名次"""
+
+    def __init__(self, series):
+        s = series.reset_index(drop=True)
+        try:
+            order = s.sort_values(kind="stable", na_position="last").index.to_numpy()
+        except TypeError:
+            # 混合类型列按字符串排序
+            order = s.astype(str).sort_values(kind="stable").index.to_numpy()
+        self.order = order
+        self.rank = np.empty(len(order), dtype=np.int64)
+        self.rank[order] = np.arange(len(order))
+        self.valid = int(s.notna().sum())
+        self.numeric = pd.api.types.is_numeric_dtype(s) or pd.api.types.is_datetime64_any_dtype(s)
+        self.sorted_values = s.to_numpy()[order[:self.valid]] if self.numeric else None
+
+    def range_positions(self, lo=None, hi=None):
+        """数值区间 [lo, hi] 的行号 (按该列升序)，二分查找，不扫描整列"""
+        start = 0 if lo is None else np.searchsorted(self.sorted_values, lo, side="left")
+        stop = self.valid if hi is None else np.searchsorted(self.sorted_values, hi, side="right")
+        return self.order[start:stop]
+
+    def sort(self, positions, descending=False):
+        """按该列名次重排任意行号子集"""
+        # 降序时空值仍排在最后
+        if positions is None:
+            if not descending:
+                return self.order
+            return np.concatenate([self.order[:self.valid][::-1], self.order[self.valid:]])
+        ranks = self.rank[positions]
+        if descending:
+            ranks = np.where(ranks < self.valid, -ranks, ranks)
+        return positions[np.argsort(ranks, kind="stable")]
+
+
+def _index_cache():
+    import streamlit as st
+    if "_preview_indexes" not in st.session_state:
+        st.session_state["_preview_indexes"] = OrderedDict()
+    return st.session_state["_preview_indexes"]
+
+
+def get_column_index(df, col_pos):
+    """取 (或建立) df 第 col_pos 列的索引；df 被替换/回收后旧索引自动失效"""
+    cache = _index_cache()
+    key = (id(df), col_pos)
+    hit = cache.get(key)
+    if hit is not None and hit[0]() is df:
+        cache.move_to_end(key)
+        return hit[1]
+    index = ColumnIndex(df.iloc[:, col_pos])
+    cache[key] = (weakref.ref(df), index)
+    while len(cache) > MAX_INDEXES:
+        cache.popitem(last=False)
+    return index
+
+
+def _parse_bound(text, is_datetime):
+    text = text.strip()
+    if not text:
+        return None
+    return pd.Timestamp(text).to_datetime64() if is_datetime else float(text)
+
+
+def select_rows(df, filter_col=None, lo=None, hi=None, contains=None, sort_col=None, descending=False):
+    """
+    返回满足条件的行号数组 (None 表示全部、原始顺序)。
+    数值/时间列走排序索引的二分查找，文本列走一次向量化 str.contains。
+    """
+    positions = None
+    if filter_col is not None:
+        if lo is not None or hi is not None:
+            positions = get_column_index(df, filter_col).range_positions(lo, hi)
+            if sort_col is None:
+                positions = np.sort(positions)
+        elif contains:
+            mask = df.iloc[:, filter_col].astype(str).str.contains(contains, regex=False, na=False)
+            positions = np.flatnonzero(mask.to_numpy())
+    if sort_col is not None:
+        positions = get_column_index(df, sort_col).sort(positions, descending)
+    return positions
+
+
+def render_data_preview(data, key, default_page_size=20):
+    """
+    分页预览组件。data 可以是 DataFrame 或 DataHandle；
+    未筛选/排序时若句柄已落盘，只从 Parquet 读取当前页所在的行组。
+    """
+    import streamlit as st
+
+    handle = None if isinstance(data, pd.DataFrame) else data
+    n_rows, n_cols = data.shape
+    columns = data.columns if handle is None else None
+
+    c1, c2, c3, c4 = st.columns([3, 3, 2, 2])
+    with c4:
+        page_size = st.selectbox("每页行数", PAGE_SIZES, index=PAGE_SIZES.index(default_page_size)
+                                 if default_page_size in PAGE_SIZES else 0, key=f"{key}_size")
+
+    df = None
+    if handle is not None:
+        # 句柄：只有真正需要筛选/排序时才取整表
+        wants_query = st.session_state.get(f"{key}_filter", _NO_FILTER) != _NO_FILTER or \
+            st.session_state.get(f"{key}_sort", _NO_SORT) != _NO_SORT
+        if wants_query or not hasattr(handle, "read_rows"):
+            df = handle.get()
+        columns = df.columns if df is not None else handle.columns()
+    else:
+        df = data
+
+    col_labels = [str(c) for c in columns]
+    with c1:
+        filter_choice = st.selectbox("筛选列", [_NO_FILTER] + col_labels, key=f"{key}_filter")
+    with c2:
+        sort_choice = st.selectbox("排序列", [_NO_SORT] + col_labels, key=f"{key}_sort")
+    with c3:
+        descending = st.toggle("降序", key=f"{key}_desc")
+
+    filter_col = None if filter_choice == _NO_FILTER else col_labels.index(filter_choice)
+    sort_col = None if sort_choice == _NO_SORT else col_labels.index(sort_choice)
+
+    lo = hi = contains = None
+    if filter_col is not None:
+        series = df.iloc[:, filter_col]
+        is_datetime = pd.api.types.is_datetime64_any_dtype(series)
+        if pd.api.types.is_numeric_dtype(series) or is_datetime:
+            f1, f2 = st.columns(2)
+            with f1:
+                lo_text = st.text_input("最小值", key=f"{key}_lo")
+            with f2:
+                hi_text = st.text_input("最大值", key=f"{key}_hi")
+            try:
+                lo, hi = _parse_bound(lo_text, is_datetime), _parse_bound(hi_text, is_datetime)
+            except ValueError:
+                st.warning("区间格式无法识别，已忽略")
+        else:
+            contains = st.text_input("包含文本", key=f"{key}_contains")
+
+    positions = None
+    if df is not None:
+        positions = select_rows(df, filter_col, lo, hi, contains, sort_col, descending)
+    total = n_rows if positions is None else len(positions)
+    pages = max(1, -(-total // page_size))
+
+    # 筛选后总页数变少时，把旧页码夹回范围内
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages
+
+    p1, p2 = st.columns([1, 4])
+    with p1:
+        page = st.number_input("页码", min_value=1, max_value=pages, value=1, step=1, key=f"{key}_page")
+    start = (page - 1) * page_size
+    stop = min(start + page_size, total)
+
+    if positions is not None:
+        window = df.iloc[positions[start:stop]]
+    elif df is not None:
+        window = df.iloc[start:stop]
+    else:
+        window = handle.read_rows(start, stop)
+    st.dataframe(window, use_container_width=True)
+    with p2:
+        st.caption(f"第 {start + 1 if total else 0}–{stop} 行 / 共 {total} 行 (全表 {n_rows} 行 × {n_cols} 列)")
@@ -0,0 +1,122 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from resolution import dst_hours
+
+# ================= 时段数据质量检查 / 批量补缺 =================
+# 转换前对每个 Sheet 的时段行做一次体检，全部在二维数组上向量化完成 (按列并行)：
+# - 时段层面：缺失时段、重复时段、整天多/少 1 小时 (如 96 点数据的 92/100 点，疑似夏令时切换日)；
+# - 数值层面：空值、负值、离群值 (中位数 ± OUTLIER_MAD 倍稳健标准差)。
+# 发现缺口时可选按时段批量补齐：线性插值 / 前值填充 / 补零。
+
+OUTLIER_MAD = 6.0          # 离群阈值：偏离中位数超过 6 倍稳健标准差 (1.4826 * MAD)
+MIN_COVERAGE = 0.75        # 至少有这么多比例的时段有数据才允许补缺，避免把小时数据"插值"成 15 分钟数据
+DST_HINTS = {-1: "夏令时开始日 (少 1 小时)", 1: "夏令时结束日 (多 1 小时)"}
+
+FILL_NONE = "不填补"
+FILL_INTERPOLATE = "线性插值"
+FILL_FFILL = "前值填充"
+FILL_ZERO = "补零"
+FILL_METHODS = [FILL_NONE, FILL_INTERPOLATE, FILL_FFILL, FILL_ZERO]
+
+REPORT_COLUMNS = ["Sheet", "列", "时段行数", "缺失时段", "重复时段", "空值", "负值", "离群值", "提示"]
+
+
+def _numeric_block(df):
+    """数值矩阵 (行 x 列)；文本单元格视为空值"""
+    if all(pd.api.types.is_numeric_dtype(t) for t in df.dtypes):
+        return df.to_numpy(dtype=float, na_value=np.nan)
+    return df.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+
+def _format_slots(slots, limit=6):
+    text = ",".join(str(s + 1) for s in slots[:limit])
+    return text + ("…" if len(slots) > limit else "")
+
+
+def check_sheet(sheet_name, df_clean, slots, points=96):
+    """
+    检查一个 Sheet 的时段行 (order_by_slot 的结果)，返回报告行列表；没有问题时返回空列表。
+    报告里的时段号从 1 开始 (96 点数据的第 1 点 = 00:15)。
+    """
+    counts = np.bincount(slots[slots >= 0], minlength=points)[:points]
+    missing = np.flatnonzero(counts == 0)
+    duplicated = np.flatnonzero(counts > 1)
+    n = len(df_clean)
+
+    values = _numeric_block(df_clean)
+    nan = np.isnan(values)
+    nan_count = nan.sum(axis=0)
+    negative = (np.nan_to_num(values, nan=0.0) < 0).sum(axis=0)
+    if n:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # 整列为空时 nanmedian 会告警
+            median = np.nanmedian(values, axis=0)
+            mad = np.nanmedian(np.abs(values - median), axis=0) * 1.4826
+        with np.errstate(invalid="ignore"):
+            outlier = ((np.abs(values - median) > OUTLIER_MAD * mad) & (mad > 0)).sum(axis=0)
+    else:
+        outlier = np.zeros(values.shape[1], dtype=int)
+
+    rows = []
+    hints = []
+    if dst_hours(n, points):
+        hints.append(f"{n} 点：疑似{DST_HINTS[dst_hours(n, points)]}")
+    elif n != points:
+        hints.append(f"时段行数 {n}，应为 {points}")
+    if len(missing) or len(duplicated) or hints:
+        rows.append({"Sheet": sheet_name, "列": "(全部)", "时段行数": n,
+                     "缺失时段": _format_slots(missing), "重复时段": _format_slots(duplicated),
+                     "空值": int(nan_count.sum()), "负值": int(negative.sum()), "离群值": int(outlier.sum()),
+                     "提示": "；".join(hints)})
+    bad = np.flatnonzero((nan_count > 0) | (negative > 0) | (outlier > 0))
+    for i in bad:
+        rows.append({"Sheet": sheet_name, "列": str(df_clean.columns[i]), "时段行数": n,
+                     "缺失时段": "", "重复时段": "",
+                     "空值": int(nan_count[i]), "负值": int(negative[i]), "离群值": int(outlier[i]), "提示": ""})
+    return rows
+
+
+def build_report(rows):
+    return pd.DataFrame(rows, columns=REPORT_COLUMNS)
+
+
+def fill_gaps(df_clean, slots, points=96, method=FILL_INTERPOLATE):
+    """
+    按时段补齐：重复时段取均值，缺失时段插入空行，再对所有列一次性填补空值。
+    返回 (补齐后的 DataFrame, 时段号 0..points-1)。
+    """
+    values = _numeric_block(df_clean)
+    valid = slots >= 0
+    sums = np.zeros((points, values.shape[1]))
+    hits = np.zeros((points, values.shape[1]))
+    observed = ~np.isnan(values[valid])
+    np.add.at(sums, slots[valid], np.where(observed, values[valid], 0.0))
+    np.add.at(hits, slots[valid], observed)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        grid = sums / hits  # 没有任何观测的位置为 NaN
+
+    filled = pd.DataFrame(grid, columns=df_clean.columns)
+    if method == FILL_INTERPOLATE:
+        filled = filled.interpolate(method="linear", limit_direction="both")
+    elif method == FILL_FFILL:
+        filled = filled.ffill().bfill()
+    elif method == FILL_ZERO:
+        filled = filled.fillna(0)
+    return filled, np.arange(points)
+
+
+def needs_fill(df_clean, slots, points=96):
+    """是否存在缺失/重复时段或空值"""
+    if len(df_clean) != points or len(pd.unique(slots)) != points:
+        return True
+    return bool(np.isnan(_numeric_block(df_clean)).any())
+
+
+def can_fill(df_clean, slots, points=96):
+    """夏令时切换日和覆盖率过低的表不补缺 (补出来的是虚构数据)"""
+    if dst_hours(len(df_clean), points):
+        return False
+    return len(pd.unique(slots[slots >= 0])) >= points * MIN_COVERAGE
@@ -0,0 +1,390 @@
+import atexit
+import hashlib
+import os
+import pickle
+import shutil
+import stat
+import tempfile
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from dtype_optimizer import optimize_sheets
+
+# ================= 进程级共享数据仓库 =================
+# 所有 Streamlit 会话共用一份 DataFrame：
+# - 按内容哈希寻址，相同的上传文件 / 相同的中间结果只存一份；
+# - 会话里只保存 DataHandle (句柄)，句柄被回收时引用计数减一，归零即删除；
+# - 内存超过 STORE_MEMORY_MB 时按 LRU 把仍被引用的数据落盘为 Parquet，下次访问再读回。
+# 仓库里的 DataFrame 会被多个会话同时引用，取出后请勿原地修改 (需要修改时先 copy)。
+# 内容指纹即数据版本号 (version)：存入 / 取出过的对象按身份记住其版本，再次 put 时不必重新哈希。
+# 全程使用 pandas 写时复制 (Copy-on-Write，pandas 3 默认开启，2.x 在此打开)：
+# 仓库里的版本不可变，会话直接引用；要修改时用 lazy_copy 得到新对象，只有被改动的列才真正复制。
+# 工作区检查点的 Parquet 文件可以用 attach 直接登记为"已落盘"条目：不读数据，首次 get 时再内存映射读入。
+
+STORE_MEMORY_MB = int(os.environ.get("STORE_MEMORY_MB", "2048"))
+STORE_DIR = os.environ.get("STORE_DIR") or os.path.join(tempfile.gettempdir(), "energy_data_store")
+MAX_UPLOADS = 64  # 上传文件索引只保留最近若干个
+SPILL_ROW_GROUP = 65536  # 落盘 Parquet 的行组大小，分页预览按行组读取
+
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+
+def lazy_copy(df):
+    """写时复制下的浅拷贝：O(1)，之后对副本的修改只复制改动到的列，不影响原对象"""
+    return df.copy(deep=False)
+
+
+def frame_key(df):
+    """DataFrame 的内容指纹 (数据 + 索引 + 列名 + 类型)"""
+    h = hashlib.blake2b(digest_size=16)
+    try:
+        h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    except TypeError:
+        # 单元格里有 list/dict 等不可哈希对象，放弃去重
+        return f"u_{uuid.uuid4().hex}"
+    h.update(repr((list(df.columns), [str(t) for t in df.dtypes], df.index.name)).encode())
+    return h.hexdigest()
+
+
+def write_parquet(df, path):
+    """
+    按仓库落盘格式写 Parquet：索引显式写成列 (按行组分页读取时才能还原正确的行标签)，行组大小 SPILL_ROW_GROUP。
+    列名不全是字符串 (或为 MultiIndex) 时用占位列名写入，返回原始列名的 pickle；否则返回 None。
+    """
+    columns = None
+    if not all(isinstance(c, str) for c in df.columns) or isinstance(df.columns, pd.MultiIndex):
+        columns = pickle.dumps(df.columns)
+        df = df.set_axis([f"c{i}" for i in range(df.shape[1])], axis=1)
+    df.to_parquet(path, index=True, row_group_size=SPILL_ROW_GROUP)
+    return columns
+
+
+class _Entry:
+    __slots__ = ("df", "shape", "labels", "nbytes", "refs", "path", "columns", "external")
+
+    def __init__(self, df, nbytes, shape=None, labels=None):
+        self.df = df
+        self.shape = df.shape if df is not None else shape
+        self.labels = df.columns if df is not None else labels  # 落盘后预览仍需要列名
+        self.nbytes = nbytes
+        self.refs = 0
+        self.path = None      # 落盘后的 Parquet 路径
+        self.columns = None   # 落盘时替换掉的原始列名
+        self.external = False # path 是外部文件 (检查点)，引用归零时不删除
+
+
+class DataHandle:
+    """会话里保存的轻量句柄；句柄被回收时自动释放仓库中的引用"""
+
+    __slots__ = ("key", "shape", "_store", "__weakref__")
+
+    def __init__(self, store, key, shape):
+        self._store = store
+        self.key = key
+        self.shape = shape
+        store._incref(key)
+
+    def get(self):
+        return self._store.get(self.key)
+
+    def read_rows(self, start, stop):
+        return self._store.read_rows(self.key, start, stop)
+
+    def columns(self):
+        return self._store._entries[self.key].labels
+
+    def nbytes(self):
+        return self._store._entries[self.key].nbytes
+
+    def __del__(self):
+        try:
+            self._store._decref(self.key)
+        except Exception:
+            pass
+
+    def __repr__(self):
+        return f"DataHandle({self.key[:8]}, shape={self.shape})"
+
+
+class DataStore:
+    def __init__(self, memory_mb=STORE_MEMORY_MB, spill_dir=STORE_DIR):
+        self.memory_limit = memory_mb * 1024 * 1024
+        # 每个进程 (各个 App 各自是一个 Streamlit 进程) 用自己的子目录，互不覆盖、互不清理
+        ensure_private_dir(spill_dir)  # 先确认目录属于当前用户，再清理其中的旧目录
+        _remove_stale(spill_dir)
+        self.spill_dir = tempfile.mkdtemp(prefix=f"p{os.getpid()}_", dir=spill_dir)
+        atexit.register(shutil.rmtree, self.spill_dir, True)
+        self._entries = OrderedDict()  # 按最近访问排序，队首最久未用
+        self._uploads = OrderedDict()  # 上传内容指纹 -> ({sheet_name: frame_key}, 压缩前后内存)
+        self._memory = 0
+        self._versions = {}  # id(df) -> (弱引用, 版本)；对象被回收时自动移除
+        self._lock = threading.RLock()
+
+    # ---------- 对外接口 ----------
+
+    def version(self, df):
+        """DataFrame 的数据版本 (内容指纹)；同一对象只计算一次"""
+        with self._lock:
+            known = self._versions.get(id(df))
+            if known is not None and known[0]() is df:
+                return known[1]
+        key = frame_key(df)
+        self._remember(df, key)
+        return key
+
+    def put(self, df):
+        """存入 DataFrame (已存在相同内容则复用)，返回句柄"""
+        key = self.version(df)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _Entry(df, int(df.memory_usage(deep=True).sum()))
+                self._entries[key] = entry
+                self._memory += entry.nbytes
+            elif entry.df is None:
+                # 已落盘的相同内容：直接用手上这份，省一次读盘
+                entry.df = df
+                self._memory += entry.nbytes
+            self._entries.move_to_end(key)
+            handle = DataHandle(self, key, df.shape)
+            self._evict()
+        return handle
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries[key]
+            self._entries.move_to_end(key)
+            if entry.df is None:
+                entry.df = self._load(entry)
+                self._remember(entry.df, key)
+                self._memory += entry.nbytes
+                self._evict(keep=key)
+            return entry.df
+
+    def attach(self, key, path, shape, labels, nbytes, renamed=False):
+        """
+        登记磁盘上已有的 Parquet (write_parquet 格式，如工作区检查点) 并返回句柄：此时不读数据，
+        首次 get 时内存映射读入，分页预览只读需要的行组。文件归调用方所有，引用归零时不删除。
+        renamed: 文件里是占位列名 (write_parquet 返回了原始列名)，读入后换回 labels。
+        """
+        with self._lock:
+            if key not in self._entries:
+                entry = _Entry(None, nbytes, tuple(shape), labels)
+                entry.path, entry.external = path, True
+                entry.columns = pickle.dumps(labels) if renamed else None
+                self._entries[key] = entry
+            return DataHandle(self, key, self._entries[key].shape)
+
+    def save_copy(self, key, path):
+        """把 key 对应的数据存为 path (write_parquet 格式)，已落盘的直接复制文件；返回原始列名 pickle 或 None"""
+        with self._lock:
+            entry = self._entries[key]
+            df, spilled, columns = entry.df, entry.path, entry.columns
+        if df is None:
+            shutil.copyfile(spilled, path)
+            return columns
+        return write_parquet(df, path)
+
+    def read_rows(self, key, start, stop):
+        """读取 [start, stop) 行；已落盘的数据只读取覆盖这些行的 Parquet 行组，不整表载入"""
+        with self._lock:
+            entry = self._entries[key]
+            if entry.df is not None:
+                return entry.df.iloc[start:stop]
+            path, columns = entry.path, entry.columns
+        pf = pq.ParquetFile(path)
+        groups, offset, first = [], 0, None
+        for i in range(pf.num_row_groups):
+            n = pf.metadata.row_group(i).num_rows
+            if offset + n > start and offset < stop:
+                groups.append(i)
+                first = offset if first is None else first
+            offset += n
+        if not groups:
+            return self.get(key).iloc[0:0]
+        df = pf.read_row_groups(groups, use_pandas_metadata=True).to_pandas()
+        if columns is not None:
+            df.columns = pickle.loads(columns)
+        return df.iloc[start - first:stop - first]
+
+    def put_sheets(self, sheets):
+        return {name: self.put(df) for name, df in sheets.items()}
+
+    def load_upload(self, raw, parse, *params, report=None):
+        """
+        上传文件去重：同一份文件 (+相同读取参数) 只解析一次，其他会话直接拿到已有数据的句柄。
+        parse() 需返回 {sheet_name: DataFrame}；解析结果先做类型压缩再入库。
+        report 传入 dict 时写入压缩前后的内存占用 (复用已有数据时也会给出)。
+        """
+        upload_key = hashlib.blake2b(raw, digest_size=16).hexdigest() + repr(params)
+        with self._lock:
+            cached = self._uploads.get(upload_key)
+            if cached is not None and all(k in self._entries for k in cached[0].values()):
+                self._uploads.move_to_end(upload_key)
+                if report is not None:
+                    report.update(cached[1])
+                return {name: DataHandle(self, k, self._entries[k].shape) for name, k in cached[0].items()}
+        sizes = {}
+        handles = self.put_sheets(optimize_sheets(parse(), sizes))
+        if report is not None:
+            report.update(sizes)
+        with self._lock:
+            self._uploads[upload_key] = ({name: h.key for name, h in handles.items()}, sizes)
+            while len(self._uploads) > MAX_UPLOADS:
+                self._uploads.popitem(last=False)
+        return handles
+
+    def stats(self):
+        with self._lock:
+            spilled = sum(1 for e in self._entries.values() if e.df is None)
+            return {
+                "entries": len(self._entries),
+                "spilled": spilled,
+                "memory_mb": round(self._memory / 1024 / 1024, 1),
+                "refs": sum(e.refs for e in self._entries.values()),
+            }
+
+    def _remember(self, df, key):
+        ident = id(df)
+
+        def forget(_, ident=ident):
+            with self._lock:
+                known = self._versions.get(ident)
+                if known is not None and known[0]() is None:
+                    del self._versions[ident]
+
+        with self._lock:
+            self._versions[ident] = (weakref.ref(df, forget), key)
+
+    # ---------- 引用计数 ----------
+
+    def _incref(self, key):
+        with self._lock:
+            self._entries[key].refs += 1
+
+    def _decref(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.refs -= 1
+            if entry.refs <= 0:
+                del self._entries[key]
+                if entry.df is not None:
+                    self._memory -= entry.nbytes
+                if entry.path and not entry.external:
+                    _remove(entry.path)
+
+    # ---------- LRU 落盘 ----------
+
+    def _evict(self, keep=None):
+        if self._memory <= self.memory_limit:
+            return
+        for key, entry in list(self._entries.items()):
+            if self._memory <= self.memory_limit:
+                break
+            if key == keep or entry.df is None:
+                continue
+            if entry.path is None and not self._spill(key, entry):
+                continue
+            entry.df = None
+            self._memory -= entry.nbytes
+
+    def _spill(self, key, entry):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"{key}.parquet")
+        try:
+            entry.columns = write_parquet(entry.df, path)
+        except Exception:
+            # Arrow 无法表示的列 (混合类型 object 等) 只能常驻内存
+            entry.columns = None
+            _remove(path)
+            return False
+        entry.path = path
+        return True
+
+    def _load(self, entry):
+        df = pd.read_parquet(entry.path, memory_map=True)
+        if entry.columns is not None:
+            df.columns = pickle.loads(entry.columns)
+        return df
+
+
+def ensure_private_dir(path):
+    """
+    创建 (或收紧) 只有当前用户可访问的目录并返回路径。共享的 /tmp 下存放会被读回的文件时使用：
+    目录属于其他用户 (可能被预先放入或篡改文件) 时报错，而不是继续读写。
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.stat(path)
+    if hasattr(os, "getuid"):
+        if info.st_uid != os.getuid():
+            raise PermissionError(f"目录 {path} 不属于当前用户，拒绝使用")
+        if info.st_mode & 0o077:
+            os.chmod(path, 0o700)
+    return path
+
+
+def _remove_stale(root):
+    """
+    清理已退出进程留下的落盘目录 (目录名前缀 p<pid>_)；仍在运行的进程的目录不动。
+    root 须已通过 ensure_private_dir 检查；其中的符号链接和不属于当前用户的条目也不动。
+    """
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return
+    for name in names:
+        pid = name[1:].split("_")[0]
+        if not (name.startswith("p") and pid.isdigit()) or int(pid) == os.getpid():
+            continue
+        path = os.path.join(root, name)
+        try:
+            info = os.lstat(path)
+        except OSError:
+            continue
+        if not stat.S_ISDIR(info.st_mode) or (hasattr(os, "getuid") and info.st_uid != os.getuid()):
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass  # 进程存在但属于其他用户
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_data_store():
+    """进程级单例：所有 Streamlit 会话共用"""
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = DataStore()
+        return _STORE
+
+
+def switch_sheet(store, sheets, old_name, current_df, new_name, keep=True):
+    """
+    各 App 的工作表切换：sheets 为 {Sheet 名: DataHandle}，返回新表的 DataFrame。
+    keep=True 时先把当前表 (含已执行的步骤) 存回 sheets[old_name]。全程只存取句柄、不复制数据：
+    仓库里的版本不可变，切入时直接引用，之后的修改由写时复制只复制改动到的列。
+    """
+    if keep and current_df is not None and old_name in sheets:
+        sheets[old_name] = store.put(current_df)
+    return sheets[new_name].get()
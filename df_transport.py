@@ -0,0 +1,284 @@
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import uuid
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import NamedTuple
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # 没有 pyarrow 时全部走 pickle 通道
+    pa = None
+
+# ================= 进程间 DataFrame 传输 =================
+# 把 DataFrame 序列化为 Arrow IPC 写进共享内存，只在进程间传递一个很小的句柄。
+# - 共享内存 (/dev/shm) 放不下的大表改写为磁盘上的 Feather (Arrow IPC 文件)，同样按内存映射读取；
+# - attach(zero_copy=True) 直接在映射内存上构造 DataFrame，数值列不再拷贝 (结果只读)；
+# - Arrow 无法表示的对象 (混合类型 object 列、非 DataFrame 返回值) 自动退回 pickle。
+
+# 单个对象超过此大小或超过 /dev/shm 剩余空间的 80% 时落盘 (Docker 默认 /dev/shm 只有 64MB)
+SHM_MAX_BYTES = int(os.environ.get("DF_SHM_MAX_MB", "1024")) * 1024 * 1024
+SPILL_DIR = os.environ.get("DF_SPILL_DIR") or os.path.join(tempfile.gettempdir(), "df_transport")
+
+
+class ShmHandle(NamedTuple):
+    name: str
+    size: int
+    kind: str  # "arrow" (共享内存) | "feather" (磁盘文件，name 为路径) | "pickle"
+    columns: bytes = None  # 非字符串列名 (如宽表的日期表头) 单独 pickle，Arrow 里用位置名代替
+
+
+def _untrack(shm):
+    """共享内存的生命周期由 attach()/release() 显式管理，不交给 resource_tracker，
+    否则发布方进程退出时会把已经被对方读取并回收的块再 unlink 一次并告警"""
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+def _shm_path(name):
+    return os.path.join("/dev/shm", name.lstrip("/"))
+
+
+def _attach_shm(name):
+    return _untrack(shared_memory.SharedMemory(name=name))
+
+
+def _new_shm(size):
+    return _untrack(shared_memory.SharedMemory(name=f"df_{uuid.uuid4().hex[:16]}", create=True, size=max(size, 1)))
+
+
+def _unlink(shm):
+    # SharedMemory.unlink() 内部会向 resource_tracker 注销一次，先补登记保持计数平衡
+    try:
+        resource_tracker.register(shm._name, "shared_memory")
+    except Exception:
+        pass
+    shm.unlink()
+
+
+def _shm_fits(size):
+    if size > SHM_MAX_BYTES:
+        return False
+    try:
+        st = os.statvfs("/dev/shm")
+    except (OSError, AttributeError):
+        return True  # 非 Linux：由系统分配，不做预判
+    # tmpfs 写满时进程会直接收到 SIGBUS，所以必须提前判断
+    return size < st.f_bavail * st.f_frsize * 0.8
+
+
+def _has_plain_columns(df):
+    cols = df.columns
+    if isinstance(cols, pd.MultiIndex):
+        return all(isinstance(c, str) for level in cols.levels for c in level)
+    return all(isinstance(c, str) for c in cols) and cols.is_unique
+
+
+def _publish_frame(df):
+    columns = None
+    if not _has_plain_columns(df):
+        columns = pickle.dumps(df.columns, protocol=pickle.HIGHEST_PROTOCOL)
+        df = df.set_axis([f"c{i}" for i in range(df.shape[1])], axis=1)
+    table = pa.Table.from_pandas(df, preserve_index=None)
+    # 先用 MockOutputStream 量出大小，再直接写进目标位置，避免中间缓冲区多拷贝一次
+    mock = pa.MockOutputStream()
+    with pa.ipc.new_stream(mock, table.schema) as writer:
+        writer.write_table(table)
+    size = mock.size()
+
+    if not _shm_fits(size):
+        os.makedirs(SPILL_DIR, exist_ok=True)
+        path = os.path.join(SPILL_DIR, f"df_{uuid.uuid4().hex[:16]}.feather")
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        return ShmHandle(path, size, "feather", columns)
+
+    shm = _new_shm(size)
+    buf = pa.py_buffer(shm.buf)
+    sink = pa.FixedSizeBufferWriter(buf)
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    sink.close()
+    del sink, buf, writer
+    shm.close()
+    return ShmHandle(shm.name, size, "arrow", columns)
+
+
+def _publish_pickle(obj):
+    payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    shm = _new_shm(len(payload))
+    shm.buf[:len(payload)] = payload
+    shm.close()
+    return ShmHandle(shm.name, len(payload), "pickle")
+
+
+def publish(obj):
+    """发布对象，返回可跨进程传递的句柄；dict 会逐项发布 (适配 dfs_dict)"""
+    if isinstance(obj, dict):
+        return {k: publish(v) for k, v in obj.items()}
+    if pa is not None and isinstance(obj, pd.DataFrame):
+        try:
+            return _publish_frame(obj)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, TypeError, ValueError):
+            pass
+    return _publish_pickle(obj)
+
+
+def _table_to_pandas(table, zero_copy):
+    # split_blocks=True 时不合并成二维块，无空值的数值列直接引用 Arrow 内存 (只读)
+    if zero_copy:
+        return table.to_pandas(split_blocks=True)
+    return table.to_pandas()
+
+
+def attach(handle, unlink=True, zero_copy=False):
+    """
+    根据句柄还原对象；默认读取后立即释放共享内存/临时文件。
+    zero_copy=True 时数值列直接映射共享内存，得到的 DataFrame 只读，
+    适合展示、导出或再次发布；需要原地修改的场景 (如交给生成代码) 请保持默认。
+    """
+    if isinstance(handle, dict):
+        return {k: attach(v, unlink=unlink, zero_copy=zero_copy) for k, v in handle.items()}
+
+    if handle.kind == "feather":
+        source = pa.memory_map(handle.name)
+        obj = _table_to_pandas(pa.ipc.open_file(source).read_all(), zero_copy)
+        if unlink:
+            _remove_file(handle.name)
+        return _restore_columns(obj, handle)
+
+    if handle.kind == "arrow" and os.path.exists(_shm_path(handle.name)):
+        # Linux: 直接把 /dev/shm 下的块映射给 Arrow，缓冲区生命周期交给 Arrow 管理；
+        # unlink 只删除名字，已建立的映射在 DataFrame 释放前一直有效
+        source = pa.memory_map(_shm_path(handle.name))
+        obj = _table_to_pandas(pa.ipc.open_stream(source).read_all(), zero_copy)
+        if unlink:
+            os.unlink(_shm_path(handle.name))
+        return _restore_columns(obj, handle)
+
+    shm = _attach_shm(handle.name)
+    try:
+        if handle.kind == "arrow":
+            # 其他平台：先拷出字节，避免 pandas 对象引用 shm.buf 导致无法 close()
+            table = pa.ipc.open_stream(pa.py_buffer(bytes(shm.buf[:handle.size]))).read_all()
+            obj = _table_to_pandas(table, zero_copy)
+        else:
+            obj = pickle.loads(shm.buf[:handle.size])
+    finally:
+        shm.close()
+        if unlink:
+            _unlink(shm)
+    return _restore_columns(obj, handle)
+
+
+def _remove_file(path):
+    try:
+        os.unlink(path)
+    except PermissionError:
+        pass  # Windows 上映射中的文件无法删除，留给 clear_spill_dir() 清理
+    except FileNotFoundError:
+        pass
+
+
+def _restore_columns(obj, handle):
+    if handle.kind != "pickle" and handle.columns is not None:
+        obj.columns = pickle.loads(handle.columns)
+    return obj
+
+
+def release(handle):
+    """不读取，直接回收句柄对应的共享内存或临时文件 (出错/超时时清理用)"""
+    if isinstance(handle, dict):
+        for v in handle.values():
+            release(v)
+        return
+    if handle.kind == "feather":
+        _remove_file(handle.name)
+        return
+    try:
+        shm = _attach_shm(handle.name)
+        shm.close()
+        _unlink(shm)
+    except FileNotFoundError:
+        pass
+
+
+def clear_spill_dir():
+    """清理残留的落盘文件 (进程被强杀时可能遗留)"""
+    shutil.rmtree(SPILL_DIR, ignore_errors=True)
+
+
+# ================= 多 Sheet 并行解析 =================
+# openpyxl 解析是纯 Python、单线程的，几十个 Sheet 的工作簿大部分时间花在这里。
+# 把工作簿落到临时文件后，由子进程各自解析一个 Sheet，结果经上面的共享内存通道送回。
+
+PARALLEL_MIN_SHEETS = 4
+PARALLEL_MIN_BYTES = 512 * 1024
+_CPUS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+READ_WORKERS = int(os.environ.get("EXCEL_READ_WORKERS", str(min(4, _CPUS))))  # 单核环境自动退回串行
+
+_READ_POOL = None
+_READ_POOL_LOCK = threading.Lock()
+
+
+def _read_sheet_worker(path, sheet_name, read_kwargs):
+    df = pd.read_excel(path, sheet_name=sheet_name, **read_kwargs)
+    return publish(df)
+
+
+def _get_read_pool():
+    global _READ_POOL
+    with _READ_POOL_LOCK:
+        if _READ_POOL is None:
+            methods = mp.get_all_start_methods()
+            ctx = mp.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _READ_POOL = ProcessPoolExecutor(max_workers=READ_WORKERS, mp_context=ctx)
+        return _READ_POOL
+
+
+def read_excel_sheets(data, sheet_names=None, **read_kwargs):
+    """
+    读取工作簿的全部 Sheet (或 sheet_names 指定的部分 Sheet)，返回 {sheet_name: DataFrame}，
+    与 pd.read_excel(sheet_name=None) 等价。Sheet 多且文件较大时并行解析。
+    取回时复制一次成为普通可写 DataFrame：解析结果会成为工作表，生成代码常有 df.loc[...] = / inplace 修改。
+    """
+    raw = bytes(data) if isinstance(data, (bytes, bytearray)) else data.getvalue()
+
+    excel = pd.ExcelFile(io.BytesIO(raw))
+    if sheet_names is None:
+        sheet_names = excel.sheet_names
+    else:
+        sheet_names = [name for name in excel.sheet_names if name in set(sheet_names)]
+    if not sheet_names:
+        return {}
+    if pa is None or READ_WORKERS < 2 or len(sheet_names) < PARALLEL_MIN_SHEETS or len(raw) < PARALLEL_MIN_BYTES:
+        return pd.read_excel(excel, sheet_name=sheet_names, **read_kwargs)
+    excel.close()
+
+    os.makedirs(SPILL_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".xlsx", dir=SPILL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(raw)
+        pool = _get_read_pool()
+        futures = [pool.submit(_read_sheet_worker, path, name, read_kwargs) for name in sheet_names]
+        try:
+            handles = [f.result() for f in futures]
+        except Exception:
+            for f in futures:
+                if f.done() and f.exception() is None:
+                    release(f.result())
+            raise
+    finally:
+        os.unlink(path)
+    return {name: attach(h) for name, h in zip(sheet_names, handles)}
@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# ================= 读入时的类型压缩 =================
+# read_excel / read_csv 读出来的数值列一律是 float64，文本列是 object/str，
+# 同一张表里大量重复的站名、时刻标签各自占一份字符串。读入后统一压缩一遍：
+# - 浮点列保持 float64：降为 float32 会让 0.1 导出成 0.1000000014901161，转成整数类型又会让
+#   生成代码里的 df.loc[i, c] = 1.5、np.isnan 等常见写法报错，所以读入时不动浮点列；
+# - 整数列：最低只降到 int32，避免生成代码里 int8/int16 乘法静默溢出；
+# - 重复率高的文本列转 category 只用于只读的表 (转换工具)：AI 生成代码里 df.loc[i, '站名'] = 'C'、
+#   s.where(cond, '其他') 等写入新取值的常见写法会对 category 列报错，AI 应用读入时 (DataStore.load_upload)
+#   不做这一步 (categories=False)。
+# 行标签 (时刻) 保持原样：生成代码和转换工具都按标签文本识别时段。
+# 设置 INGEST_OPTIMIZE_DTYPES=0 可关闭。
+
+OPTIMIZE_DTYPES = os.environ.get("INGEST_OPTIMIZE_DTYPES", "1") != "0"
+CATEGORY_MAX_RATIO = 0.5  # 不同取值数 / 行数 低于此比例才转 category
+
+
+def _memory(df):
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+def _smallest_int(values):
+    lo, hi = values.min(), values.max()
+    if np.iinfo(np.int32).min <= lo and hi <= np.iinfo(np.int32).max:
+        return "int32"
+    return "int64"
+
+
+def _optimize_column(s, categories=False):
+    """返回压缩后的列；无法压缩时原样返回。categories=True 时重复率高的文本列转 category"""
+    dtype = s.dtype
+    if pd.api.types.is_bool_dtype(dtype) or isinstance(dtype, pd.CategoricalDtype):
+        return s
+
+    if pd.api.types.is_integer_dtype(dtype) and dtype.itemsize > 4:
+        if len(s) and not isinstance(dtype, pd.api.extensions.ExtensionDtype):
+            return s.astype(_smallest_int(s.to_numpy()))
+        return s
+
+    if categories and (pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)):
+        n = len(s)
+        if n < 2:
+            return s
+        kind = pd.api.types.infer_dtype(s, skipna=True)
+        if kind not in ("string", "time", "date"):
+            return s
+        if s.nunique(dropna=True) < n * CATEGORY_MAX_RATIO:
+            return s.astype("category")
+    return s
+
+
+def optimize_frame(df, categories=False):
+    """压缩单个 DataFrame 的列类型，返回新 DataFrame (输入不变)；categories 见 _optimize_column"""
+    out = df.copy(deep=False)
+    for i in range(out.shape[1]):
+        col = out.iloc[:, i]
+        new = _optimize_column(col, categories)
+        if new is not col:
+            out.isetitem(i, new)
+    return out
+
+
+def optimize_sheets(sheets, report=None, categories=False):
+    """
+    压缩 {sheet_name: DataFrame} 中的每张表。
+    report 传入 dict 时写入 before_bytes / after_bytes，便于界面展示压缩效果。
+    categories=True 只用于之后不会被写入的表 (如转换工具读入的原表)。
+    """
+    before = after = 0
+    result = {}
+    for name, df in sheets.items():
+        if not isinstance(df, pd.DataFrame):
+            result[name] = df
+            continue
+        before += _memory(df)
+        if OPTIMIZE_DTYPES:
+            try:
+                df = optimize_frame(df, categories)
+            except Exception:
+                pass  # 压缩失败不影响读入，保留原表
+        after += _memory(df)
+        result[name] = df
+    if report is not None:
+        report["before_bytes"] = report.get("before_bytes", 0) + before
+        report["after_bytes"] = report.get("after_bytes", 0) + after
+    return result
+
+
+def format_memory_report(report):
+    before, after = report.get("before_bytes", 0), report.get("after_bytes", 0)
+    if not before:
+        return ""
+    ratio = before / after if after else float("inf")
+    return f"内存占用 {before / 1024 / 1024:.1f}MB → {after / 1024 / 1024:.1f}MB (压缩 {ratio:.1f}×)"
@@ -0,0 +1,119 @@
+import datetime
+import math
+import re
+import time
+from typing import Any, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from charts import downsample_for_plot
+from lazy_modules import LAZY_MODULES
+from forecasting import forecast_next_day
+from load_analytics import load_indicators
+from resolution import upsample_points
+from series_store import list_series, load_series
+from time_slots import slot_labels, time_slots
+
+# ================= AI 生成代码的执行环境 (各 App 与沙箱进程共用) =================
+
+
+def clean_energy_time(series):
+    """
+    【万能时间清洗器】
+    1. 能识别 '2026-01-01 24:00:00' -> 转为次日 00:00
+    2. 能识别纯时间 '24:00' -> 暂时保留或标记
+    3. 极其强健，不会因为一个错导致全盘崩溃
+    """
+    def parse_single_val(val):
+        s_val = str(val).strip()
+        # 针对电力行业特殊的 24:00 处理
+        if "24:00" in s_val:
+            # 将 24:00 替换为 00:00
+            temp_s = s_val.replace("24:00", "00:00")
+            try:
+                dt = pd.to_datetime(temp_s)
+                # 如果是包含日期的完整时间 (如 2026-01-01 24:00)，则加一天
+                if len(s_val) > 8:
+                    return dt + pd.Timedelta(days=1)
+                # 如果只是纯时间 (如 24:00)，先返回 00:00 (后续逻辑需配合日期处理)
+                return dt
+            except:
+                return pd.NaT
+        else:
+            # 正常时间
+            try:
+                return pd.to_datetime(val)
+            except:
+                return pd.NaT
+
+    # 优先尝试高速批量转换
+    try:
+        return pd.to_datetime(series)
+    except:
+        # 失败则进入逐行清洗模式
+        return series.apply(parse_single_val)
+
+
+def build_execution_globals():
+    """生成代码可直接使用的全局变量"""
+    return {
+        "pd": pd, "np": np, "re": re, "math": math, "datetime": datetime,
+        "clean_energy_time": clean_energy_time,
+        "time_slots": time_slots, "slot_labels": slot_labels,
+        "load_series": load_series, "list_series": list_series,
+        "upsample_points": upsample_points, "load_indicators": load_indicators,
+        "forecast_next_day": forecast_next_day, "downsample_for_plot": downsample_for_plot,
+        **LAZY_MODULES,  # scipy / sm / sklearn / plt：首次访问属性时才导入
+    }
+
+
+# 注入的工具函数的说明：各 App 的提示词统一引用这一份，新增 / 修改工具函数时与 build_execution_globals 一起更新
+HELPER_PROMPT = """\
+- `time_slots(labels, points=96)` maps time-of-day labels ('0:15', '00:15:00', '24:00', '第1点', ...) to integer slots 0..points-1 (-1 = not a time row) in one vectorized call; sort/group by these slots instead of parsing or sorting strings. `slot_labels(points)` returns the standard labels ('00:15' ... '24:00').
+- `load_series(station, start, end, metrics=None)` returns stored converted data as a (日期, 时间) x 指标 table (date range inclusive); `list_series()` lists stations and date ranges. Use them to compare with earlier days/months instead of asking for more uploads.
+- `upsample_points(df, points=96, method="linear")` expands hourly data to 15-minute points (24 -> 96) for ALL numeric columns at once; rows = time-of-day labels ('01:00' ... '24:00', one full day) or end-of-interval timestamps (may span many days). method: "step" (hold hourly value), "linear", "cubic" (spline), "profile" (smooth, keeps each hour's mean). Never write row-by-row interpolation.
+- `load_indicators(df)` computes daily peak/valley (and their times), load factor, peak-valley difference, ramp rates and energy for a wide table (rows or first column = time-of-day labels, one column per station); `load_indicators(df, time_col, date_col="", key_cols=[...])` does the same for long tables (one row per station per day). Never loop over stations or days.
+- `forecast_next_day(df, method="naive", points=None)` forecasts the next day (df indexed by end-of-interval timestamps or the (日期, 时间) index from `load_series`, one column per series). method: "naive" (same day last week / yesterday), "ets" (Holt-Winters), "gbm" (gradient boosting on lag features); points=24 returns hourly means. Do not write per-column model-fitting loops.
+- Charts: for a plot/曲线图 return the data to plot as a table (time index or first column, one column per curve); the app draws it with pixel-width downsampling. Do not call `plt` for on-screen charts. `downsample_for_plot(df, width=1200, method="minmax")` shrinks a long series ("lttb" keeps shape).
+- `scipy`, `sm` (statsmodels.api), `sklearn` and `plt` (matplotlib.pyplot) are imported on first use; do NOT import them inside `process_step`.
+"""
+
+
+class StepResult(NamedTuple):
+    value: Any                 # process_step 的返回值 (Styler 已剥离为 DataFrame)
+    explanation: str = None    # 代码中可选的 explanation 变量
+    styled: bool = False       # 原始返回值是否为 Styler
+    timings: dict = {}         # 各阶段耗时 (秒)
+
+
+def _is_styler(obj):
+    # --- 版本兼容的 Styler 检查 ---
+    try:
+        from pandas.io.formats.style import Styler
+        return isinstance(obj, Styler)
+    except ImportError:
+        return hasattr(obj, 'data') and hasattr(obj, 'render')
+
+
+def run_generated_code(code, arg):
+    """编译生成的代码并调用 process_step(arg)。沙箱进程和进程内回退共用这一份逻辑。"""
+    timings = {}
+    execution_globals = build_execution_globals()
+    local_scope = {}
+
+    start = time.perf_counter()
+    exec(code, execution_globals, local_scope)
+    timings["exec编译"] = time.perf_counter() - start
+
+    if 'process_step' not in local_scope:
+        raise ValueError("生成的代码中未找到 process_step 函数")
+
+    start = time.perf_counter()
+    result_obj = local_scope['process_step'](arg)
+    timings["process_step"] = time.perf_counter() - start
+
+    styled = _is_styler(result_obj)
+    if styled:
+        result_obj = result_obj.data
+    return StepResult(result_obj, local_scope.get('explanation'), styled, timings)
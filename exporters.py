@@ -0,0 +1,203 @@
+import io
+import re
+import zipfile
+from typing import NamedTuple
+
+import pandas as pd
+
+from header_layout import header_rows_for
+
+# ================= 结果导出 (Excel / Parquet / Feather / CSV) =================
+# .xlsx 由 openpyxl 逐个单元格写出，是最慢的格式且上限约 100 万行；
+# 下游系统只需要数据时可以选择列式格式，导出耗时通常低一个数量级。
+# 多个 Sheet 导出为非 Excel 格式时，每个 Sheet 一个文件，打包成 zip。
+# 双层表头的表在处理过程中是扁平列名，导出 Excel 时按 header_levels 映射还原为两行表头 (合并单元格)。
+
+FORMAT_EXCEL = "Excel (.xlsx)"
+FORMAT_PARQUET = "Parquet"
+FORMAT_FEATHER = "Feather"
+FORMAT_CSV = "CSV (gzip)"
+EXPORT_FORMATS = [FORMAT_EXCEL, FORMAT_PARQUET, FORMAT_FEATHER, FORMAT_CSV]
+PARQUET_COMPRESSIONS = ["zstd", "snappy", "gzip", "brotli", "none"]
+
+_EXTENSIONS = {FORMAT_EXCEL: ".xlsx", FORMAT_PARQUET: ".parquet", FORMAT_FEATHER: ".feather", FORMAT_CSV: ".csv.gz"}
+_MIMES = {
+    FORMAT_EXCEL: "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    FORMAT_PARQUET: "application/vnd.apache.parquet",
+    FORMAT_FEATHER: "application/vnd.apache.arrow.file",
+    FORMAT_CSV: "application/gzip",
+}
+
+
+class ExportResult(NamedTuple):
+    data: bytes
+    file_name: str
+    mime: str
+
+
+def _flat_name(col):
+    if isinstance(col, tuple):
+        parts = [str(p) for p in col if str(p) and not str(p).startswith("Unnamed")]
+        return "_".join(parts) or "_".join(str(p) for p in col)
+    return str(col)
+
+
+def _arrow_columns(df):
+    """Arrow 要求列名为不重复的字符串：多层表头拼接为一层，日期等表头转字符串"""
+    names, seen = [], {}
+    for col in df.columns:
+        name = _flat_name(col)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return df.set_axis(names, axis=1)
+
+
+def _stringify_objects(df):
+    # 混合类型 object 列 (如数字和文字混排) Arrow 无法推断类型，统一转为字符串
+    out = df.copy(deep=False)
+    for i in range(out.shape[1]):
+        if out.iloc[:, i].dtype == object:
+            out.isetitem(i, out.iloc[:, i].astype(str))
+    if out.index.dtype == object:
+        out.index = out.index.astype(str)
+    return out
+
+
+def _write_arrow(df, fmt, index, compression):
+    buf = io.BytesIO()
+    df = _arrow_columns(df)
+    if fmt == FORMAT_FEATHER:
+        # Feather 不保存行索引，需要时作为普通列写出
+        df = df.reset_index() if index else df.reset_index(drop=True)
+        df = _arrow_columns(df)
+    elif not index:
+        df = df.reset_index(drop=True)
+    try:
+        _arrow_to(buf, df, fmt, compression)
+    except Exception:
+        buf = io.BytesIO()
+        _arrow_to(buf, _stringify_objects(df), fmt, compression)
+    return buf.getvalue()
+
+
+def _arrow_to(buf, df, fmt, compression):
+    if fmt == FORMAT_FEATHER:
+        df.to_feather(buf)
+    else:
+        df.to_parquet(buf, index=None, compression=None if compression == "none" else compression)
+
+
+def _write_csv(df, index):
+    buf = io.BytesIO()
+    df.to_csv(buf, index=index, encoding="utf-8-sig", compression={"method": "gzip", "mtime": 0})
+    return buf.getvalue()
+
+
+def _merge_header(sheet, top, bottom, offset):
+    """第一层相同的相邻列横向合并；只有一层的列 (及索引列) 纵向合并两行"""
+    tops = pd.Series(top)
+    runs = tops.ne(tops.shift()).cumsum()
+    for _, run in tops.groupby(runs):
+        first, last = offset + run.index[0] + 1, offset + run.index[-1] + 1
+        if last > first and run.iloc[0]:
+            sheet.merge_cells(start_row=1, start_column=first, end_row=1, end_column=last)
+        elif last == first and not bottom[run.index[0]]:
+            sheet.merge_cells(start_row=1, start_column=first, end_row=2, end_column=first)
+    for col in range(1, offset + 1):
+        sheet.merge_cells(start_row=1, start_column=col, end_row=2, end_column=col)
+
+
+def _write_two_level(writer, sheet_name, df, index, top, bottom):
+    offset = df.index.nlevels if index else 0
+    names = ["" if n is None else str(n) for n in df.index.names] if index else []
+    pd.DataFrame([names + top, [""] * offset + bottom]).to_excel(writer, sheet_name=sheet_name, header=False, index=False)
+    df.to_excel(writer, sheet_name=sheet_name, header=False, index=index, startrow=2)
+    _merge_header(writer.sheets[sheet_name], top, bottom, offset)
+
+
+def _write_excel(frames, index, header_levels=None):
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+        for sheet_name, df in frames.items():
+            rows = header_rows_for(df, header_levels)
+            if rows is not None:
+                _write_two_level(writer, sheet_name, df, index, *rows)
+            else:
+                # 多层表头的表 pandas 只支持带索引写出
+                df.to_excel(writer, sheet_name=sheet_name, index=index or isinstance(df.columns, pd.MultiIndex))
+    return buf.getvalue()
+
+
+def _safe_file_name(name):
+    return re.sub(r'[\\/:*?"<>|]+', "_", str(name)).strip() or "sheet"
+
+
+def frame_bytes(df, fmt, index=True, compression="zstd"):
+    """把单个 DataFrame 序列化为指定格式 (非 Excel)"""
+    if fmt == FORMAT_CSV:
+        return _write_csv(df, index)
+    return _write_arrow(df, fmt, index, compression)
+
+
+def export_frames(frames, fmt, base_name, index=True, compression="zstd", header_levels=None):
+    """
+    导出 {sheet_name: DataFrame}。
+    Excel 写成一个多 Sheet 工作簿；其他格式单表直接输出文件，多表每表一个文件打包为 zip。
+    header_levels: {扁平列名: [第一层, 第二层]}，Excel 中据此还原双层表头 (其他格式保持扁平列名)。
+    """
+    if fmt == FORMAT_EXCEL:
+        return ExportResult(_write_excel(frames, index, header_levels), f"{base_name}.xlsx", _MIMES[fmt])
+    ext = _EXTENSIONS[fmt]
+    if len(frames) == 1:
+        (df,) = frames.values()
+        return ExportResult(frame_bytes(df, fmt, index, compression), f"{base_name}{ext}", _MIMES[fmt])
+    buf = io.BytesIO()
+    # 各文件本身已压缩，zip 只做打包
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED) as zf:
+        for sheet_name, df in frames.items():
+            zf.writestr(f"{_safe_file_name(sheet_name)}{ext}", frame_bytes(df, fmt, index, compression))
+    return ExportResult(buf.getvalue(), f"{base_name}.zip", "application/zip")
+
+
+def _frame_token(obj):
+    # DataHandle 按仓库中的内容键，DataFrame 按对象 id (各 App 只整体替换表，不原地修改)
+    key = getattr(obj, "key", None)
+    return ("handle", key) if key is not None else ("frame", id(obj))
+
+
+def export_frames_cached(frames, fmt, base_name, index=True, compression="zstd", key="export", header_levels=None):
+    """
+    同 export_frames，frames 的值也可以是 DataHandle；结果缓存在当前会话里。
+    侧边栏的下载按钮每次脚本重跑都要给出数据：表和导出参数都没变时直接复用上次的字节，
+    不再因为任意一次点击把所有表重新导出一遍 (句柄也只在需要导出时才取出数据)。
+    """
+    import streamlit as st
+
+    levels = tuple(sorted((k, tuple(v)) for k, v in header_levels.items())) if header_levels else None
+    signature = (tuple((name, _frame_token(df)) for name, df in frames.items()), fmt, index, compression, levels)
+    cache_key = f"{key}_cache"
+    cached = st.session_state.get(cache_key)
+    if cached is not None and cached[0] == signature:
+        _, _, result, cached_base = cached
+        return result._replace(file_name=base_name + result.file_name[len(cached_base):])
+    resolved = {name: df.get() if hasattr(df, "get") and not isinstance(df, pd.DataFrame) else df
+                for name, df in frames.items()}
+    result = export_frames(resolved, fmt, base_name, index, compression, header_levels)
+    # 同时持有原对象：保证缓存期间 id 不会被新对象复用
+    st.session_state[cache_key] = (signature, list(frames.values()), result, base_name)
+    return result
+
+
+def render_export_options(key="export"):
+    """侧边栏导出格式选择，返回 (格式, Parquet 压缩算法)"""
+    import streamlit as st
+
+    fmt = st.selectbox("导出格式", EXPORT_FORMATS, key=f"{key}_format")
+    compression = "zstd"
+    if fmt == FORMAT_PARQUET:
+        compression = st.selectbox("Parquet 压缩", PARQUET_COMPRESSIONS, key=f"{key}_compression")
+    return fmt, compression
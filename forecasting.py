@@ -0,0 +1,301 @@
+import hashlib
+import multiprocessing as mp
+import os
+import pickle
+import tempfile
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from data_store import ensure_private_dir
+from resolution import group_mean
+from series_store import get_series_store, to_long
+from time_slots import DAY_MINUTES, label_codes, slot_labels
+
+# ================= 次日负荷批量预测 =================
+# 对几百个站点 (x 指标) 的日负荷曲线预测下一天，输出与转换工具相同的 时刻 x 列 表 (96 点或聚合为 24 点)：
+# - 历史先排成 (天数, 时段数, 序列数) 的数组，缺失时段用前一天 (再不行用后一天) 同时段补齐；
+# - 各序列独立拟合，按块分发到进程池并行 (沙箱等守护进程内无法再开子进程，退回当前进程顺序执行)；
+# - 拟合好的模型 / 参数按 (站点, 指标, 方法, 点数) 存在 FORECAST_MODEL_DIR，
+#   距上次完整拟合不足 FORECAST_REFIT_DAYS 天时沿用旧参数 (ETS 不再寻优、GBM 只用新特征预测)，只做轻量更新。
+#   模型以 pickle 存储，目录只允许当前用户访问 (0700)；目录属于其他用户时不读不写，每次完整拟合。
+
+FORECAST_WORKERS = int(os.environ.get("FORECAST_WORKERS", str(min(8, os.cpu_count() or 1))))
+FORECAST_REFIT_DAYS = int(os.environ.get("FORECAST_REFIT_DAYS", "7"))
+FORECAST_MODEL_DIR = os.environ.get("FORECAST_MODEL_DIR") or os.path.join(tempfile.gettempdir(), "forecast_models")
+ETS_WINDOW_DAYS = 14  # ETS 只用最近两周拟合 (季节周期 = 一天)
+CHUNK_SERIES = 16     # 每个进程任务包含的序列数
+
+METHOD_NAIVE = "季节性朴素"
+METHOD_ETS = "指数平滑 (ETS)"
+METHOD_GBM = "梯度提升 (滞后特征)"
+FORECAST_METHODS = [METHOD_NAIVE, METHOD_ETS, METHOD_GBM]
+_METHOD_ALIASES = {"naive": METHOD_NAIVE, "ets": METHOD_ETS, "gbm": METHOD_GBM}
+
+
+# ---------- 单条序列的模型 (history 为 (天数, 时段数) 数组，weekdays 含目标日共 天数+1 个) ----------
+
+def _naive(history, weekdays, state, refit):
+    """满一周时取上周同日，否则取昨天"""
+    return (history[-7] if len(history) >= 7 else history[-1]), None
+
+
+def _ets(history, weekdays, state, refit):
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing
+
+    points = history.shape[1]
+    window = history[-ETS_WINDOW_DAYS:]
+    if len(window) < 2:
+        return history[-1], None
+    model = ExponentialSmoothing(window.ravel(), seasonal="add", seasonal_periods=points,
+                                 initialization_method="heuristic")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # 收敛等提示不影响结果
+        if refit or state is None:
+            fitted = model.fit()
+        else:
+            fitted = model.fit(smoothing_level=state["alpha"], smoothing_seasonal=state["gamma"], optimized=False)
+    params = {"alpha": float(fitted.params["smoothing_level"]), "gamma": float(fitted.params["smoothing_seasonal"])}
+    return np.asarray(fitted.forecast(points)), params
+
+
+def _lag_features(history, weekdays, day):
+    """第 day 天各时段的特征：昨天同时段、上周同日同时段、昨天均值、时段号、星期"""
+    points = history.shape[1]
+    week = history[day - 7] if day >= 7 else history[day - 1]
+    return np.column_stack([history[day - 1], week, np.full(points, np.nanmean(history[day - 1])),
+                            np.arange(points), np.full(points, weekdays[day])])
+
+
+def _gbm(history, weekdays, state, refit):
+    from sklearn.ensemble import HistGradientBoostingRegressor
+
+    days = len(history)
+    if days < 3:
+        return history[-1], None
+    model = state
+    if refit or model is None:
+        first = 7 if days >= 10 else 1
+        X = np.vstack([_lag_features(history, weekdays, d) for d in range(first, days)])
+        y = history[first:].ravel()
+        model = HistGradientBoostingRegressor(max_iter=100, learning_rate=0.1).fit(X, y)
+    extended = np.vstack([history, np.full(history.shape[1], np.nan)])  # 目标日占位，只用到它之前的行
+    return model.predict(_lag_features(extended, weekdays, days)), model
+
+
+_MODELS = {METHOD_NAIVE: _naive, METHOD_ETS: _ets, METHOD_GBM: _gbm}
+
+
+# ---------- 模型缓存 ----------
+
+def _cache_path(key):
+    name = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=16).hexdigest()
+    return os.path.join(FORECAST_MODEL_DIR, f"{name}.pkl")
+
+
+def _model_dir_ok():
+    try:
+        ensure_private_dir(FORECAST_MODEL_DIR)
+    except OSError:
+        return False
+    return True
+
+
+def _load_state(key):
+    if not _model_dir_ok():
+        return None
+    try:
+        with open(_cache_path(key), "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def _save_state(key, cached):
+    if not _model_dir_ok():
+        return
+    path = _cache_path(key)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(cached, f)
+    os.replace(tmp, path)
+
+
+def _forecast_chunk(tasks):
+    """进程池任务：[(缓存键, 方法, 历史, 星期, 目标日, 重拟合间隔)] -> [(预测, 是否完整拟合)]"""
+    out = []
+    for key, method, history, weekdays, target, refit_days in tasks:
+        if np.isnan(history).all():
+            out.append((np.full(history.shape[1], np.nan), False))
+            continue
+        cached = _load_state(key) if key is not None else None
+        state = cached["state"] if cached else None
+        age = (target - cached["fitted"]).days if cached else None
+        refit = state is None or age is None or age < 0 or age >= refit_days
+        forecast, state = _MODELS[method](history, weekdays, state, refit)
+        if key is not None and state is not None and refit:
+            _save_state(key, {"fitted": target, "state": state})
+        out.append((np.asarray(forecast, dtype=float), refit and state is not None))
+    return out
+
+
+# ---------- 进程池 ----------
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_forecast_executor():
+    """进程级单例；在守护进程 (如沙箱) 里返回 None，调用方顺序执行"""
+    global _EXECUTOR
+    if mp.current_process().daemon or FORECAST_WORKERS <= 1:
+        return None
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            methods = mp.get_all_start_methods()
+            ctx = mp.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _EXECUTOR = ProcessPoolExecutor(max_workers=FORECAST_WORKERS, mp_context=ctx)
+        return _EXECUTOR
+
+
+# ---------- 历史整理 ----------
+
+def history_cube(long, series_cols):
+    """
+    长表 [日期, 时间, series_cols..., 数值] -> (日期序列, (天数, 时段数, 序列数) 数组, 序列名列表, 间隔分钟)。
+    日期补成连续日历 (周滞后特征按日历对齐)，缺失值用前后天同时段补齐。
+    """
+    minutes = label_codes(long["时间"])
+    dates = pd.to_datetime(long["日期"]).dt.normalize()
+    keep = (minutes > 0) & dates.notna().to_numpy()
+    long, minutes, dates = long[keep], minutes[keep].astype(np.int64), dates[keep]
+    if not len(long):
+        raise ValueError("没有可用的历史数据")
+    interval = int(np.gcd.reduce(np.r_[np.unique(minutes), DAY_MINUTES]))
+    points = DAY_MINUTES // interval
+    calendar = pd.date_range(dates.min(), dates.max(), freq="D")
+    day_codes = ((dates - calendar[0]).dt.days).to_numpy()
+    series = long[series_cols[0]].astype(str)
+    for col in series_cols[1:]:
+        series = series + "|" + long[col].astype(str)
+    series_codes, names = pd.factorize(series)
+    cube = np.full((len(calendar), points, len(names)), np.nan)
+    cube[day_codes, minutes // interval - 1, series_codes] = long["数值"].to_numpy(dtype=float)
+    for d in range(1, len(cube)):  # 前一天同时段补缺
+        gap = np.isnan(cube[d])
+        cube[d][gap] = cube[d - 1][gap]
+    for d in range(len(cube) - 2, -1, -1):  # 开头几天用后一天补
+        gap = np.isnan(cube[d])
+        cube[d][gap] = cube[d + 1][gap]
+    return calendar, cube, list(names), interval
+
+
+def forecast_cube(calendar, cube, names, interval, method=METHOD_NAIVE, points=None, cache_prefix=None,
+                  refit_days=FORECAST_REFIT_DAYS):
+    """
+    对 cube 中每条序列预测下一天，返回 (目标日, 时刻 x 序列 的表, 完整拟合的序列数)。
+    points 为输出点数 (须整除原点数，如 96 -> 24 为小时均值)；cache_prefix 为 None 时不读写模型缓存。
+    """
+    method = _METHOD_ALIASES.get(method, method)
+    if method not in _MODELS:
+        raise ValueError(f"未知的预测方法: {method}")
+    target = calendar[-1] + pd.Timedelta(days=1)
+    weekdays = np.r_[calendar.dayofweek, target.dayofweek]
+    tasks = [((cache_prefix, name, method, cube.shape[1]) if cache_prefix is not None else None,
+              method, cube[:, :, i], weekdays, target, refit_days) for i, name in enumerate(names)]
+    chunks = [tasks[i:i + CHUNK_SERIES] for i in range(0, len(tasks), CHUNK_SERIES)]
+    executor = get_forecast_executor() if len(chunks) > 1 else None
+    results = executor.map(_forecast_chunk, chunks) if executor is not None else map(_forecast_chunk, chunks)
+    outcomes = [item for chunk in results for item in chunk]
+
+    values = np.column_stack([forecast for forecast, _ in outcomes]) if outcomes else np.empty((cube.shape[1], 0))
+    native = cube.shape[1]
+    points = points or native
+    if native % points:
+        raise ValueError(f"{native} 点无法聚合为 {points} 点")
+    if points != native:
+        values = group_mean(values, native // points)
+    frame = pd.DataFrame(values, index=pd.Index(slot_labels(points), name="时间"), columns=names)
+    return target, frame, sum(refit for _, refit in outcomes)
+
+
+def forecast_stations(stations, metrics=None, method=METHOD_NAIVE, history_days=28, points=None, end=None):
+    """
+    时序库中各站点的次日预测。历史窗口为截至 end (默认各站点最新日期中的最大者) 的 history_days 天。
+    返回 (目标日, 时刻 x 列 的表, 完整拟合的序列数)；只有一个指标时列名为站点，否则为 "站点|指标"。
+    """
+    store = get_series_store()
+    if end is None:
+        ranges = store.stations().set_index("station")
+        end = ranges.loc[[str(s) for s in stations], "结束日期"].max()
+    end = pd.Timestamp(end).normalize()
+    start = end - pd.Timedelta(days=history_days - 1)
+    long = store.query_many(stations, start, end, metrics)
+    single_metric = long["指标"].nunique() <= 1
+    calendar, cube, names, interval = history_cube(long, ["站点"] if single_metric else ["站点", "指标"])
+    if calendar[-1] < end:  # 所有站点都缺最后几天时仍预测 end 的下一天
+        extra = pd.date_range(calendar[-1] + pd.Timedelta(days=1), end, freq="D")
+        cube = np.concatenate([cube, np.repeat(cube[-1:], len(extra), axis=0)])
+        calendar = calendar.append(extra)
+    return forecast_cube(calendar, cube, names, interval, method, points, cache_prefix="store")
+
+
+def forecast_next_day(df, method="naive", points=None):
+    """
+    供生成代码使用：按历史预测下一天，返回 时刻标签 x 列 的表。
+    df 行索引为时段结束时间戳 (可跨多天)，或 load_series 返回的 (日期, 时间) 两层索引；每列一条序列。
+    method: "naive" (上周同日/昨天) / "ets" / "gbm"；points 为输出点数 (None 同输入，24 为小时均值)。
+    """
+    if isinstance(df.index, pd.MultiIndex):
+        long = df.rename_axis(["日期", "时间"]).reset_index().melt(["日期", "时间"], var_name="指标", value_name="数值")
+        long["时间"] = long["时间"].astype(str).str.rstrip("*")
+    else:
+        long = to_long(df)
+    calendar, cube, names, interval = history_cube(long, ["指标"])
+    return forecast_cube(calendar, cube, names, interval, method, points)[1]
+
+
+def render_forecast_panel(key="forecast"):
+    """次日预测面板：从时序库选站点，预测结果按转换工具的表格布局导出"""
+    import streamlit as st
+    from exporters import EXPORT_FORMATS, export_frames_cached
+
+    with st.expander("🔮 次日负荷预测 (时序库中的站点)"):
+        store = get_series_store()
+        ranges = store.stations()
+        if not len(ranges):
+            st.caption("时序库中还没有数据，先把转换结果存入时序库")
+            return
+        stations = st.multiselect("站点", ranges["station"].tolist(), default=ranges["station"].tolist(),
+                                  key=f"{key}_stations")
+        method_col, days_col, points_col = st.columns(3)
+        with method_col:
+            method = st.selectbox("方法", FORECAST_METHODS, key=f"{key}_method",
+                                  help="梯度提升与指数平滑按站点并行拟合，模型缓存到下次，"
+                                       f"每 {FORECAST_REFIT_DAYS} 天完整重拟合一次")
+        with days_col:
+            history_days = st.number_input("历史天数", min_value=2, max_value=366, value=28, key=f"{key}_days")
+        with points_col:
+            points = {"96 点": 96, "24 点": 24}[st.selectbox("输出", ["96 点", "24 点"], key=f"{key}_points")]
+        metric_text = st.text_input("指标 (逗号分隔，留空为全部)", key=f"{key}_metrics")
+        metrics = [m.strip() for m in metric_text.split(",") if m.strip()] or None
+        if st.button("🔮 预测下一天", key=f"{key}_run", disabled=not stations):
+            try:
+                target, frame, refits = forecast_stations(stations, metrics, method, int(history_days), points)
+            except ValueError as e:
+                st.error(f"无法预测: {e}")
+                return
+            st.session_state[f"{key}_result"] = (f"{target:%Y-%m-%d}", frame, refits)
+        result = st.session_state.get(f"{key}_result")
+        if result is not None:
+            sheet, frame, refits = result
+            st.caption(f"目标日 {sheet} | {frame.shape[1]} 条序列，其中 {refits} 条完整拟合，其余沿用缓存模型")
+            st.dataframe(frame, use_container_width=True)
+            export_format = st.selectbox("导出格式", EXPORT_FORMATS, key=f"{key}_format")
+            export = export_frames_cached({sheet: frame}, export_format, f"预测_{sheet}", index=True,
+                                          compression="zstd", key=f"{key}_export")
+            st.download_button("📥 下载预测结果", export.data, export.file_name, mime=export.mime,
+                               key=f"{key}_download")
@@ -0,0 +1,107 @@
+import datetime
+import io
+
+import numpy as np
+import pandas as pd
+
+# ================= 双层表头 (扁平列名 + 层级映射) =================
+# 原来的做法是 read_excel(header=[0, 1]) 得到 MultiIndex 列，再逐列重建元组去掉 "Unnamed"。
+# MultiIndex 列让选列、melt、导出都变慢，生成代码也经常处理错。这里改为：
+# - header=None 整表只读一次，前两行作为表头：合并单元格只在左上角有值，第一层按行向前填充；
+# - 数据部分用扁平列名 "第一层_第二层" (某一层为空时只用另一层)，重名时加 .1/.2 后缀；
+# - 扁平列名 -> (第一层, 第二层) 的映射单独保存 (会话里的 header_levels)，只在导出 Excel 时还原成两行表头。
+# 映射可以只读表头两行得到 (read_header_levels)，上传文件命中共享仓库缓存时不必重新解析整表。
+
+HEADER_SINGLE = "单行表头 (标准文件)"
+HEADER_TWO_LEVEL = "双层表头 (保留原表层级)"
+HEADER_MODES = [HEADER_SINGLE, HEADER_TWO_LEVEL]
+HEADER_ROWS = 2
+LEVEL_SEP = "_"
+
+
+def _cell_text(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NaT:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime.datetime) and value.time() == datetime.time():  # 含 pd.Timestamp：日期表头
+        return value.strftime("%Y-%m-%d")
+    return str(value).strip()
+
+
+def header_names(head):
+    """
+    head: 表头各行 (行数 x 列数)。返回 (扁平列名列表, 第一层列表, 第二层列表)。
+    第一层为合并单元格时只有左上角有值，按行向前填充；第二层不填充 (空白表示该列只有一层)。
+    """
+    text = pd.DataFrame(head).map(_cell_text).replace("", np.nan)
+    top = text.iloc[0].ffill().fillna("")
+    bottom = text.iloc[-1].fillna("") if len(text) > 1 else pd.Series("", index=top.index)
+    # 纵向合并的单元格 (如占两行的 "日期")：第二层为空；两层相同时也只保留一层
+    bottom = bottom.where(bottom != top, "")
+    flat = top.where(bottom == "", top + LEVEL_SEP + bottom)
+    flat = flat.where(flat != "", bottom)
+    flat = flat.where(flat != "", pd.Series([f"列{i + 1}" for i in range(len(flat))], index=flat.index))
+    seen = flat.groupby(flat).cumcount()
+    flat = flat.where(seen == 0, flat + "." + seen.astype(str))
+    return flat.tolist(), top.tolist(), bottom.tolist()
+
+
+def flatten_header(raw, rows=HEADER_ROWS):
+    """header=None 读入的表 -> 扁平列名的数据表 (前 rows 行作为表头，其余行重新推断类型)"""
+    rows = min(rows, len(raw))
+    if not rows:
+        return raw
+    flat, _, _ = header_names(raw.iloc[:rows].to_numpy(dtype=object))
+    return raw.iloc[rows:].set_axis(flat, axis=1).reset_index(drop=True).infer_objects()
+
+
+def header_levels_of(raw, rows=HEADER_ROWS):
+    """header=None 读入的表 (至少含表头行) -> {扁平列名: [第一层, 第二层]}"""
+    rows = min(rows, len(raw))
+    if not rows:
+        return {}
+    flat, top, bottom = header_names(raw.iloc[:rows].to_numpy(dtype=object))
+    return {name: [a, b] for name, a, b in zip(flat, top, bottom)}
+
+
+def read_header_levels(data, sheet_name=None, rows=HEADER_ROWS):
+    """只读表头 rows 行得到层级映射；sheet_name=None 时合并所有 Sheet 的映射"""
+    raw = bytes(data) if isinstance(data, (bytes, bytearray)) else data.getvalue()
+    heads = pd.read_excel(io.BytesIO(raw), sheet_name=sheet_name, header=None, nrows=rows)
+    if isinstance(heads, pd.DataFrame):
+        heads = {sheet_name: heads}
+    levels = {}
+    for head in heads.values():
+        levels.update(header_levels_of(head, rows))
+    return levels
+
+
+def read_excel_layout(data, mode=HEADER_SINGLE, sheet_names=None):
+    """按表头模式读取工作簿的全部 (或指定) Sheet：双层表头时返回扁平列名的表"""
+    from df_transport import read_excel_sheets
+
+    if mode != HEADER_TWO_LEVEL:
+        return read_excel_sheets(data, sheet_names)
+    return {name: flatten_header(raw) for name, raw in read_excel_sheets(data, sheet_names, header=None).items()}
+
+
+def header_rows_for(df, levels):
+    """导出用：df 的列在映射中时返回 (第一层列表, 第二层列表)；没有任何列属于双层表头时返回 None"""
+    if not levels or isinstance(df.columns, pd.MultiIndex):
+        return None
+    found = [levels.get(c) if isinstance(c, str) else None for c in df.columns]
+    if not any(found):
+        return None
+    # 生成代码新增的列没有层级：放在第一层，第二层留空
+    top = [f[0] if f else str(c) for c, f in zip(df.columns, found)]
+    bottom = [f[1] if f else "" for f in found]
+    return top, bottom
+
+
+def render_header_options(key="header_mode"):
+    """侧边栏 Excel 表头类型选择，返回 HEADER_SINGLE / HEADER_TWO_LEVEL"""
+    import streamlit as st
+
+    return st.radio("选择 Excel 表头类型：", HEADER_MODES, index=0, key=key,
+                    help="双层表头：合并单元格的上层标题与下层列名拼成 \"上层_下层\" 列名处理，导出 Excel 时还原两行表头")
@@ -0,0 +1,63 @@
+import importlib
+import threading
+
+# ================= 按需导入的分析库 (供生成代码使用) =================
+# scipy / statsmodels / sklearn / matplotlib 导入一次要几百毫秒到数秒，且大多数指令用不到。
+# 执行环境里放的是代理对象：第一次访问属性 (如 sm.OLS、plt.plot) 时才真正导入，之后直接转发；
+# 沙箱子进程常驻复用，同一进程只导入一次。生成代码不必在 process_step 里再写 import。
+
+
+def _use_agg_backend():
+    # 服务端没有显示设备，先固定为非交互后端再导入 pyplot
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+class LazyModule:
+    """首次访问属性时才导入的模块代理；子模块 (如 sklearn.linear_model) 也按需导入"""
+
+    def __init__(self, name, setup=None):
+        self._name = name
+        self._setup = setup
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    if self._setup is not None:
+                        self._setup()
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        if attr.startswith("__") and attr.endswith("__"):
+            raise AttributeError(attr)  # copy/pickle 等探测魔术方法时不触发导入
+        module = self._load()
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            try:
+                return importlib.import_module(f"{module.__name__}.{attr}")
+            except ImportError:
+                raise AttributeError(f"module '{module.__name__}' has no attribute '{attr}'") from None
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}'{' (loaded)' if self.loaded else ''}>"
+
+
+# 生成代码中的名字 -> 代理 (进程级，所有执行共用)
+LAZY_MODULES = {
+    "scipy": LazyModule("scipy"),
+    "sm": LazyModule("statsmodels.api"),
+    "sklearn": LazyModule("sklearn"),
+    "plt": LazyModule("matplotlib.pyplot", setup=_use_agg_backend),
+}
@@ -0,0 +1,156 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+
+# ================= 异步 LLM 调用层 (各 App 共用) =================
+# Streamlit 的脚本线程如果同步等待 LLM，请求进行中页面无法刷新状态。
+# 这里在后台线程里常驻一个 asyncio 事件循环：
+# - 各 App 把协程提交到该循环，脚本线程轮询结果，期间持续刷新状态 (已等待秒数、各 Sheet 进度)；
+# - 所有会话的 LLM 请求共用一个信号量，同时在途的请求不超过 LLM_CONCURRENCY 个；
+# - 多个 Sheet / 文件可以同时发起生成请求 (run_many)，总耗时接近最慢的一个而不是逐个相加。
+# Streamlit 的 st.* 只能在脚本线程调用：协程里的进度通过 ProgressLog 传回，由 wait_with_status 写到页面。
+
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "4"))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "120"))  # 单次请求超时 (秒)
+POLL_INTERVAL = 0.5
+
+
+class LLMLoop:
+    """后台线程中的事件循环 + 全局并发上限"""
+
+    def __init__(self, concurrency=LLM_CONCURRENCY):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="llm-loop", daemon=True)
+        self._thread.start()
+        self._semaphore = asyncio.run_coroutine_threadsafe(self._make_semaphore(concurrency), self.loop).result()
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+
+    @staticmethod
+    async def _make_semaphore(concurrency):
+        return asyncio.Semaphore(max(1, concurrency))
+
+    def submit(self, coro):
+        """提交协程，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def limited(self, coro):
+        """在全局并发上限内等待 coro"""
+        async with self._semaphore:
+            return await asyncio.wait_for(coro, LLM_TIMEOUT)
+
+    def client(self, key, factory):
+        """按 key 缓存异步客户端：连接池绑定在本循环上，不随脚本重跑反复创建"""
+        with self._clients_lock:
+            if key not in self._clients:
+                self._clients[key] = factory()
+            return self._clients[key]
+
+
+_LOOP = None
+_LOOP_LOCK = threading.Lock()
+
+
+def get_llm_loop():
+    """进程级单例"""
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = LLMLoop()
+        return _LOOP
+
+
+def openai_client(api_key, base_url=None):
+    from openai import AsyncOpenAI
+
+    return get_llm_loop().client(("openai", api_key, base_url),
+                                 lambda: AsyncOpenAI(api_key=api_key, base_url=base_url))
+
+
+def gemini_client(api_key, **http_options):
+    from google import genai
+
+    key = ("gemini", api_key, tuple(sorted(http_options.items())))
+    return get_llm_loop().client(key, lambda: genai.Client(api_key=api_key, http_options=http_options or None).aio)
+
+
+async def chat_completion(client, **kwargs):
+    """OpenAI 兼容接口 (DeepSeek / 千问)，返回回复文本"""
+    response = await get_llm_loop().limited(client.chat.completions.create(**kwargs))
+    return response.choices[0].message.content
+
+
+async def gemini_generate(client, model, contents):
+    """Gemini 异步接口，返回回复文本"""
+    response = await get_llm_loop().limited(client.models.generate_content(model=model, contents=contents))
+    return response.text
+
+
+class ProgressLog:
+    """协程 -> 脚本线程的进度消息队列 (线程安全)，附带各阶段耗时供性能面板补录"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._messages = []
+        self.timings = []  # [(阶段, 秒, 附加信息)]
+
+    def write(self, message):
+        with self._lock:
+            self._messages.append(message)
+
+    def drain(self):
+        with self._lock:
+            messages, self._messages = self._messages, []
+        return messages
+
+    def timing(self, stage, seconds, **meta):
+        with self._lock:
+            self.timings.append((stage, seconds, meta))
+
+
+async def timed_call(log, stage, coro, **meta):
+    """await coro 并把耗时记到 log"""
+    start = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        log.timing(stage, time.perf_counter() - start, **meta)
+
+
+async def run_many(coros):
+    """并发执行多个协程 (LLM 请求数受全局信号量限制)，返回结果列表；失败的位置为异常对象"""
+    return await asyncio.gather(*coros, return_exceptions=True)
+
+
+def wait_with_status(future, status, label, log=None):
+    """
+    在脚本线程中等待 future，期间每 POLL_INTERVAL 秒刷新状态标题 (已等待秒数) 并输出协程的进度消息。
+    返回协程结果；协程抛出的异常原样抛出。
+    """
+    from perf_monitor import get_recorder
+
+    start = time.perf_counter()
+    try:
+        while True:
+            try:
+                return future.result(timeout=POLL_INTERVAL)
+            except FutureTimeout:
+                if future.done():
+                    raise  # 协程自身的超时 (LLM_TIMEOUT)，不是轮询超时
+                status.update(label=f"{label} ({time.perf_counter() - start:.0f}s)")
+            except BaseException:
+                # 脚本被中断 (用户触发了重跑等)：不再需要结果，取消尚未完成的请求
+                future.cancel()
+                raise
+            finally:
+                if log is not None:
+                    for message in log.drain():
+                        status.write(message)
+    finally:
+        if log is not None:
+            recorder = get_recorder()
+            for stage, seconds, meta in log.timings:
+                recorder.add(stage, seconds, **meta)
+            log.timings.clear()
@@ -0,0 +1,215 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from resolution import infer_interval
+from time_slots import DAY_MINUTES, label_codes, label_convention, order_by_slot, slot_labels
+
+# ================= 负荷特性指标 (峰谷 / 负荷率 / 爬坡) =================
+# 对每个站点 (列) 每天的负荷曲线计算：最大/最小负荷及出现时刻、平均负荷、负荷率、峰谷差 (率)、
+# 最大上升/下降速率、电量。
+# 所有曲线先排成 (天数, 时段数, 列数) 的三维数组，再沿时段轴一次归约：
+# - 宽表 (行 = 时刻，列 = 站点)：天数为 1；
+# - 长表 (日期 / 时间 / 分组列 / 数值列)：按 (分组, 日期) 编号后一次散列到数组里，不逐组循环。
+# 几千个站点的 96 点曲线在百毫秒量级完成。
+
+INDICATORS = ["最大负荷", "最大负荷时刻", "最小负荷", "最小负荷时刻", "平均负荷", "负荷率",
+              "峰谷差", "峰谷差率", "最大上升速率(/h)", "最大下降速率(/h)", "电量", "有效点数"]
+
+
+def _extreme_labels(curves, labels, use_max):
+    """(组, 时段, 列) 中每条曲线极值所在时段的标签；整条为空时为空字符串"""
+    fill = -np.inf if use_max else np.inf
+    filled = np.where(np.isnan(curves), fill, curves)
+    pos = filled.argmax(axis=1) if use_max else filled.argmin(axis=1)
+    names = np.asarray(labels, dtype=object)[pos]
+    return np.where(np.isnan(curves).all(axis=1), "", names)
+
+
+def curve_indicators(curves, interval, labels):
+    """
+    curves: (组, 时段, 列) 的负荷数组 (空值为 NaN)，interval: 采样间隔 (分钟)，labels: 各时段标签。
+    返回 {指标: (组, 列) 数组}。
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # 整条曲线为空时 nanmax 等会告警
+        peak = np.nanmax(curves, axis=1)
+        valley = np.nanmin(curves, axis=1)
+        mean = np.nanmean(curves, axis=1)
+        ramp = np.diff(curves, axis=1) * (60 / interval)  # 相邻时段变化量折算为每小时
+        ramp_up = np.nanmax(ramp, axis=1) if ramp.shape[1] else np.full_like(peak, np.nan)
+        ramp_down = np.nanmin(ramp, axis=1) if ramp.shape[1] else np.full_like(peak, np.nan)
+    count = (~np.isnan(curves)).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        positive = np.where(peak > 0, peak, np.nan)
+        load_factor = mean / positive
+        gap_rate = (peak - valley) / positive
+    return {
+        "最大负荷": peak,
+        "最大负荷时刻": _extreme_labels(curves, labels, use_max=True),
+        "最小负荷": valley,
+        "最小负荷时刻": _extreme_labels(curves, labels, use_max=False),
+        "平均负荷": mean,
+        "负荷率": load_factor,
+        "峰谷差": peak - valley,
+        "峰谷差率": gap_rate,
+        "最大上升速率(/h)": ramp_up,
+        "最大下降速率(/h)": ramp_down,
+        "电量": np.where(count > 0, np.nansum(curves, axis=1) * interval / 60, np.nan),
+        "有效点数": count,
+    }
+
+
+def _numeric(df):
+    """转为 float 数组；只有非数值列才逐列解析 (几千列的纯数值表直接整体转换)"""
+    text = [c for c, dtype in enumerate(df.dtypes) if not pd.api.types.is_numeric_dtype(dtype)]
+    if text:
+        df = df.copy()
+        for c in text:
+            df.isetitem(c, pd.to_numeric(df.iloc[:, c], errors="coerce"))
+    return df.to_numpy(dtype=float, na_value=np.nan)
+
+
+def _is_day_axis(labels):
+    """一天内的时刻标签：绝大多数行可识别且互不重复 (跨多天的时间戳列不算，应按长表处理)"""
+    codes = label_codes(labels)
+    valid = codes[~np.isnan(codes)]
+    return (len(valid) >= 0.9 * len(codes) and len(np.unique(valid)) == len(valid)
+            and infer_interval(labels) is not None)
+
+
+def as_wide(df):
+    """行索引是时刻标签时原样返回；时刻标签在第一列时以其为索引；都不是则返回 None"""
+    if _is_day_axis(df.index):
+        return df
+    if df.shape[1] > 1 and _is_day_axis(df.iloc[:, 0]):
+        return df.set_index(df.columns[0])
+    return None
+
+
+def wide_indicators(df):
+    """宽表：行为一天的时刻标签 (96/48/24 点等)，每列一条曲线；返回 列 x 指标 的表"""
+    df = as_wide(df)
+    if df is None:
+        raise ValueError("行索引与第一列都不是一天内的时刻标签，长表请指定 time_col")
+    interval = infer_interval(df.index)
+    points = DAY_MINUTES // interval
+    rows, slots = order_by_slot(df, points=points)
+    values = _numeric(rows)
+    # 去掉全部无法转为数值的列 (备注等)；本来就是数值类型的列即使全空也保留
+    keep = ~np.isnan(values).all(axis=0) | np.array([pd.api.types.is_numeric_dtype(t) for t in rows.dtypes])
+    rows, values = rows.loc[:, keep], values[:, keep]
+    curves = np.full((1, points, rows.shape[1]), np.nan)
+    curves[0, slots] = values  # 重复时段取最后一行，缺失时段为 NaN
+    # 极值时刻按输入的标签约定给出 (00:00 ... 23:45 的表不会报成 00:15 ... 24:00)
+    result = curve_indicators(curves, interval, slot_labels(points, label_convention(df.index)))
+    out = pd.DataFrame({name: values[0] for name, values in result.items()}, index=rows.columns)
+    out.index.name = "列"
+    return out[INDICATORS]
+
+
+def _dates_and_minutes(df, time_col, date_col):
+    """
+    长表每行的 (日期, 当天的分钟数, 是否结束时刻约定)。时刻约定的判断与 time_slots 一致：
+    - 结束时刻 (00:15..24:00，右闭区间)：分钟数 1..1440，次日 00:00 记为当天 24:00；
+    - 开始时刻 (00:00..23:45，左闭区间)：分钟数 0..1439。
+    完整时间戳出现 24:00，或最早的记录不在零点时按结束时刻解释。
+    """
+    if date_col:
+        minutes = label_codes(df[time_col])
+        end = label_convention(df[time_col]) == "end"
+        dates = pd.to_datetime(df[date_col], errors="coerce").dt.normalize()
+        return dates.to_numpy(), minutes, end
+    is_24 = np.zeros(len(df), dtype=bool)
+    if pd.api.types.is_datetime64_any_dtype(df[time_col]):
+        ts = df[time_col]
+    else:
+        text = df[time_col].astype(str).str.strip()
+        is_24 = text.str.contains("24:00", regex=False).to_numpy()
+        text = text.str.replace("24:00", "00:00", regex=False)
+        try:
+            ts = pd.to_datetime(text)  # 格式统一时按首行推断格式，比逐行 mixed 解析快一个数量级
+        except (ValueError, TypeError):
+            ts = pd.to_datetime(text, errors="coerce", format="mixed")
+        ts = ts + pd.to_timedelta(is_24.astype(int), unit="D")
+    first = ts.min()
+    end = bool(is_24.any()) or pd.isna(first) or first != first.normalize()
+    dates = (ts - pd.Timedelta(minutes=1) if end else ts).dt.normalize()
+    minutes = ((ts - dates).dt.total_seconds() / 60).to_numpy(dtype=float)
+    return dates.to_numpy(), minutes, end
+
+
+def long_indicators(df, time_col, date_col="", key_cols=(), value_cols=None):
+    """
+    长表：每行一个时刻。time_col 为完整时间戳，或配合 date_col 的时刻标签；key_cols 为分组列 (如站点)。
+    返回 分组列 + 日期 + 列 + 各指标 的表 (每个分组每天每个数值列一行)。
+    """
+    key_cols = list(key_cols)
+    if value_cols is None:
+        skip = set(key_cols) | {time_col, date_col}
+        value_cols = [c for c in df.columns if c not in skip and pd.api.types.is_numeric_dtype(df[c])]
+    value_cols = list(value_cols)
+    dates, minutes, end = _dates_and_minutes(df, time_col, date_col)
+    in_day = (minutes > 0) & (minutes <= DAY_MINUTES) if end else (minutes >= 0) & (minutes < DAY_MINUTES)
+    valid = ~np.isnan(minutes) & in_day & ~pd.isna(dates)
+    if not valid.any():
+        raise ValueError("没有可识别的时刻行")
+    minute_values = np.unique(minutes[valid]).astype(np.int64)
+    interval = int(np.gcd.reduce(np.r_[minute_values, DAY_MINUTES]))
+    points = DAY_MINUTES // interval
+
+    rows = df.loc[valid]
+    slots = minutes[valid].astype(np.int64) // interval - (1 if end else 0)
+    groups = pd.DataFrame({**{c: rows[c].to_numpy() for c in key_cols}, "日期": dates[valid]})
+    codes = groups.groupby(list(groups.columns), sort=True, dropna=False).ngroup().to_numpy()
+    first = ~groups.duplicated().to_numpy()
+    keys = groups[first].set_index(codes[first]).sort_index()  # 组号 -> (分组列..., 日期)
+
+    curves = np.full((len(keys), points, len(value_cols)), np.nan)
+    curves[codes, slots] = _numeric(rows[value_cols])  # 一次散列：每行落到 (分组日, 时段) 位置
+    result = curve_indicators(curves, interval, slot_labels(points, "end" if end else "start"))
+
+    n_groups, n_cols = len(keys), len(value_cols)
+    out = keys.loc[np.repeat(np.arange(n_groups), n_cols)].reset_index(drop=True)
+    out["列"] = np.tile(np.asarray(value_cols, dtype=object), n_groups)
+    for name in INDICATORS:
+        out[name] = result[name].ravel()
+    return out
+
+
+def load_indicators(df, time_col=None, date_col="", key_cols=(), value_cols=None):
+    """
+    供生成代码使用：一次计算所有曲线的负荷特性指标。
+    - 不给 time_col：df 为宽表 (行索引或第一列为时刻标签，其余每列一个站点)，返回 站点 x 指标；
+    - 给出 time_col：df 为长表，按 key_cols + 日期 分组，返回每组每天每个数值列一行。
+    """
+    if time_col is None:
+        return wide_indicators(df)
+    return long_indicators(df, time_col, date_col, key_cols, value_cols)
+
+
+def render_load_report(df, key="load_report"):
+    """一键负荷特性报告：宽表自动识别；长表需选择时间/日期/分组列"""
+    import streamlit as st
+
+    with st.expander("📈 负荷特性报告 (峰谷 / 负荷率 / 爬坡)"):
+        wide = as_wide(df) is not None
+        time_col = date_col = None
+        key_cols = []
+        if not wide:
+            columns = [str(c) for c in df.columns]
+            lookup = dict(zip(columns, df.columns))
+            time_col = lookup.get(st.selectbox("时间列 (完整时间戳或时刻)", columns, key=f"{key}_time"))
+            date_choice = st.selectbox("日期列 (时间列只有时刻时选择)", ["(无)"] + columns, key=f"{key}_date")
+            date_col = "" if date_choice == "(无)" else lookup[date_choice]
+            key_cols = [lookup[c] for c in st.multiselect("分组列 (如站点)", columns, key=f"{key}_keys")]
+        if st.button("⚡ 一键生成", key=f"{key}_run"):
+            try:
+                report = load_indicators(df, time_col, date_col, key_cols)
+            except ValueError as e:
+                st.error(f"无法生成报告: {e}")
+                return
+            st.dataframe(report, use_container_width=True)
+            st.download_button("📥 下载报告 (CSV)", report.to_csv(index=wide).encode("utf-8-sig"),
+                               file_name="负荷特性报告.csv", mime="text/csv", key=f"{key}_download")
@@ -0,0 +1,182 @@
+import ast
+import os
+from typing import NamedTuple
+
+import pandas as pd
+
+# ================= 生成代码的性能静态检查 =================
+# 执行前用 AST 扫描 process_step，找出在几十万行数据上会慢几个数量级的写法：
+# iterrows / itertuples、apply(axis=1)、循环内 pd.concat、逐个元素 pd.to_datetime、循环内 .loc/.at 逐行读写。
+# 按 DataFrame 行列数粗估耗时 (经验单价，量级准确即可)；超过 LINT_REWRITE_SECONDS 时
+# 可以在重试循环里把 vectorize_request 的说明发回给模型，要求改写成向量化代码后再执行。
+
+LINT_REWRITE_SECONDS = float(os.environ.get("LINT_REWRITE_SECONDS", "2"))
+
+# 规则 -> (每行耗时 (秒)，每行每列追加耗时 (秒)，说明，改写建议)
+RULES = {
+    "iterrows": (1.5e-5, 1e-6, "`iterrows()` 逐行遍历",
+                 "use column arithmetic / boolean masks / np.where instead of iterrows"),
+    "itertuples": (1e-6, 1e-7, "`itertuples()` 逐行遍历",
+                   "replace the row loop with vectorized column operations"),
+    "apply_rows": (1e-5, 5e-7, "`apply(axis=1)` 按行调用 Python 函数",
+                   "rewrite apply(axis=1) as column expressions (np.where / np.select / arithmetic)"),
+    "to_datetime_row": (5e-5, 0.0, "逐个元素调用 `pd.to_datetime`",
+                        "call pd.to_datetime (or clean_energy_time) once on the whole column"),
+    "concat_loop": (1e-4, 0.0, "循环内反复 `pd.concat` (每次复制已累积的全部数据，总量平方增长)",
+                    "collect pieces in a list and call pd.concat once after the loop"),
+    "row_index": (1e-5, 0.0, "循环内用 `.loc/.iloc/.at/.iat` 逐行读写",
+                  "assign whole columns at once instead of writing cell by cell in a loop"),
+}
+_ROW_METHODS = {"iterrows", "itertuples"}
+_INDEXERS = {"loc", "iloc", "at", "iat"}
+
+
+class Finding(NamedTuple):
+    rule: str
+    line: int
+    message: str
+    seconds: float = None  # 估计耗时；无法估计 (循环次数未知) 时为 None
+
+
+def frame_shape(arg):
+    """process_step 参数的 (行数, 列数)；多表 dict 取总行数和最大列数"""
+    if isinstance(arg, pd.DataFrame):
+        return arg.shape
+    if isinstance(arg, dict):
+        frames = [v for v in arg.values() if isinstance(v, pd.DataFrame)]
+        return sum(f.shape[0] for f in frames), max((f.shape[1] for f in frames), default=0)
+    return 0, 0
+
+
+def _is_to_datetime(node):
+    return (isinstance(node, ast.Attribute) and node.attr == "to_datetime") or \
+        (isinstance(node, ast.Name) and node.id == "to_datetime")
+
+
+def _is_row_loop(iter_node):
+    """for 循环是否逐行：iterrows/itertuples、range(len(...))、df.index"""
+    if isinstance(iter_node, ast.Call):
+        func = iter_node.func
+        if isinstance(func, ast.Attribute) and func.attr in _ROW_METHODS:
+            return True
+        if isinstance(func, ast.Name) and func.id == "range" and iter_node.args:
+            arg = iter_node.args[-1] if len(iter_node.args) > 1 else iter_node.args[0]
+            return isinstance(arg, ast.Call) and isinstance(arg.func, ast.Name) and arg.func.id == "len"
+        if isinstance(func, ast.Name) and func.id == "enumerate" and iter_node.args:
+            return _is_row_loop(iter_node.args[0])
+    return isinstance(iter_node, ast.Attribute) and iter_node.attr == "index"
+
+
+def _names(node):
+    return {n.id for n in ast.walk(node) if isinstance(n, ast.Name)}
+
+
+class _Visitor(ast.NodeVisitor):
+    def __init__(self):
+        self.hits = {}     # (规则, 行号) -> 是否逐行 (循环次数 ~ 行数)
+        self.loops = []    # [(是否逐行, 循环变量名)]
+        self.lambdas = 0
+
+    def _hit(self, rule, node, per_row=True):
+        key = (rule, node.lineno)
+        self.hits[key] = self.hits.get(key, False) or per_row
+
+    def _visit_loop(self, node, row_loop, targets):
+        self.loops.append((row_loop, targets))
+        self.generic_visit(node)
+        self.loops.pop()
+
+    def visit_For(self, node):
+        self._visit_loop(node, _is_row_loop(node.iter), _names(node.target))
+
+    def visit_While(self, node):
+        self._visit_loop(node, False, set())
+
+    def _visit_comprehension(self, node):
+        rows = any(_is_row_loop(g.iter) for g in node.generators)
+        targets = set().union(*(_names(g.target) for g in node.generators))
+        self._visit_loop(node, rows, targets)
+
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = _visit_comprehension
+
+    def visit_Lambda(self, node):
+        self.lambdas += 1
+        self.generic_visit(node)
+        self.lambdas -= 1
+
+    def visit_Call(self, node):
+        func = node.func
+        in_loop = bool(self.loops)
+        row_loop = any(rows for rows, _ in self.loops)
+        if isinstance(func, ast.Attribute):
+            if func.attr in _ROW_METHODS:
+                self._hit(func.attr, node)
+            elif func.attr in ("apply", "map", "applymap"):
+                axis = next((k.value for k in node.keywords if k.arg == "axis"), None)
+                if func.attr == "apply" and isinstance(axis, ast.Constant) and axis.value in (1, "columns"):
+                    self._hit("apply_rows", node)
+                if node.args and _is_to_datetime(node.args[0]):
+                    self._hit("to_datetime_row", node)
+            elif func.attr == "concat" and in_loop:
+                self._hit("concat_loop", node, per_row=row_loop)
+        if _is_to_datetime(func) and (self.lambdas or in_loop):
+            self._hit("to_datetime_row", node, per_row=bool(self.lambdas) or row_loop)
+        self.generic_visit(node)
+
+    def visit_Subscript(self, node):
+        value = node.value
+        if isinstance(value, ast.Attribute) and value.attr in _INDEXERS and self.loops:
+            loop_vars = set().union(*(targets for _, targets in self.loops))
+            if _names(node.slice) & loop_vars:
+                self._hit("row_index", node, per_row=any(rows for rows, _ in self.loops))
+        self.generic_visit(node)
+
+
+def analyze_code(code, shape=(0, 0)):
+    """扫描生成代码，返回 [Finding] (按行号排序)；代码有语法错误时返回空列表 (交给执行阶段报错)"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return []
+    visitor = _Visitor()
+    visitor.visit(tree)
+    rows, cols = shape
+    findings = []
+    for (rule, line), per_row in sorted(visitor.hits.items(), key=lambda item: item[0][1]):
+        row_cost, col_cost, label, _ = RULES[rule]
+        seconds = None
+        if per_row and rows:
+            seconds = rows * (row_cost + cols * col_cost)
+            if rule == "concat_loop":
+                seconds += rows * rows * max(cols, 1) * 8 / 4e9 / 2  # 每次复制已累积部分，约 4 GB/s
+        findings.append(Finding(rule, line, label, seconds))
+    return findings
+
+
+def estimated_seconds(findings):
+    return sum(f.seconds for f in findings if f.seconds)
+
+
+def needs_rewrite(findings, threshold=LINT_REWRITE_SECONDS):
+    """估计耗时超过阈值，值得让模型先改写再执行"""
+    return estimated_seconds(findings) >= threshold
+
+
+def vectorize_request(findings, shape):
+    """发回给模型的改写要求：逐条指出位置与改法"""
+    lines = [f"- line {f.line}: {RULES[f.rule][3]}"
+             + (f" (estimated ~{f.seconds:.1f}s)" if f.seconds else "") for f in findings]
+    return (f"The code works but is too slow for this data ({shape[0]} rows x {shape[1]} columns). "
+            "Rewrite `process_step` with vectorized pandas/numpy operations and keep the same result:\n"
+            + "\n".join(lines))
+
+
+def format_findings(findings, runtime=None, shape=None):
+    """结果旁展示的性能说明 (markdown)；runtime 为实测 process_step 耗时 (秒)"""
+    parts = []
+    if runtime is not None:
+        parts.append(f"⏱️ process_step 实测 {runtime:.2f}s" + (f" ({shape[0]} 行 x {shape[1]} 列)" if shape else ""))
+    for f in findings:
+        estimate = f" (估计 ~{f.seconds:.1f}s)" if f.seconds else ""
+        parts.append(f"⚠️ 第 {f.line} 行：{f.message}{estimate}")
+    return "\n".join(f"> {p}" for p in parts)
@@ -0,0 +1,175 @@
+import functools
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import resource  # 仅类 Unix 平台可用
+except ImportError:
+    resource = None
+
+# ================= 性能监控 (各 App 共用) =================
+# 用法：
+#   with perf_stage("读取Excel"): ...
+#   @timed("构建Prompt")
+#   def build_prompt(...): ...
+# 每个浏览器会话在 st.session_state 中保留一个滚动窗口，侧边栏可展开查看 / 导出 JSONL。
+
+PERF_WINDOW = 500          # 每个会话保留的最大记录数
+SESSION_KEY = "perf_recorder"
+
+
+def _current_rss_mb():
+    """当前进程常驻内存 (MB)。优先读 /proc，其他平台退化为峰值 RSS。"""
+    if resource is None:
+        return 0.0
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        # macOS 的 ru_maxrss 单位是字节，Linux 是 KB；这里只作粗略参考
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class PerfRecorder:
+    """按阶段记录耗时与内存变化的轻量记录器"""
+
+    def __init__(self, maxlen=PERF_WINDOW):
+        self.records = deque(maxlen=maxlen)
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name, **meta):
+        parent = self._stack[-1] if self._stack else None
+        self._stack.append(name)
+        rss_before = _current_rss_mb()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            # st.rerun / st.stop 也是通过异常实现的，只记录类型，不吞掉
+            error = type(e).__name__
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            rss_after = _current_rss_mb()
+            self._stack.pop()
+            self.records.append({
+                "ts": time.time(),
+                "stage": name,
+                "parent": parent,
+                "seconds": round(elapsed, 6),
+                "rss_mb": round(rss_after, 1),
+                "rss_delta_mb": round(rss_after - rss_before, 1),
+                "error": error,
+                **meta,
+            })
+
+    def add(self, name, seconds, **meta):
+        """补录在别处测得的耗时 (如沙箱子进程回传的阶段耗时)"""
+        self.records.append({
+            "ts": time.time(),
+            "stage": name,
+            "parent": self._stack[-1] if self._stack else None,
+            "seconds": round(seconds, 6),
+            "rss_mb": None,
+            "rss_delta_mb": None,
+            "error": None,
+            **meta,
+        })
+
+    def timed(self, name=None):
+        """装饰器版本的 stage()"""
+        def decorator(func):
+            stage_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def clear(self):
+        self.records.clear()
+
+    def to_jsonl(self):
+        return "\n".join(json.dumps(r, ensure_ascii=False, default=str) for r in self.records)
+
+    def summary(self):
+        """按阶段汇总：次数 / 平均 / P95 / 最大 / 最近一次"""
+        if not self.records:
+            return pd.DataFrame()
+        df = pd.DataFrame(list(self.records))
+        grouped = df.groupby("stage", sort=False)["seconds"]
+        summary = pd.DataFrame({
+            "次数": grouped.size(),
+            "平均(s)": grouped.mean(),
+            "P95(s)": grouped.quantile(0.95),
+            "最大(s)": grouped.max(),
+            "最近(s)": grouped.last(),
+            "最近内存增量(MB)": df.groupby("stage", sort=False)["rss_delta_mb"].last(),
+        })
+        return summary.sort_values("平均(s)", ascending=False).round(4)
+
+
+# ================= Streamlit 会话绑定 =================
+
+def get_recorder():
+    """返回当前会话的记录器；脱离 Streamlit 运行时(如子进程)返回一个临时记录器"""
+    try:
+        import streamlit as st
+        if SESSION_KEY not in st.session_state:
+            st.session_state[SESSION_KEY] = PerfRecorder()
+        return st.session_state[SESSION_KEY]
+    except Exception:
+        return _FALLBACK_RECORDER
+
+
+_FALLBACK_RECORDER = PerfRecorder()
+
+
+def perf_stage(name, **meta):
+    return get_recorder().stage(name, **meta)
+
+
+def timed(name=None):
+    """装饰器：调用时才取会话记录器，避免模块导入阶段绑定到错误的会话"""
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with perf_stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render_perf_panel():
+    """侧边栏性能面板 (默认关闭)"""
+    import streamlit as st
+
+    with st.sidebar:
+        st.divider()
+        if not st.toggle("⏱️ 性能面板", value=False, key="perf_panel_on"):
+            return
+        recorder = get_recorder()
+        if not recorder.records:
+            st.caption("暂无记录")
+            return
+        st.caption(f"最近 {len(recorder.records)} 条记录 (当前内存 {_current_rss_mb():.0f} MB)")
+        st.dataframe(recorder.summary(), use_container_width=True)
+        c1, c2 = st.columns(2)
+        with c1:
+            st.download_button("📤 导出 JSONL", recorder.to_jsonl(), "perf_records.jsonl",
+                               mime="application/jsonl", use_container_width=True)
+        with c2:
+            if st.button("🧹 清空", key="perf_clear", use_container_width=True):
+                recorder.clear()
+                st.rerun()
@@ -1,12 +1,21 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-import io
-import re
-import math
-import datetime
-# 替换为通义千问兼容的 OpenAI 库
-from openai import OpenAI
+from perf_monitor import perf_stage, render_perf_panel
+from data_store import get_data_store
+from sandbox_pool import run_in_sandbox
+from data_preview import render_data_preview
+from dtype_optimizer import format_memory_report
+from exporters import export_frames_cached, render_export_options
+from series_store import render_store_ingest
+from charts import render_chart_panel
+from workspace import checkpoint_workspace, render_workspace_panel, restore_workspace
+from load_analytics import render_load_report
+from exec_env import HELPER_PROMPT
+# 通义千问兼容 OpenAI 接口：使用异步客户端，请求在后台事件循环中进行
+from llm_async import chat_completion, get_llm_loop, openai_client, wait_with_status
+from csv_reader import read_csv_upload, render_csv_options
+from header_layout import HEADER_SINGLE, flatten_header, read_header_levels, render_header_options
+from perf_lint import analyze_code, format_findings, frame_shape
 
 # ================= 0. 配置与初始化 =================
 
@@ -20,8 +29,8 @@ else:
 
 try:
     # 【核心修改 1】：必须使用截图中的“套餐专属 Base URL”
-    client = OpenAI(
-        api_key=api_key,
+    client = openai_client(
+        api_key,
         base_url="https://token-plan.cn-beijing.maas.aliyuncs.com/compatible-mode/v1"
     )
 except Exception as e:
@@ -29,29 +38,19 @@ except Exception as e:
     st.stop()
 
 # ================= 1. 核心工具函数 =================
-
-def clean_energy_time(series):
-    """解决 '24:00' 问题的能源行业时间清洗器"""
-    def parse_single_val(val):
-        s_val = str(val).strip()
-        if "24:00" in s_val:
-            temp_s = s_val.replace("24:00", "00:00")
-            try:
-                dt = pd.to_datetime(temp_s)
-                if len(s_val) > 8: return dt + pd.Timedelta(days=1)
-                return dt
-            except: return pd.NaT
-        else:
-            try: return pd.to_datetime(val)
-            except: return pd.NaT
-    try: return pd.to_datetime(series)
-    except: return series.apply(parse_single_val)
+# clean_energy_time 等工具函数定义在 exec_env 中，由沙箱子进程注入生成代码
 
 # ================= 2. 全局状态管理 =================
+# 进程级共享数据仓库：dfs_dict 里只保存句柄 (DataHandle)，多人上传同一文件时只解析、存储一份
+store = get_data_store()
+# 工作区检查点：重启 / 断线重连后按 URL 中的工作区编号恢复 (须在默认值初始化之前)
+restore_workspace("qwen_app")
+
 if "chat_history" not in st.session_state: st.session_state.chat_history = []
 if "current_df" not in st.session_state: st.session_state.current_df = None
 if "dfs_dict" not in st.session_state: st.session_state.dfs_dict = {} 
 if "file_hash" not in st.session_state: st.session_state.file_hash = None
+if "header_levels" not in st.session_state: st.session_state.header_levels = {} # 双层表头：扁平列名 -> [第一层, 第二层]，导出时还原
 
 # ================= 3. 侧边栏 =================
 with st.sidebar:
@@ -70,43 +69,41 @@ with st.sidebar:
     st.header("📂 文件上传")
     
     # 【UI 修改】：更新文案
-    header_mode = st.radio(
-        "选择 Excel 表头类型：", 
-        ["单行表头 (标准文件)", "双层表头 (保留原表层级)"], 
-        index=0
-    )
+    header_mode = render_header_options()
     
     uploaded_files = st.file_uploader("上传 Excel/CSV (支持多选)", type=["xlsx", "xls", "csv"], accept_multiple_files=True)
+    csv_options = render_csv_options()
     
     if uploaded_files:
-        current_hash = hash(tuple(f.getvalue() for f in uploaded_files) + (header_mode,))
+        current_hash = hash(tuple(f.getvalue() for f in uploaded_files) + (header_mode, csv_options))
         if st.session_state.file_hash != current_hash:
             try:
                 st.session_state.dfs_dict = {}
+                st.session_state.header_levels = {}
+                memory_report = {}
                 for f in uploaded_files:
-                    if f.name.endswith('.csv'):
-                        df_temp = pd.read_csv(f)
-                        df_temp.columns = df_temp.columns.astype(str)
-                    else:
-                        if header_mode == "单行表头 (标准文件)":
-                            # 标准单行读取
-                            df_temp = pd.read_excel(f)
+                    def parse_file(f=f):
+                        if f.name.endswith('.csv'):
+                            # pyarrow 引擎 + 类型提示；可选列裁剪 / 流式 96->24 聚合
+                            df_temp = read_csv_upload(f, csv_options)
                             df_temp.columns = df_temp.columns.astype(str)
                         else:
-                            # 【核心修改】：双层表头读取，保留 MultiIndex 结构以还原 Excel 视觉
-                            df_temp = pd.read_excel(f, header=[0, 1])
-                            
-                            # 优化表头显示：将无意义的 "Unnamed: x_level_y" 替换为空白，让 Streamlit 渲染更干净
-                            new_cols = []
-                            for col in df_temp.columns:
-                                level_0 = "" if "Unnamed" in str(col[0]) else str(col[0])
-                                level_1 = "" if "Unnamed" in str(col[1]) else str(col[1])
-                                new_cols.append((level_0, level_1))
-                            
-                            # 重新赋值为多层表头
-                            df_temp.columns = pd.MultiIndex.from_tuples(new_cols)
-                            
-                    st.session_state.dfs_dict[f.name] = df_temp
+                            if header_mode == HEADER_SINGLE:
+                                # 标准单行读取
+                                df_temp = pd.read_excel(f)
+                                df_temp.columns = df_temp.columns.astype(str)
+                            else:
+                                # 双层表头：整表只读一次，表头两行拼成扁平列名 "上层_下层"，不使用 MultiIndex
+                                df_temp = flatten_header(pd.read_excel(f, header=None))
+                        return {f.name: df_temp}
+
+                    # 同一文件 + 同一表头模式已被其他会话解析过时直接复用
+                    with perf_stage("读取文件", file=f.name):
+                        st.session_state.dfs_dict.update(store.load_upload(f.getvalue(), parse_file, f.name, header_mode, csv_options,
+                                                                         report=memory_report))
+                        if header_mode != HEADER_SINGLE and not f.name.endswith('.csv'):
+                            # 层级映射只读表头两行 (命中缓存时也不必重新解析整表)
+                            st.session_state.header_levels.update(read_header_levels(f.getvalue(), sheet_name=0))
                 
                 st.session_state.file_hash = current_hash
                 st.session_state.current_df = None 
@@ -114,7 +111,7 @@ with st.sidebar:
                 file_names_str = "\n".join([f"- `{name}`" for name in st.session_state.dfs_dict.keys()])
                 st.session_state.chat_history = [{
                     "role": "assistant", 
-                    "content": f"✅ **成功以【{header_mode}】模式加载 {len(uploaded_files)} 个文件！**\n{file_names_str}\n\n请下达指令。"
+                    "content": f"✅ **成功以【{header_mode}】模式加载 {len(uploaded_files)} 个文件！**\n{file_names_str}\n\n📉 {format_memory_report(memory_report)}\n\n请下达指令。"
                 }]
                 st.rerun()
             except Exception as e:
@@ -124,18 +121,25 @@ with st.sidebar:
         st.session_state.file_hash = None
         st.session_state.current_df = None
         st.session_state.dfs_dict = {}
+        st.session_state.header_levels = {}
         st.session_state.chat_history = []
         st.rerun()
 
     if st.session_state.current_df is not None:
         st.divider()
-        out = io.BytesIO()
-        with pd.ExcelWriter(out, engine='openpyxl') as writer:
-            if isinstance(st.session_state.current_df.columns, pd.MultiIndex):
-                st.session_state.current_df.to_excel(writer, index=True)
-            else:
-                st.session_state.current_df.to_excel(writer, index=False)
-        st.download_button("📥 下载汇总结果", out.getvalue(), "Merged_Result.xlsx", use_container_width=True)
+        export_format, compression = render_export_options()
+        with perf_stage("导出文件", format=export_format):
+            # 双层表头的列导出 Excel 时还原为两行表头 (合并单元格)
+            export = export_frames_cached({"Sheet1": st.session_state.current_df}, export_format, "Merged_Result",
+                                   index=False, compression=compression, header_levels=st.session_state.header_levels)
+        st.download_button("📥 下载汇总结果", export.data, export.file_name, mime=export.mime, use_container_width=True)
+        render_store_ingest({"Merged_Result": st.session_state.current_df})
+
+    # 状态有变化时后台写检查点 (只写新出现的数据版本)
+    checkpoint_workspace("qwen_app", ["chat_history", "current_df", "dfs_dict", "header_levels"],
+                         f"{len(st.session_state.dfs_dict)} 个文件 · {len(st.session_state.chat_history)} 条对话")
+    render_workspace_panel("qwen_app")
+    render_perf_panel()
 
 # ================= 4. 主界面 =================
 st.title("⚡ AI 能源数据分析台 (千问 V39)")
@@ -146,17 +150,18 @@ if not st.session_state.dfs_dict and st.session_state.current_df is None:
 
 # 数据预览逻辑
 if st.session_state.current_df is not None:
-    with st.expander("📊 当前工作区数据预览 (Top 5)", expanded=True):
-        st.dataframe(st.session_state.current_df.head(5), use_container_width=True)
-        st.caption(f"当前形状: {st.session_state.current_df.shape}")
+    with st.expander("📊 当前工作区数据预览", expanded=True):
+        render_data_preview(st.session_state.current_df, key="preview")
+    render_load_report(st.session_state.current_df)
+    render_chart_panel(st.session_state.current_df)
 else:
     with st.expander(f"📊 源文件预览 (共 {len(st.session_state.dfs_dict)} 个)", expanded=True):
         file_names = list(st.session_state.dfs_dict.keys())
         tabs = st.tabs(file_names[:10]) 
         for i, fname in enumerate(file_names[:10]):
             with tabs[i]:
-                st.dataframe(st.session_state.dfs_dict[fname].head(5), use_container_width=True)
-                st.caption(f"原始形状: {st.session_state.dfs_dict[fname].shape}")
+                # 直接传句柄：不筛选/排序时只读取当前页
+                render_data_preview(st.session_state.dfs_dict[fname], key=f"preview_{i}")
 
 for msg in st.session_state.chat_history:
     with st.chat_message(msg["role"]): st.markdown(msg["content"])
@@ -176,16 +181,17 @@ if user_prompt := st.chat_input("请输入指令..."):
                 df_dtypes = str(st.session_state.current_df.dtypes)
                 data_context = f"【Data Context】\nYou have a single working DataFrame `df`.\nSample:\n{df_sample}\nTypes:\n{df_dtypes}"
                 func_req = "2. Define a function `def process_step(df):` that returns the modified single dataframe."
-                exec_args = st.session_state.current_df.copy()
+                # 沙箱执行不会修改输入，无需再拷贝
+                exec_args = st.session_state.current_df
             else:
                 data_context = "【Data Context】\nYou are given a dictionary `dfs_dict` where KEYS are string filenames and VALUES are pandas DataFrames.\n"
-                for fname, df in list(st.session_state.dfs_dict.items())[:5]: 
-                    data_context += f"- Filename: '{fname}'\n  Columns: {list(df.columns)}\n"
+                for fname, handle in list(st.session_state.dfs_dict.items())[:5]: 
+                    data_context += f"- Filename: '{fname}'\n  Columns: {list(handle.get().columns)}\n"
                 if len(st.session_state.dfs_dict) > 5:
                     data_context += f"... and {len(st.session_state.dfs_dict)-5} more files.\n"
                 
                 func_req = "2. Define a function `def process_step(dfs_dict):` that processes this dictionary. Extract info from filenames if needed, combine all dataframes, and return ONE single resulting DataFrame."
-                exec_args = {k: v.copy() for k, v in st.session_state.dfs_dict.items()}
+                exec_args = {k: h.get() for k, h in st.session_state.dfs_dict.items()}
 
             # 构建符合 OpenAI/千问 规范的系统提示词
             system_prompt = f"""
@@ -196,7 +202,8 @@ if user_prompt := st.chat_input("请输入指令..."):
             【Requirements】
             1. Return ONLY valid Python code inside ```python blocks. No explanations outside the code block.
             {func_req}
-            3. Use `clean_energy_time(series)` for date parsing if needed.
+            3. Use `clean_energy_time(series)` for date parsing if needed. These built-in helpers are already available (do not import or redefine them):
+{HELPER_PROMPT}
             4. Assume necessary libraries (pd, np, re, math, datetime) are imported.
             5. Use regex `re.findall` or `re.search` to extract dates from keys (filenames) if necessary.
             """
@@ -204,14 +211,16 @@ if user_prompt := st.chat_input("请输入指令..."):
             status.write(f"正在请求千问 API ({selected_model})...")
             
             # 使用 openai 库调用千问
-            response = client.chat.completions.create(
-                model=selected_model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"User Request: {user_prompt}"}
-                ]
-            )
-            raw_code = response.choices[0].message.content
+            # 请求在途时页面继续刷新状态 (已等待秒数)
+            with perf_stage("LLM调用", model=selected_model):
+                raw_code = wait_with_status(get_llm_loop().submit(chat_completion(
+                    client,
+                    model=selected_model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": f"User Request: {user_prompt}"}
+                    ]
+                )), status, f"✨ 正在请求千问 API ({selected_model})...")
             
             # 提取代码块
             if "```python" in raw_code:
@@ -223,27 +232,24 @@ if user_prompt := st.chat_input("请输入指令..."):
             
             status.write("代码生成完毕，正在执行...")
             
-            # 执行环境
-            execution_globals = {
-                "pd": pd, "np": np, "re": re, "math": math, 
-                "datetime": datetime, "clean_energy_time": clean_energy_time 
-            }
-            local_scope = {}
-            exec(cleaned_code, execution_globals, local_scope)
+            # 执行前的性能静态检查 (本页单次生成，只提示不改写)
+            shape = frame_shape(exec_args)
+            findings = analyze_code(cleaned_code, shape)
+            if findings:
+                status.write(format_findings(findings))
+
+            # 在沙箱子进程中执行 (已注入 pd/np/re/math/datetime、clean_energy_time、time_slots、load_series、upsample_points、load_indicators、forecast_next_day 与 downsample_for_plot)
+            with perf_stage("沙箱执行"):
+                step = run_in_sandbox(cleaned_code, exec_args)
+            new_df = step.value
             
-            if 'process_step' in local_scope:
-                new_df = local_scope['process_step'](exec_args)
-                
-                st.session_state.current_df = new_df
-                status.update(label="✅ 执行成功", state="complete", expanded=False)
-                
-                result_msg = f"✅ 处理完成。当前表格形状: {new_df.shape}"
-                st.session_state.chat_history.append({"role": "assistant", "content": result_msg})
-                st.rerun()
-            else:
-                status.update(label="❌ 函数丢失", state="error")
-                st.error("AI 未生成 process_step 函数")
-                st.code(cleaned_code)
+            st.session_state.current_df = new_df
+            status.update(label="✅ 执行成功", state="complete", expanded=False)
+            
+            result_msg = f"✅ 处理完成。当前表格形状: {new_df.shape}\n\n" \
+                         + format_findings(findings, step.timings.get("process_step"), shape)
+            st.session_state.chat_history.append({"role": "assistant", "content": result_msg})
+            st.rerun()
 
         except Exception as e:
             status.update(label="❌ 发生错误", state="error")
@@ -0,0 +1,263 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from time_slots import DAY_MINUTES, label_codes, order_by_slot, slot_labels, time_slots
+
+# ================= 分辨率自适应降采样 =================
+# 从时刻标签推断源数据粒度 (5/15/30/60 分钟 -> 288/96/48/24 点)，
+# 按任意整数倍降采样到目标点数；夏令时切换日 (少/多 1 小时，如 92/100 点) 按文件中的行顺序分组。
+# 聚合在 (组数, 每组点数, 列数) 的三维数组上一次完成，不逐行循环；
+# 均值/最大/最小/合计/峰值时刻等多个统计量共用同一个三维数组，一次读取同时得出。
+# 反方向 (如 24 -> 96) 由 upsample 完成：所有列一次性展开，遵循右闭区间约定 (01:00 的值代表 00:15–01:00)。
+
+TARGET_POINTS = {"1 小时 (24 点)": 24, "30 分钟 (48 点)": 48, "15 分钟 (96 点)": 96}
+
+STAT_MEAN = "均值"
+STAT_MAX = "最大值"
+STAT_MIN = "最小值"
+STAT_SUM = "合计"
+STAT_PEAK = "峰值时刻"     # 组内最大值出现的时刻 (源数据的时段标签)
+STATISTICS = [STAT_MEAN, STAT_MAX, STAT_MIN, STAT_SUM, STAT_PEAK]
+
+ROUNDING = {"整数": 0, "1 位小数": 1, "2 位小数": 2, "3 位小数": 3, "不取整": None}
+
+UP_STEP = "阶梯保持"        # 组内各点等于该小时的值 (保持小时均值)
+UP_LINEAR = "线性插值"      # 在各小时的结束时刻之间线性插值
+UP_CUBIC = "三次样条"       # 自然三次样条 (scipy)，曲线更平滑
+UP_PROFILE = "保均值曲线"   # 按曲线形状分配，并保证每小时的均值与原值一致
+UPSAMPLE_METHODS = [UP_STEP, UP_LINEAR, UP_CUBIC, UP_PROFILE]
+UPSAMPLE_TARGETS = {"15 分钟 (96 点)": 96, "30 分钟 (48 点)": 48, "5 分钟 (288 点)": 288}
+_METHOD_ALIASES = {"step": UP_STEP, "linear": UP_LINEAR, "cubic": UP_CUBIC, "spline": UP_CUBIC,
+                   "profile": UP_PROFILE}
+
+
+def infer_interval(labels):
+    """根据时刻标签推断采样间隔 (分钟)；无法判断时返回 None"""
+    codes = label_codes(labels)
+    minutes = np.unique(codes[codes >= 0]).astype(np.int64)
+    if len(minutes) < 2:
+        return None
+    step = int(np.gcd.reduce(np.diff(minutes)))
+    if step <= 0 or DAY_MINUTES % step:
+        return None
+    return step
+
+
+def dst_hours(n_rows, points):
+    """行数相对整天多/少一小时时返回 +1 / -1 (夏令时切换日)，否则 0"""
+    per_hour = points // 24
+    if per_hour == 0:
+        return 0
+    if n_rows == points - per_hour:
+        return -1
+    if n_rows == points + per_hour:
+        return 1
+    return 0
+
+
+def file_order_rows(df, points):
+    """按文件原有顺序取出时段行及其时段号 (夏令时日的重复时刻不能按时段号排序)"""
+    slots = time_slots(df.index, points)
+    rows = np.flatnonzero(slots >= 0)
+    return df.iloc[rows], slots[rows]
+
+
+def _mark_repeats(names):
+    seen, labels = set(), []
+    for name in names:
+        labels.append(f"{name}*" if name in seen else name)
+        seen.add(name)
+    return labels
+
+
+def dst_labels(slots, ratio, points):
+    """夏令时日每组的标签取组内最后一个时段的结束时刻；重复出现的时刻加 * 区分"""
+    return _mark_repeats(np.asarray(slot_labels(points))[slots[ratio - 1::ratio]])
+
+
+def upsample_labels(slots, ratio, points):
+    """升采样后的标签：源时段 s (points 点) 展开为目标时段 s*ratio .. s*ratio+ratio-1；重复时刻加 *"""
+    fine = (np.asarray(slots)[:, None] * ratio + np.arange(ratio)).ravel()
+    return _mark_repeats(np.asarray(slot_labels(points * ratio))[fine])
+
+
+def reshape_groups(values, ratio):
+    """(行数, 列数) -> (组数, ratio, 列数)；行数必须是 ratio 的整数倍"""
+    return values.reshape(-1, ratio, values.shape[1])
+
+
+def group_mean(values, ratio):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # 整组为空时 nanmean 会告警
+        return np.nanmean(reshape_groups(values, ratio), axis=1)
+
+
+def group_stats(values, ratio, stats, row_labels=None):
+    """
+    在同一个 (组数, ratio, 列数) 数组上计算多个统计量，返回 {统计量: 二维数组}。
+    各统计量均忽略空值；整组为空时数值统计为 NaN、峰值时刻为空字符串。
+    峰值时刻需要 row_labels (每行的时段标签)。
+    """
+    groups = reshape_groups(values, ratio)
+    empty = np.isnan(groups).all(axis=1)
+    result = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # 整组为空时 nanmean/nanmax 会告警
+        for stat in stats:
+            if stat == STAT_MEAN:
+                result[stat] = np.nanmean(groups, axis=1)
+            elif stat == STAT_MAX:
+                result[stat] = np.nanmax(groups, axis=1)
+            elif stat == STAT_MIN:
+                result[stat] = np.nanmin(groups, axis=1)
+            elif stat == STAT_SUM:
+                result[stat] = np.where(empty, np.nan, np.nansum(groups, axis=1))
+            elif stat == STAT_PEAK:
+                # 空值按 -inf 参与 argmax，整组为空的位置最后置空
+                pos = np.argmax(np.where(np.isnan(groups), -np.inf, groups), axis=1)
+                names = reshape_groups(np.asarray(row_labels, dtype=object)[:, None], ratio)[:, :, 0]
+                peak = np.take_along_axis(names, pos, axis=1)
+                result[stat] = np.where(empty, "", peak)
+            else:
+                raise ValueError(f"未知的统计量: {stat}")
+    return result
+
+
+def round_values(df, decimals):
+    """数值列按 decimals 取整；0 位时转为整数 (空值先补 0)，None 表示不取整"""
+    if decimals is None:
+        return df
+    if decimals == 0:
+        return df.fillna(0).round(0).astype(int)
+    return df.round(decimals)
+
+
+def downsample(df_rows, ratio, labels, stats=(STAT_MEAN,), row_labels=None, decimals=None):
+    """
+    按连续 ratio 行一组聚合 (忽略空值)，返回以 labels 为索引的新表。
+    只有一个统计量时列与原表相同；多个统计量时列为两层表头 (原列, 统计量)。
+    """
+    values = df_rows.to_numpy(dtype=float, na_value=np.nan)
+    stats = list(stats)
+    frames = {}
+    for stat, block in group_stats(values, ratio, stats, row_labels).items():
+        frame = pd.DataFrame(block, index=labels)  # 先用列位置作列名，重名列也不会错位
+        frames[stat] = frame if stat == STAT_PEAK else round_values(frame, decimals)
+    if len(stats) == 1:
+        return frames[stats[0]].set_axis(df_rows.columns, axis=1)
+    # 同一列的各统计量相邻：(原列, 统计量)
+    order = [(stat, i) for i in range(df_rows.shape[1]) for stat in stats]
+    combined = pd.concat(frames, axis=1)[order]
+    combined.columns = pd.MultiIndex.from_arrays(
+        [[df_rows.columns[i] for _, i in order], [stat for stat, _ in order]], names=["列", "统计量"])
+    return combined
+
+
+def split_statistics(df):
+    """两层表头 (列, 统计量) 的结果按统计量拆成 {统计量: 表}；单层表头原样返回 {None: df}"""
+    if not isinstance(df.columns, pd.MultiIndex) or df.columns.names[-1] != "统计量":
+        return {None: df}
+    stats = df.columns.get_level_values(-1)
+    return {stat: df.loc[:, stats == stat].droplevel(-1, axis=1) for stat in dict.fromkeys(stats)}
+
+
+# ================= 升采样 (如 24 -> 96) =================
+
+def _anchor_weights(n, ratio):
+    """细粒度第 j 点在相邻两个小时端点之间的位置：返回 (左端点, 右端点, 右端点权重)"""
+    t = (np.arange(n * ratio) + 1) / ratio - 1  # 以小时端点为单位的坐标，第 k 个端点在 t = k
+    t = np.clip(t, 0, n - 1)                     # 第一个小时之前按第一个值保持
+    left = np.floor(t).astype(int)
+    right = np.minimum(left + 1, n - 1)
+    return left, right, (t - left)[:, None]
+
+
+def _linear(values, ratio):
+    left, right, w = _anchor_weights(len(values), ratio)
+    return values[left] * (1 - w) + values[right] * w
+
+
+def _cubic(values, ratio):
+    from scipy.interpolate import CubicSpline
+
+    n = len(values)
+    out = _linear(values, ratio)
+    ok = ~np.isnan(values).any(axis=0)  # 有空值的列退回线性插值
+    if n < 3 or not ok.any():
+        return out
+    x = np.clip((np.arange(n * ratio) + 1) / ratio - 1, 0, n - 1)
+    out[:, ok] = CubicSpline(np.arange(n), values[:, ok], axis=0, bc_type="natural")(x)
+    return out
+
+
+def _profile(values, ratio, profile=None):
+    """
+    保均值分配：没有给出曲线时以线性插值为形状、按小时平移到原均值；
+    给出曲线 (长度为总点数或其约数的一维数组，或同形状的二维数组) 时按曲线比例缩放，曲线组均值为 0 的小时退回阶梯。
+    """
+    step = np.repeat(values, ratio, axis=0)
+    if profile is None:
+        shape = _linear(values, ratio)
+        return shape + step - np.repeat(group_mean(shape, ratio), ratio, axis=0)
+    profile = np.asarray(profile, dtype=float)
+    if profile.ndim == 1:
+        if len(step) % len(profile):
+            raise ValueError(f"曲线长度 {len(profile)} 与总点数 {len(step)} 不匹配")
+        profile = np.tile(profile, len(step) // len(profile))[:, None]
+    scale = np.repeat(group_mean(np.broadcast_to(profile, step.shape).copy(), ratio), ratio, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        shaped = step * profile / scale
+    return np.where(np.isfinite(shaped), shaped, step)
+
+
+def upsample_values(values, ratio, method=UP_STEP, profile=None):
+    """(行数, 列数) -> (行数*ratio, 列数)：每一行 (一个粗时段) 展开为 ratio 个细时段，所有列一次完成"""
+    method = _METHOD_ALIASES.get(method, method)
+    if method == UP_STEP:
+        return np.repeat(values, ratio, axis=0)
+    if method == UP_LINEAR:
+        return _linear(values, ratio)
+    if method == UP_CUBIC:
+        return _cubic(values, ratio)
+    if method == UP_PROFILE:
+        return _profile(values, ratio, profile)
+    raise ValueError(f"未知的升采样方法: {method}")
+
+
+def upsample(df_rows, ratio, labels, method=UP_STEP, profile=None, decimals=None):
+    """按时间顺序排列的粗粒度行 -> 以 labels 为索引的细粒度表"""
+    values = df_rows.to_numpy(dtype=float, na_value=np.nan)
+    frame = pd.DataFrame(upsample_values(values, ratio, method, profile), index=labels, columns=df_rows.columns)
+    return round_values(frame, decimals)
+
+
+def upsample_points(df, points=96, method="linear", profile=None):
+    """
+    供生成代码使用：把小时 (或其他粗粒度) 数据展开为 points 点，所有列一次完成。
+    - 行索引为时刻标签 ('01:00' ... '24:00')：须为完整的一天，返回以 slot_labels(points) 为索引的表；
+    - 行索引为完整时间戳 (可跨多天，右闭区间，如 01:00 代表 00:00–01:00)：返回对应的细粒度时间戳索引。
+    method: "step" / "linear" / "cubic" / "profile" (或中文名)。
+    """
+    if isinstance(df.index, pd.DatetimeIndex):
+        rows = df.sort_index()
+        minutes = DAY_MINUTES // points
+        # 源粒度取相邻时间戳间隔的众数 (只有一行时按小时数据处理)
+        gap = pd.Series(rows.index[1:] - rows.index[:-1]).mode()
+        ratio = int(gap.iloc[0] / pd.Timedelta(minutes=minutes)) if len(gap) else 60 // minutes
+        offsets = pd.to_timedelta(np.arange(ratio - 1, -1, -1) * minutes, unit="min").to_numpy()
+        index = pd.DatetimeIndex((rows.index.to_numpy()[:, None] - offsets[None, :]).ravel(), name=df.index.name)
+        return upsample(rows, max(ratio, 1), index, method, profile)
+    interval = infer_interval(df.index)
+    if interval is None:
+        raise ValueError("无法从行索引识别时刻")
+    source = DAY_MINUTES // interval
+    if points % source:
+        raise ValueError(f"{source} 点无法整数倍展开为 {points} 点")
+    rows, slots = order_by_slot(df, points=source)
+    if len(rows) != source or len(np.unique(slots)) != source:
+        raise ValueError(f"时段不完整：应为 {source} 行，实际 {len(rows)} 行")
+    out = upsample(rows, points // source, slot_labels(points), method, profile)
+    out.index.name = df.index.name
+    return out
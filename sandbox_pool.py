@@ -0,0 +1,198 @@
+import gc
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import traceback
+
+import df_transport
+from data_store import lazy_copy
+from exec_env import StepResult, run_generated_code
+from perf_monitor import get_recorder, perf_stage
+
+try:
+    import resource  # 仅类 Unix 平台可用
+except ImportError:
+    resource = None
+
+# ================= 生成代码沙箱执行池 =================
+# AI 生成的 process_step 在预热好的子进程里运行 (pandas/numpy 已导入)：
+# - 每个任务单独的 CPU 时间上限 (RLIMIT_CPU) 和墙钟超时，超时直接杀掉子进程并补一个新的；
+# - 子进程整体内存上限 (RLIMIT_AS)，超限在子进程内表现为 MemoryError，不影响服务进程；
+# - DataFrame 经 df_transport 以 Arrow IPC 形式放在共享内存里进出，不走 pickle。
+# 设置 SANDBOX_ENABLED=0 可退回旧的进程内 exec (如 Windows 本地调试)。
+
+SANDBOX_ENABLED = os.environ.get("SANDBOX_ENABLED", "1") != "0"
+SANDBOX_WORKERS = int(os.environ.get("SANDBOX_WORKERS", "2"))
+SANDBOX_CPU_SECONDS = int(os.environ.get("SANDBOX_CPU_SECONDS", "120"))
+SANDBOX_MEMORY_MB = int(os.environ.get("SANDBOX_MEMORY_MB", "4096"))
+SANDBOX_TIMEOUT = float(os.environ.get("SANDBOX_TIMEOUT", "180"))
+# 额外预导入到 forkserver 的模块 (逗号分隔，如 "scipy,statsmodels.api")：子进程直接继承，首次使用不再等待导入
+SANDBOX_PRELOAD = [m.strip() for m in os.environ.get("SANDBOX_PRELOAD", "").split(",") if m.strip()]
+
+
+class SandboxError(RuntimeError):
+    """生成代码在沙箱中执行失败；消息保留原异常类型，方便回传给 AI 修正"""
+
+
+class SandboxTimeout(SandboxError):
+    pass
+
+
+# ================= 子进程侧 =================
+
+def _cpu_seconds_used():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _set_soft_limit(kind, value):
+    # 只调软上限：普通用户降低硬上限后无法再升回来，而 CPU 上限需要每个任务重新设置
+    _, hard = resource.getrlimit(kind)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(kind, (value, hard))
+
+
+def _worker_main(conn, memory_mb):
+    if resource is not None and memory_mb:
+        _set_soft_limit(resource.RLIMIT_AS, memory_mb * 1024 * 1024)
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        code, arg_handle, cpu_seconds = task
+        arg = None
+        try:
+            if resource is not None and cpu_seconds:
+                # RLIMIT_CPU 按进程累计，所以每个任务都在已用时间基础上再放宽 cpu_seconds
+                _set_soft_limit(resource.RLIMIT_CPU, int(_cpu_seconds_used()) + cpu_seconds)
+            start = time.perf_counter()
+            arg = df_transport.attach(arg_handle, unlink=False)  # 输入由主进程回收
+            attach_seconds = time.perf_counter() - start
+
+            step = run_generated_code(code, arg)
+
+            start = time.perf_counter()
+            out_handle = df_transport.publish(step.value)
+            timings = {"沙箱读入": attach_seconds, **step.timings,
+                       "沙箱回传": time.perf_counter() - start}
+            conn.send(("ok", out_handle, step.explanation, step.styled, timings))
+        except BaseException as e:
+            conn.send(("error", type(e).__name__, str(e), traceback.format_exc(limit=5)))
+        finally:
+            del arg
+            gc.collect()
+
+
+# ================= 主进程侧 =================
+
+class _Worker:
+    def __init__(self, ctx, memory_mb):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, memory_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class SandboxPool:
+    """固定大小的子进程池；每个会话线程借出一个空闲进程执行一次 process_step"""
+
+    def __init__(self, workers=SANDBOX_WORKERS, cpu_seconds=SANDBOX_CPU_SECONDS,
+                 memory_mb=SANDBOX_MEMORY_MB, timeout=SANDBOX_TIMEOUT):
+        methods = mp.get_all_start_methods()
+        # 不用 fork：Streamlit 服务进程里有很多线程，fork 出来的子进程可能带着锁死的状态
+        self._ctx = mp.get_context("forkserver" if "forkserver" in methods else "spawn")
+        if self._ctx.get_start_method() == "forkserver":
+            self._ctx.set_forkserver_preload(["exec_env", "time_slots", "series_store", "df_transport", "sandbox_pool",
+                                              *SANDBOX_PRELOAD])
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        for _ in range(workers):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        return _Worker(self._ctx, self.memory_mb)
+
+    def run(self, code, arg, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        with perf_stage("沙箱发布输入"):
+            arg_handle = df_transport.publish(arg)
+        worker = self._idle.get()
+        try:
+            if not worker.process.is_alive():
+                worker = self._spawn()
+            worker.conn.send((code, arg_handle, self.cpu_seconds))
+            if not worker.conn.poll(timeout):
+                worker.kill()
+                worker = self._spawn()
+                raise SandboxTimeout(f"TimeoutError: 代码执行超过 {timeout:.0f} 秒，已强制终止 (可能存在死循环或笛卡尔积)")
+            try:
+                reply = worker.conn.recv()
+            except EOFError:
+                worker.process.join(timeout=1)
+                exitcode = worker.process.exitcode
+                worker.kill()
+                worker = self._spawn()
+                raise SandboxError(f"ResourceError: 执行进程异常退出 (exitcode={exitcode})，"
+                                   f"可能超出 CPU 时间 {self.cpu_seconds}s 或内存 {self.memory_mb}MB 限制")
+        finally:
+            self._idle.put(worker)
+            df_transport.release(arg_handle)
+
+        if reply[0] == "error":
+            _, exc_type, message, _tb = reply
+            raise SandboxError(f"{exc_type}: {message}")
+        _, out_handle, explanation, styled, timings = reply
+        with perf_stage("沙箱取回结果"):
+            # 结果会成为 current_df 并作为下一步的输入，必须可写：复制一次，不用只读的零拷贝映射
+            value = df_transport.attach(out_handle)
+        return StepResult(value, explanation, styled, timings)
+
+    def shutdown(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().kill()
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    """进程级单例：所有 Streamlit 会话共用一个执行池"""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = SandboxPool()
+        return _POOL
+
+
+def _copy_arg(arg):
+    # 写时复制：生成代码对副本的任何修改都不会写回原数据，无需整表深拷贝
+    if isinstance(arg, dict):
+        return {k: lazy_copy(v) for k, v in arg.items()}
+    return lazy_copy(arg)
+
+
+def run_in_sandbox(code, arg, timeout=None):
+    """执行生成代码中的 process_step(arg)，返回 StepResult。arg 不会被修改。"""
+    if not SANDBOX_ENABLED:
+        step = run_generated_code(code, _copy_arg(arg))
+    else:
+        step = get_pool().run(code, arg, timeout=timeout)
+    recorder = get_recorder()
+    for stage, seconds in step.timings.items():
+        recorder.add(stage, seconds, sandbox=SANDBOX_ENABLED)
+    return step
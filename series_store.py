@@ -0,0 +1,359 @@
+import datetime
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows：只在进程内互斥
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from time_slots import label_codes
+
+# ================= 本地时序库 (跨天 / 跨文件) =================
+# 转换结果和 AI 分析结果以前只能下载，做月度/年度分析要把几十个工作簿重新上传、重新转换。
+# 这里把结果按 站点/月份 分区追加写入 Parquet (只追加、不改写)，另有一个很小的索引文件
+# (_index.jsonl，每个分区文件一行：站点、日期范围、行数、批次)。
+# - 查询先在内存中的索引里筛出站点和日期范围相交的文件，只读取这几个文件；
+# - 同一站点同一天重复写入时，以最后一次写入为准 (按批次号去重)；
+# - 分区文件多了可以 compact() 合并，合并后查询仍只读每月一个文件。
+# 生成代码可以直接调用 load_series(站点, 起始日期, 结束日期) 取数。
+# 追加索引行与 compact 重写索引互斥 (进程内锁 + _index.lock 文件锁)：合并期间其他会话 / 进程登记的新文件不会丢失。
+
+STORE_DIR = os.environ.get("SERIES_STORE_DIR") or os.path.join(tempfile.gettempdir(), "series_store")
+INDEX_FILE = "_index.jsonl"
+LOCK_FILE = "_index.lock"
+LONG_COLUMNS = ["日期", "时间", "分钟", "指标", "数值", "批次"]
+_DATE_IN_NAME = re.compile(r"(\d{4})[-_./年]?(\d{1,2})[-_./月]?(\d{1,2})")
+
+
+def _metric_name(col):
+    if isinstance(col, tuple):
+        return "_".join(str(p) for p in col if str(p) and not str(p).startswith("Unnamed"))
+    return str(col)
+
+
+def _safe_part(text):
+    return re.sub(r'[\\/:*?"<>|=\s]+', "_", str(text)).strip("_") or "_"
+
+
+def sheet_date(name):
+    """从 Sheet 名 / 文件名中识别日期 (如 2026-01-05、20260105、2026年1月5日)，识别不到返回 None"""
+    m = _DATE_IN_NAME.search(str(name))
+    if not m:
+        return None
+    try:
+        return pd.Timestamp(datetime.date(*map(int, m.groups())))
+    except ValueError:
+        return None
+
+
+_DATETIME_KINDS = ("datetime", "datetime64", "date")
+
+
+def _is_time_axis(values):
+    """是否有可识别的时刻：时刻标签 (至少一行)，或不全在零点的时间戳"""
+    if pd.api.types.infer_dtype(values, skipna=True) in _DATETIME_KINDS:
+        ts = pd.Series(pd.to_datetime(values, errors="coerce")).dropna()
+        return bool(len(ts)) and not (ts == ts.dt.normalize()).all()
+    labels = pd.Series(np.asarray(values, dtype=object)).astype(str).str.strip().str.rstrip("*")
+    return bool((label_codes(labels) >= 0).any())
+
+
+def to_long(df, date=None):
+    """
+    把时段表 (行 = 时刻，列 = 指标) 转为长表 [日期, 时间, 分钟, 指标, 数值]。
+    行索引为完整时间戳时日期取自索引 (次日 00:00 记为当天 24:00)；只有时刻时使用 date。
+    行索引不含时刻 (如 reset_index 后的 RangeIndex) 时，以第一个能识别为时刻 / 时间戳的列作为行索引；
+    都识别不到时报错，而不是返回空表。非时段行、非数值列 (如峰值时刻) 和空值不入库。
+    """
+    index = df.index
+    if isinstance(index, pd.MultiIndex):
+        raise ValueError("行索引为多层时无法识别时刻")
+    if pd.api.types.infer_dtype(index, skipna=True) not in _DATETIME_KINDS and not _is_time_axis(index):
+        time_col = next((c for c in df.columns if _is_time_axis(df[c])), None)
+        if time_col is None:
+            raise ValueError("行索引和各列中都没有可识别的时刻 (如 00:15、24:00 或完整时间戳)")
+        df = df.set_index(time_col)
+        index = df.index
+    if pd.api.types.infer_dtype(index, skipna=True) in _DATETIME_KINDS:
+        ts = pd.Series(pd.to_datetime(index, errors="coerce"))
+        shifted = ts - pd.Timedelta(minutes=1)  # 00:00 归到前一天的 24:00
+        dates = shifted.dt.normalize()
+        minutes = ((ts - dates).dt.total_seconds() // 60).to_numpy(dtype=float)
+        stars = np.zeros(len(ts), dtype=bool)
+        keep = ts.notna().to_numpy()
+        if (ts[keep] == ts[keep].dt.normalize()).all():
+            raise ValueError("行索引只有日期，没有时刻")
+    else:
+        if date is None:
+            raise ValueError("行索引只有时刻，需要指定日期")
+        labels = pd.Series(index.astype(str)).str.strip()
+        stars = labels.str.endswith("*").to_numpy()  # 夏令时结束日重复的时刻
+        minutes = label_codes(labels.str.rstrip("*"))
+        dates = pd.Series(pd.Timestamp(date).normalize(), index=labels.index)
+        keep = minutes >= 0
+    rows = np.flatnonzero(keep)
+    if not len(rows):
+        return pd.DataFrame(columns=LONG_COLUMNS[:-1])
+
+    values = df.iloc[rows].apply(pd.to_numeric, errors="coerce")
+    numeric = values.notna().any().to_numpy()
+    values = values.loc[:, numeric]
+    metrics = [_metric_name(c) for c in df.columns[numeric]]
+    minutes = minutes[rows].astype(np.int16)
+    times = np.array([f"{m // 60:02d}:{m % 60:02d}" for m in range(1441)], dtype=object)[minutes]
+    times = np.where(stars[rows], times + "*", times)
+
+    n_rows, n_cols = values.shape
+    long = pd.DataFrame({
+        "日期": np.repeat(dates.to_numpy()[rows], n_cols),
+        "时间": np.repeat(times, n_cols),
+        "分钟": np.repeat(minutes, n_cols),
+        "指标": np.tile(np.asarray(metrics, dtype=object), n_rows),
+        "数值": values.to_numpy(dtype=float, na_value=np.nan).ravel(),
+    })
+    return long[long["数值"].notna()].reset_index(drop=True)
+
+
+class SeriesStore:
+    """按 站点/月份 分区的只追加 Parquet 时序库"""
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self._lock = threading.Lock()        # 保护内存中的索引副本
+        self._write_lock = threading.Lock()  # 索引文件的写入 (追加 / 重写)
+        self._catalog = None
+        self._catalog_stamp = None
+
+    # ---------- 索引 ----------
+    def _index_path(self):
+        return os.path.join(self.root, INDEX_FILE)
+
+    @contextmanager
+    def _index_locked(self):
+        """独占索引文件的写入：同一进程内用线程锁，跨进程用 flock (没有 fcntl 时只有线程锁)"""
+        with self._write_lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, LOCK_FILE), "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def catalog(self):
+        """索引表：每个分区文件一行；索引文件没有变化时直接用内存里的副本"""
+        path = self._index_path()
+        try:
+            stat = os.stat(path)
+            stamp = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            stamp = (0, 0)
+        with self._lock:
+            if self._catalog is None or stamp != self._catalog_stamp:
+                entries = []
+                if stamp[0]:
+                    with open(path, encoding="utf-8") as f:
+                        entries = [json.loads(line) for line in f if line.strip()]
+                catalog = pd.DataFrame(entries, columns=["station", "path", "start", "end", "rows", "batch"])
+                catalog["start"] = pd.to_datetime(catalog["start"])
+                catalog["end"] = pd.to_datetime(catalog["end"])
+                self._catalog, self._catalog_stamp = catalog, stamp
+            return self._catalog
+
+    def stations(self):
+        """各站点的日期范围和数据量"""
+        catalog = self.catalog()
+        return catalog.groupby("station").agg(起始日期=("start", "min"), 结束日期=("end", "max"),
+                                              行数=("rows", "sum"), 文件数=("path", "size")).reset_index()
+
+    # ---------- 写入 ----------
+    def append(self, station, long):
+        """把 to_long 的结果追加为新的分区文件 (每个月一个文件)，返回写入行数"""
+        if not len(long):
+            return 0
+        batch = time.time_ns()
+        long = long.assign(批次=batch)
+        station_dir = os.path.join(self.root, f"station={_safe_part(station)}")
+        lines = []
+        for month, part in long.groupby(long["日期"].dt.strftime("%Y-%m"), sort=True):
+            month_dir = os.path.join(station_dir, f"month={month}")
+            os.makedirs(month_dir, exist_ok=True)
+            path = os.path.join(month_dir, f"part-{batch}-{uuid.uuid4().hex[:8]}.parquet")
+            tmp = f"{path}.tmp"
+            part.to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+            lines.append(json.dumps({
+                "station": str(station), "path": os.path.relpath(path, self.root),
+                "start": part["日期"].min().strftime("%Y-%m-%d"), "end": part["日期"].max().strftime("%Y-%m-%d"),
+                "rows": len(part), "batch": batch}, ensure_ascii=False))
+        # 数据文件落盘之后才登记索引：查询永远看不到写了一半的文件
+        with self._index_locked(), open(self._index_path(), "a", encoding="utf-8") as f:
+            f.write("".join(f"{line}\n" for line in lines))
+        return len(long)
+
+    def ingest(self, station, df, date=None):
+        """写入一张时段表 (见 to_long)，返回写入行数"""
+        return self.append(station, to_long(df, date))
+
+    # ---------- 查询 ----------
+    def _read_long(self, stations, start, end, metrics):
+        """多个站点 [start, end] 的长表 (带 站点 列)；所有命中文件读完后只做一次去重、排序"""
+        catalog = self.catalog()
+        start = pd.Timestamp(start).normalize() if start is not None else None
+        end = pd.Timestamp(end).normalize() if end is not None else None
+        hit = catalog["station"].isin([str(s) for s in stations])
+        if start is not None:
+            hit &= catalog["end"] >= start
+        if end is not None:
+            hit &= catalog["start"] <= end
+        filters = ([("日期", ">=", start)] if start is not None else []) + \
+                  ([("日期", "<=", end)] if end is not None else [])
+        if metrics is not None:
+            metrics = [metrics] if isinstance(metrics, str) else list(metrics)
+            filters.append(("指标", "in", metrics))
+        tables = []
+        for station, files in catalog[hit].groupby("station", sort=False)["path"]:
+            # 同一站点的分区文件一次交给 pyarrow 并行读取，行过滤下推到 Parquet 的行组统计
+            table = pq.read_table([os.path.join(self.root, path) for path in files], filters=filters or None)
+            tables.append(table.append_column("站点", pa.array(np.full(table.num_rows, station, dtype=object),
+                                                              pa.string())))
+        long = pa.concat_tables(tables).to_pandas() if tables else None
+        if long is None or not len(long):
+            return pd.DataFrame(columns=["站点", *LONG_COLUMNS])
+        # 同一天重复入库时以最后一次为准；再按日期、时刻排序 (重复时刻保持原有先后)
+        long = long.sort_values("批次", kind="stable").drop_duplicates(["站点", "日期", "时间", "指标"], keep="last")
+        return long.sort_values(["日期", "分钟"], kind="stable").reset_index(drop=True)
+
+    def query(self, station, start=None, end=None, metrics=None, wide=True):
+        """
+        取某站点 [start, end] (含两端) 的数据。
+        wide=True 返回 (日期, 时间) x 指标 的宽表，否则返回长表。
+        """
+        long = self._read_long([station], start, end, metrics).drop(columns="站点")
+        if not wide:
+            return long.drop(columns=["分钟", "批次"])
+        metric_order = long["指标"].unique().tolist()
+        table = long.pivot(index=["日期", "时间"], columns="指标", values="数值")
+        rows = pd.MultiIndex.from_frame(long[["日期", "时间"]].drop_duplicates())
+        table = table.reindex(index=rows, columns=metric_order if len(long) else [])
+        table.columns.name = None
+        return table
+
+    def query_many(self, stations, start=None, end=None, metrics=None):
+        """多个站点一次查询，返回带 站点 列的长表 [站点, 日期, 时间, 指标, 数值]"""
+        return self._read_long(stations, start, end, metrics).drop(columns=["分钟", "批次"])
+
+    # ---------- 维护 ----------
+    def compact(self, station=None):
+        """
+        把每个 站点/月份 的多个分区文件合并为一个 (去重后)，并重写索引。
+        从读取索引到替换索引全程持有索引写锁：期间 append 写好的数据文件要等合并完成才能登记，不会被覆盖掉。
+        """
+        with self._index_locked():
+            return self._compact(station)
+
+    def _compact(self, station):
+        catalog = self.catalog()
+        if not len(catalog):
+            return 0
+        merged = 0
+        keep = []
+        for (name, month_dir), group in catalog.groupby(
+                [catalog["station"], catalog["path"].map(os.path.dirname)], sort=False):
+            if (station is not None and name != str(station)) or len(group) == 1:
+                keep.append(group)
+                continue
+            long = pd.concat([pd.read_parquet(os.path.join(self.root, p)) for p in group["path"]],
+                             ignore_index=True)
+            long = long.sort_values("批次", kind="stable").drop_duplicates(["日期", "时间", "指标"], keep="last")
+            long = long.sort_values(["日期", "分钟"], kind="stable")
+            batch = int(group["batch"].max())
+            path = os.path.join(month_dir, f"part-{batch}-compact.parquet")
+            long.to_parquet(os.path.join(self.root, f"{path}.tmp"), index=False)
+            os.replace(os.path.join(self.root, f"{path}.tmp"), os.path.join(self.root, path))
+            keep.append(pd.DataFrame([{"station": name, "path": path, "start": long["日期"].min(),
+                                       "end": long["日期"].max(), "rows": len(long), "batch": batch}]))
+            merged += len(group)
+        catalog_new = pd.concat(keep, ignore_index=True)
+        with self._lock:  # 已持有索引写锁 (见 compact)
+            tmp = f"{self._index_path()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for row in catalog_new.itertuples(index=False):
+                    f.write(json.dumps({"station": row.station, "path": row.path,
+                                        "start": pd.Timestamp(row.start).strftime("%Y-%m-%d"),
+                                        "end": pd.Timestamp(row.end).strftime("%Y-%m-%d"),
+                                        "rows": int(row.rows), "batch": int(row.batch)}, ensure_ascii=False) + "\n")
+            os.replace(tmp, self._index_path())
+            self._catalog = None
+        # 索引切换后再删除被合并的旧文件
+        live = set(catalog_new["path"])
+        for path in catalog["path"]:
+            if path not in live:
+                try:
+                    os.unlink(os.path.join(self.root, path))
+                except OSError:
+                    pass
+        return merged
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_series_store():
+    """进程级单例"""
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = SeriesStore()
+        return _STORE
+
+
+def load_series(station, start=None, end=None, metrics=None, wide=True):
+    """供生成代码使用：按站点和日期范围 (含两端) 取历史数据"""
+    return get_series_store().query(station, start, end, metrics, wide)
+
+
+def list_series():
+    """供生成代码使用：库中已有的站点及日期范围"""
+    return get_series_store().stations()
+
+
+def render_store_ingest(frames, key="store", default_station=""):
+    """侧边栏"存入时序库"：frames 为 {Sheet 名: 时段表或 DataHandle}；Sheet 名含日期时按 Sheet 名的日期入库"""
+    import streamlit as st
+
+    with st.expander("🗄️ 存入时序库 (跨天/跨文件分析)"):
+        station = st.text_input("站点", value=default_station, key=f"{key}_station")
+        default_date = st.date_input("日期 (Sheet 名中没有日期时使用)", key=f"{key}_date")
+        if st.button("💾 写入", key=f"{key}_ingest", disabled=not station):
+            store = get_series_store()
+            written, skipped = 0, []
+            for name, df in frames.items():
+                if not isinstance(df, pd.DataFrame):
+                    df = df.get()  # DataHandle：点击写入时才取出数据
+                try:
+                    written += store.ingest(station, df, sheet_date(name) or default_date)
+                except ValueError as e:
+                    skipped.append(f"{name} ({e})")
+            if written:
+                st.success(f"已写入 {written} 条记录")
+            else:
+                st.error("没有写入任何记录：请检查表中是否有时刻行和数值列")
+            if skipped:
+                st.caption("未入库：" + "；".join(skipped))
@@ -0,0 +1,126 @@
+import ast
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from data_store import get_data_store
+from exec_env import StepResult
+from perf_monitor import get_recorder
+from sandbox_pool import run_in_sandbox
+
+# ================= 步骤结果记忆 (代码哈希 + 数据版本 -> 结果) =================
+# 只依赖输入数据的 process_step 代码作用在同一版本的数据上，结果必然相同：
+# - 重跑技能库里的宏、撤销后重做、AI 自动修正时给出了与上次完全相同的代码，都直接取结果，不再进沙箱；
+# - 结果 DataFrame 存进共享数据仓库 (按内容寻址)，记忆表只持有句柄：内存紧张时由仓库按 LRU 落盘为 Parquet；
+# - 记忆表本身按 LRU 保留最近 STEP_MEMO_ENTRIES 条，淘汰时释放句柄；
+# - 代码读取历史库 / 预测模型 (load_series、forecast_next_day 等)、当前时间、随机数或文件时结果会变，不记忆；
+# - 执行报错不进共享记忆表：可能只是一时的失败，也不应把一个会话的错误抛给其他会话；
+#   同一次请求内的自动修正由调用方 (ai_app.solve_sheet) 自行记住失败过的代码，不重复执行。
+# 数据版本即 DataStore.version (内容指纹)，所有会话共用一张记忆表。
+
+STEP_MEMO_ENTRIES = int(os.environ.get("STEP_MEMO_ENTRIES", "256"))
+
+# 出现这些名字 (函数名或属性名) 的代码视为结果不只取决于输入数据
+IMPURE_NAMES = {
+    "load_series", "list_series", "forecast_next_day",          # 历史库 / 模型缓存会变
+    "now", "today", "utcnow", "time", "perf_counter", "monotonic",  # 当前时间
+    "random", "rand", "randn", "randint", "choice", "shuffle", "permutation", "sample", "default_rng",
+    "uuid1", "uuid4", "urandom",                                 # 随机数
+    "open", "read_csv", "read_excel", "read_parquet", "read_feather", "read_json", "listdir", "environ",
+}
+
+
+def code_hash(code):
+    """代码指纹：忽略首尾空白与行尾空格，其余任何改动都视为不同代码"""
+    text = "\n".join(line.rstrip() for line in code.strip().splitlines())
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def is_deterministic(code):
+    """代码是否只依赖输入数据 (没有用到 IMPURE_NAMES)；语法错误的代码返回 False (交给执行阶段报错)"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return False
+    for node in ast.walk(tree):
+        name = node.id if isinstance(node, ast.Name) else node.attr if isinstance(node, ast.Attribute) else None
+        if name in IMPURE_NAMES:
+            return False
+    return True
+
+
+class _Memo:
+    __slots__ = ("handle", "explanation", "styled")
+
+    def __init__(self, handle, explanation=None, styled=False):
+        self.handle = handle        # 结果 DataFrame 在仓库中的句柄
+        self.explanation = explanation
+        self.styled = styled
+
+
+class StepMemo:
+    def __init__(self, max_entries=STEP_MEMO_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (代码指纹, 数据版本) -> _Memo，队首最久未用
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        with self._lock:
+            memo = self._entries.get(key)
+            if memo is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return memo
+
+    def remember(self, key, memo):
+        with self._lock:
+            self._entries[key] = memo
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)  # 句柄随之回收，仓库引用计数减一
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+_MEMO = None
+_MEMO_LOCK = threading.Lock()
+
+
+def get_step_memo():
+    """进程级单例：所有 Streamlit 会话共用"""
+    global _MEMO
+    with _MEMO_LOCK:
+        if _MEMO is None:
+            _MEMO = StepMemo()
+        return _MEMO
+
+
+def run_step_memoized(code, df, version=None):
+    """
+    与 run_in_sandbox 相同，但 (代码, 数据版本) 已成功执行过时直接返回记下的结果。
+    version 为 df 的数据版本 (已有句柄时传 handle.key，省一次哈希)。返回 (StepResult, 是否命中)。
+    结果可能随时间 / 外部数据变化的代码 (见 is_deterministic) 每次都执行。
+    """
+    if not is_deterministic(code):
+        return run_in_sandbox(code, df), False
+    store = get_data_store()
+    key = (code_hash(code), version or store.version(df))
+    memo_table = get_step_memo()
+    memo = memo_table.lookup(key)
+    if memo is not None:
+        get_recorder().add("结果复用", 0.0, hit=True)
+        return StepResult(memo.handle.get(), memo.explanation, memo.styled), True
+
+    step = run_in_sandbox(code, df)
+    if isinstance(step.value, pd.DataFrame):
+        memo_table.remember(key, _Memo(store.put(step.value), step.explanation, step.styled))
+    return step, False
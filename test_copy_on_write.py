@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import sandbox_pool
+from data_store import DataStore, switch_sheet
+
+# 切换工作表 / 备份 / 执行一步时的 DataFrame.copy 调用次数：
+# 全部走句柄 + 写时复制，不应出现整表深拷贝；进程内执行只做一次 O(1) 的浅拷贝。
+
+STEP_CODE = """
+def process_step(df):
+    df["a"] = df["a"] * 2
+    return df
+"""
+
+
+@pytest.fixture
+def copies(monkeypatch):
+    """统计 DataFrame.copy 调用：返回 deep 参数列表"""
+    calls = []
+    original = pd.DataFrame.copy
+
+    def counting_copy(self, deep=True):
+        calls.append(deep)
+        return original(self, deep=deep)
+
+    monkeypatch.setattr(pd.DataFrame, "copy", counting_copy)
+    return calls
+
+
+@pytest.fixture
+def store(tmp_path):
+    return DataStore(memory_mb=1024, spill_dir=str(tmp_path))
+
+
+def _sheets():
+    rng = np.random.default_rng(0)
+    return {name: pd.DataFrame(rng.random((1000, 8)), columns=list("abcdefgh")) for name in ("Sheet1", "Sheet2")}
+
+
+def test_sheet_switch_makes_no_copies(store, copies):
+    all_sheets = store.put_sheets(_sheets())
+    current_name, current_df = "Sheet1", all_sheets["Sheet1"].get()
+    for name in ["Sheet2", "Sheet1"] * 5:
+        current_df = switch_sheet(store, all_sheets, current_name, current_df, name)
+        current_name = name
+    assert copies == []
+    assert current_df is all_sheets["Sheet1"].get()
+
+
+def test_sheet_switch_keeps_progress(store, copies):
+    all_sheets = store.put_sheets(_sheets())
+    edited = all_sheets["Sheet1"].get().assign(a=0.0)  # 在 Sheet1 上执行过一步
+    switch_sheet(store, all_sheets, "Sheet1", edited, "Sheet2")
+    assert all_sheets["Sheet1"].get() is edited
+    switch_sheet(store, all_sheets, "Sheet2", edited, "Sheet1", keep=False)
+    assert all_sheets["Sheet2"].get() is not edited
+    assert not any(copies)  # 没有深拷贝
+
+
+def test_in_process_step_copies_only_changed_columns(store, copies, monkeypatch):
+    monkeypatch.setattr(sandbox_pool, "SANDBOX_ENABLED", False)
+    df = _sheets()["Sheet1"]
+    backup = store.put(df)  # 撤销备份只存句柄
+    before = df["a"].to_numpy().copy()
+
+    step = sandbox_pool.run_in_sandbox(STEP_CODE, df)
+
+    assert copies == [False]  # 只有 lazy_copy 的一次浅拷贝
+    np.testing.assert_array_equal(df["a"].to_numpy(), before)  # 输入未被修改
+    assert backup.get() is df
+    assert np.shares_memory(step.value["b"].to_numpy(), df["b"].to_numpy())  # 未改动的列共享内存
+    assert not np.shares_memory(step.value["a"].to_numpy(), df["a"].to_numpy())
+
+
+def test_sandbox_step_makes_no_copies_in_parent(copies):
+    pool = sandbox_pool.SandboxPool(workers=1)
+    try:
+        df = _sheets()["Sheet1"]
+        step = pool.run(STEP_CODE, df)
+    finally:
+        pool.shutdown()
+    assert copies == []
+    np.testing.assert_array_equal(step.value["a"].to_numpy(), df["a"].to_numpy() * 2)
+    step.value.loc[0, "a"] = 0.0  # 取回的结果可写，可直接作为下一步的输入
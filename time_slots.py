@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+# ================= 时段索引 (96 / 48 / 24 点) =================
+# 一次性预先生成"标签 -> 编码"查找表，覆盖所有常见写法：
+#   "0:15" / "00:15" / "00:15:00" / "24:00" / "00:00-00:15" / "第1点" ...
+# 编码规则：时刻标签编码为当天的分钟数 (0–1440)，"第N点" 编码为 -N。
+# 整张表的行标签只需一次 Series.map 就能完成分类和排序，不再做字符串扫描和字符串排序。
+
+LOOKUP_STEP = 5         # 查找表的最小粒度 (分钟)，覆盖到 288 点
+MAX_POINTS = 288
+DAY_MINUTES = 1440
+
+
+def _clock_variants(minute):
+    h, m = divmod(minute, 60)
+    return (f"{h}:{m:02d}", f"{h:02d}:{m:02d}", f"{h}:{m:02d}:00", f"{h:02d}:{m:02d}:00")
+
+
+def _build_lookup():
+    lookup = {}
+    for minute in range(0, DAY_MINUTES + 1, LOOKUP_STEP):
+        for label in _clock_variants(minute):
+            lookup[label] = minute
+    # "00:00-00:15" 这类区间写法按区间结束时刻编码
+    for step in (5, 15, 30, 60):
+        for end in range(step, DAY_MINUTES + 1, step):
+            for a in _clock_variants(end - step)[:2]:
+                for b in _clock_variants(end)[:2]:
+                    for sep in ("-", "~", "—"):
+                        lookup[f"{a}{sep}{b}"] = end
+    for n in range(1, MAX_POINTS + 1):
+        lookup[f"第{n}点"] = -n
+        lookup[f"第{n:02d}点"] = -n
+    return lookup
+
+
+LABEL_CODES = _build_lookup()
+
+
+def label_codes(labels):
+    """一次 map 得到每个标签的编码 (float 数组)：分钟数 / -N (第N点) / NaN (非时段行)"""
+    values = pd.Series(np.asarray(labels, dtype=object))
+    kind = pd.api.types.infer_dtype(values, skipna=True)
+    if kind in ("datetime", "datetime64"):
+        return _datetime_codes(pd.to_datetime(values, errors="coerce"))
+    return values.astype(str).str.strip().map(LABEL_CODES).to_numpy(dtype=float)
+
+
+def spans_days(labels):
+    """
+    完整时间戳是否超出首日 24:00 (跨多天)。label_codes 只能把首日编码为时段，
+    跨多天的表必须由调用方整表另行处理 (如原样保留并提示)，否则首日以后的行会被当作非时段行丢掉。
+    """
+    values = pd.Series(np.asarray(labels, dtype=object))
+    if pd.api.types.infer_dtype(values, skipna=True) not in ("datetime", "datetime64"):
+        return False
+    ts = pd.to_datetime(values, errors="coerce")
+    return bool(((ts - ts.min().normalize()) > pd.Timedelta(minutes=DAY_MINUTES)).any())
+
+
+def _datetime_codes(ts):
+    # 完整时间戳：按相对首日零点的分钟数编码，次日 00:00 即 1440 (24:00)；首日以外为 NaN (见 spans_days)
+    origin = ts.min().normalize()
+    minutes = ((ts - origin).dt.total_seconds() / 60).to_numpy(dtype=float, copy=True)
+    minutes[(minutes < 0) | (minutes > DAY_MINUTES)] = np.nan
+    return minutes
+
+
+def _is_end_convention(codes):
+    # 出现 24:00 或没有 00:00：时段结束时刻 (00:15 ... 24:00)
+    return DAY_MINUTES in codes or 0 not in codes
+
+
+def label_convention(labels):
+    """时刻标签的约定："end" (00:15 ... 24:00) 或 "start" (00:00 ... 23:45)，判断规则与 time_slots 相同"""
+    return "end" if _is_end_convention(label_codes(labels)) else "start"
+
+
+def time_slots(labels, points=96, convention=None):
+    """
+    把行标签映射为 0..points-1 的时段号，非时段行为 -1 (int16 数组)。
+    convention 为 None 时自动判断：时刻标签中出现 24:00 或没有 00:00 时按"时段结束时刻"解释
+    (00:15 -> 0, 24:00 -> 95)，否则按"时段开始时刻"解释 (00:00 -> 0, 23:45 -> 95)；
+    分块处理同一份数据时应显式传入 "end" / "start"，避免各块判断不一致。
+    只有在没有任何时刻标签时才使用"第N点"标签 (第1点 -> 0)。
+    """
+    codes = label_codes(labels)
+    slots = np.full(len(codes), -1, dtype=np.int16)
+    clock = codes >= 0
+    if clock.any():
+        step = DAY_MINUTES // points
+        minutes = codes[clock]
+        aligned = minutes % step == 0
+        valid = minutes[aligned]
+        if convention is None:
+            end_convention = _is_end_convention(valid)
+        else:
+            end_convention = convention == "end"
+        slot = (minutes // step - (1 if end_convention else 0)).astype(np.int16)
+        slot[~aligned | (slot < 0) | (slot >= points)] = -1
+        slots[clock] = slot
+    else:
+        point = codes < 0
+        n = -codes[point]
+        slots[point] = np.where(n <= points, n - 1, -1).astype(np.int16)
+    return slots
+
+
+def slot_labels(points=96, convention="end"):
+    """标准时段标签；convention="end" 为 00:15 ... 24:00，"start" 为 00:00 ... 23:45"""
+    step = DAY_MINUTES // points
+    offset = step if convention == "end" else 0
+    return [f"{m // 60:02d}:{m % 60:02d}" for m in range(offset, offset + DAY_MINUTES, step)]
+
+
+def order_by_slot(df, points=96):
+    """
+    取出 df 中的时段行并按时段号排序，返回 (DataFrame, 时段号数组)；
+    返回的 DataFrame 保留原始行标签，slots 与之逐行对应。
+    """
+    slots = time_slots(df.index, points)
+    rows = np.flatnonzero(slots >= 0)
+    order = rows[np.argsort(slots[rows], kind="stable")]
+    return df.iloc[order], slots[order]
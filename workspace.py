@@ -0,0 +1,334 @@
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from data_store import DataHandle, ensure_private_dir, get_data_store
+from perf_monitor import perf_stage
+
+# ================= 工作区检查点 (重启 / 断线重连后快速恢复) =================
+# Streamlit 重启或浏览器重连会清空 session_state，用户只能重新上传、重新跑一遍 AI 步骤。
+# 这里把工作区 (各工作表、撤销 / 重做栈、对话记录、技能库等) 持续写到本地目录：
+# - 数据按版本 (DataStore 内容指纹) 存成 Parquet，多个检查点 / 多个工作区共用同一份文件，只写新出现的版本；
+# - 其余状态写成 JSON 清单，DataFrame 位置只记版本号；状态没变时不写，写盘在后台线程进行，不阻塞页面；
+# - 工作区编号放在 URL (?ws=...) 里，新会话打开同一链接时按清单恢复：数据只登记为"已落盘"的句柄，
+#   用到哪张表才内存映射读入哪张，不重新解析 Excel，也不重跑 AI 步骤。
+# 超过 WORKSPACE_KEEP_DAYS 未更新的工作区及不再被引用的数据文件定期清理。
+# 目录只对当前用户开放 (0700)，清单是纯 JSON (列名也按 JSON 编码)，读回时不会执行任何代码；
+# 侧边栏只列出本浏览器会话里用过的工作区，别人的工作区只能凭 URL 中的随机编号打开。
+
+WORKSPACE_DIR = os.environ.get("WORKSPACE_DIR") or os.path.join(tempfile.gettempdir(), "energy_workspaces")
+WORKSPACE_KEEP_DAYS = float(os.environ.get("WORKSPACE_KEEP_DAYS", "7"))
+WORKSPACE_PARAM = "ws"   # URL 查询参数名
+PRUNE_INTERVAL = 3600    # 清理过期检查点的间隔 (秒)
+
+_FRAME = "__frame__"     # 清单中 DataFrame / 句柄的占位标记
+
+
+def _data_dir():
+    return os.path.join(WORKSPACE_DIR, "data")
+
+
+def _manifest_path(app, workspace_id):
+    return os.path.join(WORKSPACE_DIR, app, f"{workspace_id}.json")
+
+
+def _frame_path(key):
+    return os.path.join(_data_dir(), f"{key}.parquet")
+
+
+def _replace_atomic(path, write):
+    """先写临时文件再改名，进程中途退出也不会留下半个文件"""
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        result = write(tmp)
+        os.replace(tmp, path)
+        return result
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+# ---------- 状态 <-> 清单 ----------
+
+def _encode(value, handles):
+    """把会话状态转成可写 JSON 的结构；DataFrame / 句柄换成 {__frame__: 版本}，句柄收集到 handles"""
+    if isinstance(value, (DataHandle, pd.DataFrame)):
+        handle = value if isinstance(value, DataHandle) else get_data_store().put(value)
+        handles[handle.key] = handle
+        return {_FRAME: handle.key, "handle": isinstance(value, DataHandle)}
+    if isinstance(value, dict):
+        return {str(k): _encode(v, handles) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v, handles) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return None  # 其他对象 (图表、Styler 等) 不进检查点
+
+
+def _decode(value, frames):
+    """_encode 的逆过程：句柄位置登记为已落盘条目 (不读数据)，DataFrame 位置读入数据；缺失的数据文件记为 None"""
+    if isinstance(value, dict):
+        if _FRAME in value:
+            handle = frames.get(value[_FRAME])
+            if handle is None or value.get("handle"):
+                return handle
+            return handle.get()
+        return {k: _decode(v, frames) for k, v in value.items()}
+    if isinstance(value, list):
+        items = [_decode(v, frames) for v in value]
+        # 撤销栈等列表里缺失的版本直接去掉，避免之后对 None 调用 .get()
+        return [v for v, raw in zip(items, value) if v is not None or not (isinstance(raw, dict) and _FRAME in raw)]
+    return value
+
+
+def _label_to_json(label):
+    """列名 -> JSON：字符串原样保存，其余类型带上标记以便还原 (日期表头、数字列名、多层列名)"""
+    if isinstance(label, str):
+        return label
+    if isinstance(label, tuple):
+        return {"tuple": [_label_to_json(v) for v in label]}
+    if isinstance(label, (bool, np.bool_)):
+        return {"bool": bool(label)}
+    if isinstance(label, (int, np.integer)):
+        return {"int": int(label)}
+    if isinstance(label, (float, np.floating)):
+        return None if np.isnan(label) else {"float": float(label)}
+    if isinstance(label, (datetime.datetime, datetime.date)):
+        return {"time": label.isoformat()}
+    return None if label is None else str(label)
+
+
+def _label_from_json(value):
+    if isinstance(value, dict):
+        if "tuple" in value:
+            return tuple(_label_from_json(v) for v in value["tuple"])
+        if "time" in value:
+            return pd.Timestamp(value["time"])
+        return next(iter(value.values()))  # bool / int / float
+    return value
+
+
+def labels_to_json(labels):
+    multi = isinstance(labels, pd.MultiIndex)
+    return {"values": [_label_to_json(v) for v in labels], "multi": multi,
+            "names": [n if isinstance(n, str) else None for n in labels.names]}
+
+
+def labels_from_json(meta):
+    values = [_label_from_json(v) for v in meta["values"]]
+    if meta.get("multi"):
+        return pd.MultiIndex.from_tuples(values, names=meta.get("names"))
+    return pd.Index(values, name=(meta.get("names") or [None])[0], tupleize_cols=False)
+
+
+def _frame_meta(handle, columns):
+    return {
+        "shape": list(handle.shape),
+        "nbytes": handle.nbytes(),
+        "labels": labels_to_json(handle.columns()),
+        "renamed": columns is not None,  # 文件里是占位列名 c0, c1, ...
+    }
+
+
+# ---------- 后台写盘 ----------
+
+_WRITER = None
+_WRITER_LOCK = threading.Lock()
+_LAST_PRUNE = 0.0
+
+
+def _get_writer():
+    """进程级单例：单个后台线程顺序写检查点 (同一数据文件不会被并发写两次)"""
+    global _WRITER
+    with _WRITER_LOCK:
+        if _WRITER is None:
+            _WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="workspace-writer")
+        return _WRITER
+
+
+def _write_checkpoint(app, workspace_id, state, handles, summary):
+    global _LAST_PRUNE
+    store = get_data_store()
+    ensure_private_dir(WORKSPACE_DIR)
+    os.makedirs(_data_dir(), mode=0o700, exist_ok=True)
+    os.makedirs(os.path.join(WORKSPACE_DIR, app), mode=0o700, exist_ok=True)
+    frames = {}
+    for key, handle in handles.items():
+        path = _frame_path(key)
+        meta_path = path + ".json"
+        if os.path.exists(path) and os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                frames[key] = json.load(f)
+            os.utime(path)  # 仍被引用，刷新时间避免被清理
+            os.utime(meta_path)
+            continue
+        try:
+            columns = _replace_atomic(path, lambda tmp: store.save_copy(key, tmp))
+        except Exception:
+            continue  # Arrow 无法表示的数据 (混合类型 object 等) 只能放弃，恢复时该版本缺失
+        frames[key] = _frame_meta(handle, columns)
+        _replace_atomic(meta_path, lambda tmp: _dump_json(frames[key], tmp))
+    manifest = {"app": app, "saved_at": time.time(), "summary": summary, "frames": frames, "state": state}
+    _replace_atomic(_manifest_path(app, workspace_id), lambda tmp: _dump_json(manifest, tmp))
+    if time.time() - _LAST_PRUNE > PRUNE_INTERVAL:
+        _LAST_PRUNE = time.time()
+        prune_workspaces()
+
+
+def _dump_json(obj, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+
+
+def prune_workspaces(keep_days=WORKSPACE_KEEP_DAYS):
+    """删除超过 keep_days 未更新的工作区清单，以及不再被任何清单引用的数据文件"""
+    cutoff = time.time() - keep_days * 86400
+    referenced = set()
+    for app in os.listdir(WORKSPACE_DIR) if os.path.isdir(WORKSPACE_DIR) else []:
+        folder = os.path.join(WORKSPACE_DIR, app)
+        if app == "data" or not os.path.isdir(folder):
+            continue
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if not name.endswith(".json"):
+                continue
+            if os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    referenced.update(json.load(f)["frames"])
+            except (OSError, ValueError, KeyError):
+                continue
+    if os.path.isdir(_data_dir()):
+        for name in os.listdir(_data_dir()):
+            key = name.split(".")[0]
+            path = os.path.join(_data_dir(), name)
+            if key not in referenced and os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+
+
+# ---------- 对外接口 ----------
+
+def _query_workspace_id():
+    import streamlit as st
+
+    value = st.query_params.get(WORKSPACE_PARAM)
+    return value if isinstance(value, str) and value.isalnum() else None
+
+
+def load_manifest(app, workspace_id):
+    try:
+        with open(_manifest_path(app, workspace_id), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def restore_workspace(app):
+    """
+    每次脚本运行开头 (初始化 session_state 默认值之前) 调用：URL 中的工作区编号与当前会话不同
+    (新会话 / 断线重连 / 在面板中切换工作区) 且存在检查点时，按清单恢复会话状态。返回是否恢复。
+    """
+    import streamlit as st
+
+    workspace_id = _query_workspace_id()
+    if workspace_id is None or st.session_state.get("workspace_id") == workspace_id:
+        return False
+    _remember_workspace(workspace_id)
+    try:
+        ensure_private_dir(WORKSPACE_DIR)
+    except PermissionError:
+        return False
+    manifest = load_manifest(app, workspace_id)
+    if manifest is None:
+        return False
+    store = get_data_store()
+    with perf_stage("恢复工作区", frames=len(manifest["frames"])):
+        frames = {}
+        for key, meta in manifest["frames"].items():
+            path = _frame_path(key)
+            if not os.path.exists(path):
+                continue
+            try:
+                labels = labels_from_json(meta["labels"])
+            except (KeyError, TypeError, ValueError):
+                continue  # 无法识别的清单条目按缺失处理
+            frames[key] = store.attach(key, path, meta["shape"], labels, meta["nbytes"], meta.get("renamed", False))
+        for name, value in manifest["state"].items():
+            st.session_state[name] = _decode(value, frames)
+    st.session_state.workspace_signature = _signature(manifest["state"])
+    return True
+
+
+def _signature(state):
+    return hashlib.blake2b(json.dumps(state, ensure_ascii=False, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def checkpoint_workspace(app, keys, summary=""):
+    """
+    把 session_state 中的 keys 写入当前工作区的检查点 (放在每次运行都会执行到的位置，如侧边栏末尾)。
+    内容没变时不写；写盘在后台线程完成，新数据版本才写 Parquet。
+    """
+    import streamlit as st
+
+    workspace_id = st.session_state.get("workspace_id") or _query_workspace_id()
+    if workspace_id is None:
+        workspace_id = uuid.uuid4().hex  # 编号即访问凭据，用完整的随机值
+        st.query_params[WORKSPACE_PARAM] = workspace_id
+    _remember_workspace(workspace_id)
+
+    handles = {}
+    state = {key: _encode(st.session_state.get(key), handles) for key in keys}
+    if not handles and "workspace_signature" not in st.session_state:
+        return  # 还没有数据，没有值得恢复的内容 (已保存过的工作区被清空时仍要写，避免恢复出旧数据)
+    signature = _signature(state)
+    if st.session_state.get("workspace_signature") == signature:
+        return
+    st.session_state.workspace_signature = signature
+    _get_writer().submit(_write_checkpoint, app, workspace_id, state, handles, summary)
+
+
+def _remember_workspace(workspace_id):
+    """当前会话的工作区编号；本浏览器会话用过的编号另记一份，供侧边栏切换"""
+    import streamlit as st
+
+    st.session_state.workspace_id = workspace_id
+    seen = st.session_state.setdefault("workspace_ids", [])
+    if workspace_id not in seen:
+        seen.append(workspace_id)
+
+
+def list_workspaces(app, workspace_ids):
+    """给定编号中已有检查点的工作区，按保存时间倒序：[(编号, 保存时间, 摘要)]"""
+    result = []
+    for workspace_id in workspace_ids:
+        manifest = load_manifest(app, workspace_id)
+        if manifest is not None:
+            result.append((workspace_id, manifest["saved_at"], manifest.get("summary", "")))
+    return sorted(result, key=lambda item: item[1], reverse=True)
+
+
+def render_workspace_panel(app):
+    """侧边栏：当前工作区编号与本浏览器会话用过的其他工作区，点击即切换 (通过 URL 参数，下一次运行时恢复)"""
+    import streamlit as st
+
+    with st.expander("💾 工作区检查点"):
+        current = st.session_state.get("workspace_id")
+        st.caption(f"当前工作区: `{current}` (状态自动保存；重启或断线后打开同一链接即可恢复，请勿把链接发给他人)")
+        for workspace_id, saved_at, summary in list_workspaces(app, st.session_state.get("workspace_ids", [])):
+            if workspace_id == current:
+                continue
+            label = f"{time.strftime('%m-%d %H:%M', time.localtime(saved_at))} {summary}"
+            if st.button(f"↩️ {label}", key=f"ws_{workspace_id}", use_container_width=True):
+                st.query_params[WORKSPACE_PARAM] = workspace_id
+                st.rerun()